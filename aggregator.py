@@ -0,0 +1,55 @@
+def eccuExactKey(e):
+	"""Grouping key of ECCU events that share the same request name, start/end times and requestor.
+	:param e: an ECCU event
+	:type e: an EccuEvent object
+	:returns: a tuple
+	"""
+	return (e.getRequestName(), e.getEventStartTime(), e.getEventEndTime(), e.getRequestor())
+
+
+def eccuTimeWindowKey(window):
+	"""Return a grouping key function for ECCU events that share the same request name and
+	requestor, and that were requested within the same time window.
+	:param window: the time window duration in seconds
+	:type window: an int
+	:returns: a function taking an EccuEvent object and returning a tuple
+	"""
+	def key(e):
+		return (e.getRequestName(), e.getRequestor(), int(e.getEventStartTime()) // window)
+	return key
+
+
+def aggregateEvents(events, key = eccuExactKey):
+	"""Aggregate ECCU events in a single pass: the events are grouped by key, and each group
+	is merged into its first event. The property names of the group are concatenated, the
+	start/end times are extended to cover all the events of the group, and the events of the
+	group are kept on the first event (see EccuEvent.getEvents).
+	:param events: the events to be aggregated
+	:type events: an iterable of EccuEvent objects
+	:param key: a function returning the grouping key of an event (see eccuExactKey and eccuTimeWindowKey)
+	:type key: a callable
+	:returns: a List of (event, number of events merged) tuples, in the order of the first event of each group
+	"""
+	groups = {}
+	for e in events:
+		k = key(e)
+		group = groups.get(k)
+		if group is None:
+			groups[k] = [ [ e ], e.getEventStartTime(), e.getEventEndTime() ]
+			continue
+		group[0].append(e)
+		if int(e.getEventStartTime()) < int(group[1]):
+			group[1] = e.getEventStartTime()
+		if e.getEventEndTime() is not None and (group[2] is None or int(e.getEventEndTime()) > int(group[2])):
+			group[2] = e.getEventEndTime()
+
+	result = []
+	for merged, start, end in groups.values():
+		first = merged[0]
+		if len(merged) > 1:
+			first.setPropertyName(', '.join([ e.getPropertyName() for e in merged ]))
+			first.setEventStartTime(start)
+			first.setEventEndTime(end)
+			first.setMergedEvents(merged)
+		result.append((first, len(merged)))
+	return result
@@ -0,0 +1,125 @@
+import copy
+import json
+import queue
+import logging
+import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from metrics import LOG_RECORDS_DROPPED
+
+
+# Format of the log lines (text format)
+DEFAULT_LOG_FORMAT = '%(asctime)-12s [%(levelname)s] %(message)s'
+
+# Maximum size in bytes of a log file and number of rotated files kept
+DEFAULT_LOG_MAX_BYTES = 10*1024*1024
+DEFAULT_LOG_BACKUP_COUNT = 10
+
+# Maximum number of records waiting to be written, records below WARNING are dropped beyond
+DEFAULT_LOG_QUEUE_SIZE = 10000
+
+# Maximum number of seconds a WARNING or more severe record waits for room in a full queue
+# before it is dropped (only if the listener thread is stuck)
+DEFAULT_LOG_BLOCK_TIMEOUT = 5.0
+
+
+class JsonFormatter(logging.Formatter):
+	"""
+	Format the log records as JSON lines: time (ISO 8601, UTC), level, thread, message
+	and the exception traceback if any.
+	"""
+
+	def format(self, record):
+		line = {
+			'time': datetime.datetime.utcfromtimestamp(record.created).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+			'level': record.levelname,
+			'thread': record.threadName,
+			'message': record.getMessage()
+		}
+		if record.exc_info and not record.exc_text:
+			record.exc_text = self.formatException(record.exc_info)
+		if record.exc_text:
+			line['exception'] = record.exc_text
+		return json.dumps(line)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+	"""
+	Queue the log records without waiting: when the queue is full, DEBUG and INFO records
+	are dropped and counted instead of blocking the fetch or publish workers. WARNING and
+	more severe records wait for room in the queue, so that errors are never lost.
+	Messages are formatted by the listener thread, so the arguments of a log call must not
+	be modified after the call (pass strings and numbers).
+	"""
+
+	def __init__(self, queue, blockTimeout = DEFAULT_LOG_BLOCK_TIMEOUT):
+		"""
+		:param queue: the queue read by the listener
+		:param blockTimeout: maximum number of seconds a WARNING or more severe record waits in a full queue
+		:type blockTimeout: a float
+		"""
+		QueueHandler.__init__(self, queue)
+		self.blockTimeout = blockTimeout
+
+	def enqueue(self, record):
+		try:
+			if record.levelno >= logging.WARNING:
+				self.queue.put(record, timeout = self.blockTimeout)
+			else:
+				self.queue.put_nowait(record)
+		except queue.Full:
+			LOG_RECORDS_DROPPED.inc(level = record.levelname)
+
+	def prepare(self, record):
+		# Unlike QueueHandler, leave msg and args as is (lazy formatting) but keep the traceback
+		# as text since the frames of the exception may be gone when the record is written
+		if record.exc_info:
+			record = copy.copy(record)
+			record.exc_text = logging.Formatter().formatException(record.exc_info)
+			record.exc_info = None
+		return record
+
+
+class AsyncLog:
+	"""
+	Log to a rotating file from a background thread (QueueListener): logging calls only
+	queue the records, the formatting, file writes and rotations never block the caller.
+	"""
+
+	def __init__(self, logger, filename, maxBytes = DEFAULT_LOG_MAX_BYTES, backupCount = DEFAULT_LOG_BACKUP_COUNT, queueSize = DEFAULT_LOG_QUEUE_SIZE):
+		"""
+		:param logger: the logger to attach the queue to
+		:param filename: the path and file name of the log file
+		:type filename: a String object
+		:param queueSize: the maximum number of records waiting to be written
+		:type queueSize: an int
+		"""
+		self.logger = logger
+		self.fileHandler = RotatingFileHandler(filename, maxBytes = maxBytes, backupCount = backupCount)
+		self.fileHandler.setFormatter(logging.Formatter(DEFAULT_LOG_FORMAT))
+		self.queue = queue.Queue(queueSize)
+		self.queueHandler = NonBlockingQueueHandler(self.queue)
+		self.listener = QueueListener(self.queue, self.fileHandler)
+		self.listener.start()
+		logger.addHandler(self.queueHandler)
+
+	def setLevel(self, level):
+		"""Set the level of the logger: records below it are not even created.
+		:param level: the level name (DEBUG, INFO, WARNING, ERROR or CRITICAL)
+		:type level: a String object
+		"""
+		levelNumber = logging.getLevelName(level.upper())
+		if not isinstance(levelNumber, int):
+			raise ValueError('unknown log level ' + level)
+		self.logger.setLevel(levelNumber)
+
+	def setJson(self, enabled = True):
+		"""Write JSON lines (see JsonFormatter) instead of text lines.
+		"""
+		self.fileHandler.setFormatter(JsonFormatter() if enabled else logging.Formatter(DEFAULT_LOG_FORMAT))
+
+	def close(self):
+		"""Write the records still queued and close the log file.
+		"""
+		self.logger.removeHandler(self.queueHandler)
+		self.listener.stop()
+		self.fileHandler.close()
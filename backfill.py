@@ -0,0 +1,106 @@
+import os
+import json
+import threading
+
+from eventtime import toEpochSeconds, fromEpochSeconds
+
+
+# Default duration in seconds of each backfill time slice
+DEFAULT_SLICE_DURATION = 3600
+
+# Name of the work item covering ECCU requests (ECCU API cannot be queried by time slice)
+ECCU_WORK_ITEM = 'eccu'
+
+
+class BackfillPlan:
+	"""
+	The resumable work plan of a backfill: the time range is split into time slices,
+	and each slice is marked as done once all its events have been published.
+	The plan is saved to disk after each change, so an interrupted backfill started
+	again with the same range only processes the slices that are not done yet.
+	"""
+
+	def __init__(self, filename, start, end, sliceDuration = DEFAULT_SLICE_DURATION):
+		"""
+		:param filename: the plan path and file name (created if needed)
+		:type filename: a String object
+		:param start: start date of the backfill (e.g. 2018-12-13T15:00:00)
+		:type start: a String object
+		:param end: end date of the backfill (e.g. 2018-12-14T15:00:00)
+		:type end: a String object
+		:param sliceDuration: duration in seconds of each time slice
+		:type sliceDuration: an int
+		"""
+		self.filename = filename
+		self.lock = threading.Lock()
+		self.plan = None
+		if os.path.isfile(filename):
+			with open(filename, mode='r') as infile:
+				plan = json.load(infile)
+			# A plan is only resumed for the same time range
+			if plan['from'] == start and plan['to'] == end:
+				self.plan = plan
+		if self.plan is None:
+			self.plan = { 'from': start, 'to': end, 'sliceDuration': sliceDuration, 'slices': self._split(start, end, sliceDuration), 'done': [] }
+			self.save()
+
+	def _split(self, start, end, sliceDuration):
+		slices = []
+		startTS = toEpochSeconds(start)
+		endTS = toEpochSeconds(end)
+		while startTS < endTS:
+			sliceEnd = min(endTS, startTS + sliceDuration)
+			slices.append([ fromEpochSeconds(startTS), fromEpochSeconds(sliceEnd) ])
+			startTS = sliceEnd
+		return slices
+
+	def isResumed(self):
+		"""Return True if some work items were already done by a previous run.
+		"""
+		return len(self.plan['done']) > 0
+
+	def getPendingSlices(self):
+		"""Return the time slices not done yet.
+		:returns: a List of (start, end) String objects
+		"""
+		with self.lock:
+			done = set(self.plan['done'])
+			return [ (s, e) for s, e in self.plan['slices'] if s not in done ]
+
+	def isDone(self, item):
+		"""Return True if a work item is done.
+		:param item: the start date of a time slice, or ECCU_WORK_ITEM
+		:type item: a String object
+		"""
+		with self.lock:
+			return item in self.plan['done']
+
+	def markDone(self, item):
+		"""Mark a work item as done and save the plan.
+		:param item: the start date of a time slice, or ECCU_WORK_ITEM
+		:type item: a String object
+		"""
+		with self.lock:
+			if item not in self.plan['done']:
+				self.plan['done'].append(item)
+				self._save()
+
+	def getProgress(self):
+		"""Return the number of work items done and the total number of work items (slices and ECCU).
+		"""
+		with self.lock:
+			return len(self.plan['done']), len(self.plan['slices']) + 1
+
+	def save(self):
+		with self.lock:
+			self._save()
+
+	def _save(self):
+		# The plan is replaced atomically so that a crash never leaves a truncated plan
+		directory = os.path.dirname(self.filename)
+		if directory and not os.path.isdir(directory):
+			os.makedirs(directory)
+		tmpFile = self.filename + '.tmp'
+		with open(tmpFile, mode='w') as outfile:
+			json.dump(self.plan, outfile, indent = 1)
+		os.replace(tmpFile, self.filename)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Measure the memory used by parsed EventViewer events kept alive at the same time
+(e.g. during a backfill), once the raw JSON pages have been released.
+The slotted Event classes are compared with a replica of the former layout
+(per-object __dict__, per-object tags list, decoded eventData fields).
+
+Usage: python benchmarks/bench_event_memory.py [number of events]
+"""
+
+import os
+import sys
+import json
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from event import FastPurgeCPCodeEvent
+
+
+class LegacyFastPurgeEvent:
+	"""Replica of the former FastPurgeCPCodeEvent attributes layout.
+	"""
+
+	def __init__(self):
+		self.eventId = None
+		self.tags = []
+		self.tags.append("Akamai")
+		self.tags.append("FastPurgeCPC")
+
+	def parseJson(self, json):
+		self.eventId = json['eventId']
+		self.eventTime = json['eventTime']
+		self.eventTypeId = json['eventType']['eventTypeId']
+		self.eventTypeName = json['eventType']['eventTypeName']
+		self.eventDefinitionId = json['eventType']['eventDefinition']['eventDefinitionId']
+		self.eventName = json['eventType']['eventDefinition']['eventName']
+		self.username = json['username']
+		self.impersonator = json['impersonator']
+		self.eventData = json['eventData']
+		for kv in self.eventData:
+			if kv['key'] == 'Purge action':
+				self.purgeAction = kv['value']
+			if kv['key'] == 'Purge network':
+				self.purgeNetwork = kv['value']
+			if kv['key'] == 'Purge request':
+				self.purgeRequest = kv['value']
+			if kv['key'] == 'Purge response':
+				self.purgeResponse = kv['value']
+
+
+def generatePage(count):
+	"""Generate the JSON text of an EventViewer page with purge events.
+	"""
+	events = []
+	for i in range(count):
+		events.append({
+			'eventId': '%08x-0000-0000-0000-%012x' % (random.getrandbits(32), i),
+			'eventTime': '2019-01-10T09:%02d:%02d.%03dZ' % (random.randint(0, 59), random.randint(0, 59), random.randint(0, 999)),
+			'eventData': [
+				{ 'key': 'Purge action', 'value': 'invalidate' },
+				{ 'key': 'Purge network', 'value': 'production' },
+				{ 'key': 'Purge request', 'value': 'fi-api.ccu.akadns.net. Objects to Purge - https://www.customerdomain.com/%d/' % i },
+				{ 'key': 'Purge response', 'value': '{"httpStatus":201,"detail":"Request accepted","estimatedSeconds":5,"purgeId":"%d"}' % i },
+			],
+			'eventType': { 'eventTypeId': '229', 'eventTypeName': 'Fast Purge',
+				'eventDefinition': { 'eventDefinitionId': '229233', 'eventName': 'Purge request' } },
+			'impersonator': None,
+			'username': 'user%d@customerdomain.com' % random.randint(0, 9),
+		})
+	return json.dumps({ 'events': events })
+
+
+def measure(name, eventClass, page):
+	"""Parse a page, release the raw JSON and return the memory used by the events.
+	"""
+	tracemalloc.start()
+	data = json.loads(page)
+	events = []
+	for raw in data['events']:
+		e = eventClass()
+		e.parseJson(raw)
+		events.append(e)
+	del data, raw
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	print('%-28s %8.1f bytes/event %10.1f MB total %10.1f MB peak' % (name, current / len(events), current / 1048576.0, peak / 1048576.0))
+	return current
+
+
+def main(argv):
+	count = int(argv[0]) if argv else 100000
+	random.seed(0)
+	page = generatePage(count)
+	legacy = measure('legacy __dict__ events', LegacyFastPurgeEvent, page)
+	slotted = measure('slotted events', FastPurgeCPCodeEvent, page)
+	print('%-28s %8.1f%%' % ('memory saved', 100.0 * (legacy - slotted) / legacy))
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
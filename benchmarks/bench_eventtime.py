@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Compare the per-event cost of timestamp conversion: the strptime/astimezone/strftime('%s')
+conversion formerly done by EventViewerEvent.parseJson against eventtime.toEpochSeconds.
+
+Usage: python benchmarks/bench_eventtime.py [number of events]
+"""
+
+import os
+import sys
+import time
+import random
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from eventtime import toEpochSeconds
+from timezones import LocalTimezone, UTCTimezone
+
+
+LocalTZ = LocalTimezone()
+UTCTZ = UTCTimezone()
+
+
+def legacyEventViewerTime(epoch_time):
+	dt = datetime.datetime.strptime(epoch_time, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=UTCTZ).astimezone(LocalTZ)
+	return str(int(dt.strftime("%s")) * 1000)
+
+
+def fastEventViewerTime(epoch_time):
+	return str(toEpochSeconds(epoch_time) * 1000)
+
+
+def legacyEccuTime(epoch_time):
+	date_time_obj = datetime.datetime.strptime(epoch_time, '%Y-%m-%dT%H:%M:%S.%f%z')
+	return str(int(date_time_obj.timestamp()))
+
+
+def fastEccuTime(epoch_time):
+	return str(toEpochSeconds(epoch_time))
+
+
+def generateDates(count, suffix):
+	"""Generate dates spread over one day, like the events of a 24h EventViewer window.
+	"""
+	start = int(time.time()) - 86400
+	dates = []
+	for i in range(count):
+		ts = start + random.randint(0, 86400)
+		dates.append(datetime.datetime.utcfromtimestamp(ts).strftime('%Y-%m-%dT%H:%M:%S') + '.%03d' % random.randint(0, 999) + suffix)
+	return dates
+
+
+def bench(name, function, dates):
+	startTime = time.perf_counter()
+	for d in dates:
+		function(d)
+	elapsed = time.perf_counter() - startTime
+	print('%-28s %10.3f us/event' % (name, elapsed * 1000000 / len(dates)))
+	return elapsed
+
+
+def main(argv):
+	count = int(argv[0]) if argv else 100000
+	random.seed(0)
+
+	dates = generateDates(count, 'Z')
+	for d in dates[:1000]:
+		assert legacyEventViewerTime(d) == fastEventViewerTime(d), d
+	legacy = bench('EventViewer strptime', legacyEventViewerTime, dates)
+	fast = bench('EventViewer toEpochSeconds', fastEventViewerTime, dates)
+	print('%-28s %10.1fx' % ('speedup', legacy / fast))
+
+	dates = generateDates(count, '+0000')
+	for d in dates[:1000]:
+		assert legacyEccuTime(d) == fastEccuTime(d), d
+	legacy = bench('ECCU strptime', legacyEccuTime, dates)
+	fast = bench('ECCU toEpochSeconds', fastEccuTime, dates)
+	print('%-28s %10.1fx' % ('speedup', legacy / fast))
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
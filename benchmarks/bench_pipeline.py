@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+"""
+Time each stage of the annotation pipeline on synthetic fixtures (see fixtures.py):
+JSON decode, parseJson, matchCriteria, parseEvents (prescreen, parse and match),
+streamParseEvents (streaming decode of a page and parseEvents, as done by the fetcher),
+ECCU parsing and aggregation, coalescing and annotation payload building.
+The throughput and peak memory of each stage are compared with the stored baselines,
+and the exit code is 1 when a stage regressed beyond the tolerance. Each size is timed
+several times (at least --repeat runs and --min-duration seconds) and the fastest run of
+each stage is kept, so that small sizes are not decided by a single noisy run; a size
+slower than its baseline is timed again before a regression is reported. Stages running
+for less than a few milliseconds are too short to be gated.
+A fixed calibration workload is timed between the runs and throughputs are compared
+relative to it: a machine slowed down as a whole (other processes, CPU frequency,
+noisy neighbours) slows the calibration as much as the stages and is not a regression.
+
+The fixtures are generated page by page, outside of the timed sections, so that even
+1M events do not have to be kept in memory. Network calls are not included (see the
+mock server to load test the fetchers and the dispatcher).
+
+Usage: python benchmarks/bench_pipeline.py [--sizes 1000,100000,1000000] [--page-size 500]
+	[--baseline benchmarks/baselines.json] [--save-baseline] [--tolerance 0.25] [--no-memory]
+	[--repeat 3] [--min-duration 2.0]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import getopt
+import logging
+import tempfile
+import importlib.util
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..'))
+
+import fixtures
+from mpulseapihandler import MPulseAPIHandler
+from coalescer import EventCoalescer
+from jsonstream import JsonArrayReader
+
+
+DEFAULT_SIZES = [ 1000, 100000 ]
+DEFAULT_BASELINE_FILE = os.path.join(BENCHMARKS_DIR, 'baselines.json')
+DEFAULT_TOLERANCE = 0.25
+
+# Number of times the calibration workload decodes its page and iterations of its Python loop
+CALIBRATION_DECODES = 5
+CALIBRATION_LOOPS = 20000
+
+# Minimum number of timed runs per size, and minimum cumulated duration in seconds of the runs:
+# small sizes are run many times, large sizes only --repeat times
+DEFAULT_REPEAT = 3
+DEFAULT_MIN_DURATION = 2.0
+
+# Stages running for less than this duration in seconds (e.g. ECCU stages at small sizes) are
+# within the timer and scheduler noise: their throughput is reported but not gated
+MIN_STAGE_SECONDS = 0.002
+
+# Number of times a size is timed again when a stage looks slower than its baseline: the regression
+# is only reported if the stage is still slower in the fastest of all the timings
+CONFIRMATIONS = 2
+
+# ECCU histories are much shorter than EventViewer: one ECCU request for 10 events
+ECCU_REQUESTS_RATIO = 10
+
+ECCU_AGGREGATION_WINDOW = 3600
+COALESCING_WINDOW = 60
+
+STAGES = ('decode', 'parseJson', 'matchCriteria', 'parseEvents', 'streamParseEvents', 'eccuDecode', 'parseEccuEvents', 'aggregateECCUEvents', 'coalesce', 'payload')
+
+
+def loadAnnotator(logger):
+	"""Import mpulse-annotator.py as a module (its file name is not a valid module name).
+	"""
+	spec = importlib.util.spec_from_file_location('annotator', os.path.join(BENCHMARKS_DIR, '..', 'mpulse-annotator.py'))
+	annotator = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(annotator)
+	annotator.l = logger
+	return annotator
+
+
+class Stage:
+	"""Cumulated duration, number of items and peak memory of a pipeline stage.
+	"""
+
+	def __init__(self, name):
+		self.name = name
+		self.seconds = 0.0
+		self.items = 0
+		self.peak = 0
+		# Duration of the calibration workload timed with the runs (see calibrate)
+		self.calibration = None
+
+	def run(self, memory, items, function, *args):
+		"""Call function(*args) and account its duration, or its peak memory if memory is True.
+		"""
+		if memory:
+			tracemalloc.reset_peak()
+			before = tracemalloc.get_traced_memory()[0]
+			result = function(*args)
+			self.peak = max(self.peak, tracemalloc.get_traced_memory()[1] - before)
+			return result
+		startTime = time.perf_counter()
+		result = function(*args)
+		self.seconds += time.perf_counter() - startTime
+		self.items += items
+		return result
+
+	def getThroughput(self):
+		return self.items / self.seconds if self.seconds > 0 else 0.0
+
+	def getRelativeThroughput(self):
+		"""Return the number of items processed in the duration of the calibration workload.
+		"""
+		return self.getThroughput() * self.calibration
+
+
+def calibrate(page):
+	"""Time a fixed workload, mixing JSON decoding and Python code as the stages do.
+	:param page: the JSON text of a fixture page
+	:returns: the duration in seconds
+	"""
+	startTime = time.perf_counter()
+	for i in range(CALIBRATION_DECODES):
+		json.loads(page)
+	total = 0
+	for i in range(CALIBRATION_LOOPS):
+		total += i * i
+	return time.perf_counter() - startTime
+
+
+def parseAll(eventsSelector, events):
+	parsed = []
+	for raw in events:
+		selector = eventsSelector.get(raw['eventType']['eventDefinition']['eventDefinitionId'])
+		if selector is not None:
+			e = selector[0]()
+			e.parseJson(raw)
+			parsed.append((e, selector[1]))
+	return parsed
+
+
+def matchAll(parsed):
+	return [ e for e, criteria in parsed if e.matchCriteria(criteria) ]
+
+
+def streamParseAll(annotator, eventsSelector, body):
+	return annotator.parseEvents(JsonArrayReader(io.BytesIO(body), 'events'), eventsSelector)
+
+
+def coalesceAll(logger, events):
+	coalescer = EventCoalescer(logger, lambda e: COALESCING_WINDOW)
+	return list(coalescer.coalesce(events))
+
+
+def buildPayloads(mpulse, events):
+	for e in events:
+		mpulse.addAnnotation('token', e.getAnnotationTitle(), e.getAnnotationText(), e.getEventStartTime(), e.getEventEndTime())
+
+
+def runStages(annotator, logger, eventsSelector, size, pageSize, memory):
+	"""Run all the stages on size events and return the Stage objects.
+	"""
+	stages = dict((name, Stage(name)) for name in STAGES)
+	mpulse = MPulseAPIHandler(logger, simulate = True)
+	selected = []
+	for page in fixtures.generateEventViewerPages(size, pageSize):
+		text = json.dumps(page)
+		del page
+		count = text.count('"eventId"')
+		data = stages['decode'].run(memory, count, json.loads, text)
+		parsed = stages['parseJson'].run(memory, count, parseAll, eventsSelector, data['events'])
+		stages['matchCriteria'].run(memory, len(parsed), matchAll, parsed)
+		selected += stages['parseEvents'].run(memory, count, annotator.parseEvents, data['events'], eventsSelector)
+		del data, parsed
+		body = text.encode('utf-8')
+		del text
+		stages['streamParseEvents'].run(memory, count, streamParseAll, annotator, eventsSelector, body)
+		del body
+
+	eccuCount = max(1, size // ECCU_REQUESTS_RATIO)
+	text = json.dumps(fixtures.generateEccuRequests(eccuCount))
+	data = stages['eccuDecode'].run(memory, eccuCount, json.loads, text)
+	del text
+	eccuEvents = stages['parseEccuEvents'].run(memory, eccuCount, annotator.parseEccuEvents, data['requests'], '0', eventsSelector)
+	del data
+	eccuEvents = stages['aggregateECCUEvents'].run(memory, len(eccuEvents), annotator.aggregateECCUEvents, eccuEvents, ECCU_AGGREGATION_WINDOW)
+
+	selected += eccuEvents
+	annotations = stages['coalesce'].run(memory, len(selected), coalesceAll, logger, selected)
+	stages['payload'].run(memory, len(annotations), buildPayloads, mpulse, annotations)
+	return stages
+
+
+def timeStages(annotator, logger, eventsSelector, size, pageSize, repeat, minDuration):
+	"""Run all the stages at least repeat times and for at least minDuration seconds, and keep the
+	fastest run of each stage (slower runs were disturbed by the garbage collector, other processes...).
+	The calibration workload is timed between the runs and its fastest duration is kept the same way.
+	:returns: the Stage objects and the number of runs
+	"""
+	page = json.dumps(next(fixtures.generateEventViewerPages(pageSize, pageSize, seed = 1)))
+	best = None
+	calibration = calibrate(page)
+	runs = 0
+	startTime = time.perf_counter()
+	while runs < repeat or time.perf_counter() - startTime < minDuration:
+		stages = runStages(annotator, logger, eventsSelector, size, pageSize, False)
+		calibration = min(calibration, calibrate(page))
+		runs += 1
+		if best is None:
+			best = stages
+			continue
+		for name in STAGES:
+			if stages[name].seconds < best[name].seconds:
+				best[name] = stages[name]
+	for stage in best.values():
+		stage.calibration = calibration
+	return best, runs
+
+
+def throughputRatio(stage, reference):
+	"""Return the throughput of a stage divided by the throughput of its baseline.
+	"""
+	# Baselines recorded before the calibration only hold the absolute throughput
+	if 'relative' in reference:
+		return stage.getRelativeThroughput() / reference['relative'] if reference['relative'] > 0 else 1.0
+	return stage.getThroughput() / reference['throughput'] if reference['throughput'] > 0 else 1.0
+
+
+def isGated(stage):
+	return stage.seconds >= MIN_STAGE_SECONDS
+
+
+def isSlower(stages, baseline, tolerance):
+	"""Return True if the throughput of a gated stage is below its baseline beyond the tolerance.
+	"""
+	return any(throughputRatio(stages[name], baseline[name]) < 1 - tolerance for name in STAGES if name in baseline and isGated(stages[name]))
+
+
+def compare(size, stages, baseline, tolerance):
+	"""Print the results of a size and return the number of regressions against the baseline.
+	"""
+	regressions = 0
+	print('  %-20s %10s %10s %14s %10s  %s' % ('stage', 'items', 'seconds', 'items/s', 'peak MB', 'baseline'))
+	for name in STAGES:
+		stage = stages[name]
+		throughput = stage.getThroughput()
+		status = ''
+		reference = baseline.get(name)
+		if reference is not None:
+			ratio = throughputRatio(stage, reference)
+			status = '%+.1f%%' % ((ratio - 1) * 100)
+			if not isGated(stage):
+				status += ' (too short)'
+			elif ratio < 1 - tolerance:
+				status += ' REGRESSION (throughput)'
+				regressions += 1
+			if reference.get('peak') and stage.peak > reference['peak'] * (1 + tolerance) and stage.peak - reference['peak'] > 1048576:
+				status += ' REGRESSION (memory)'
+				regressions += 1
+		print('  %-20s %10d %10.3f %14.0f %10.2f  %s' % (name, stage.items, stage.seconds, throughput, stage.peak / 1048576.0, status))
+	return regressions
+
+
+def main(argv):
+	sizes = DEFAULT_SIZES
+	pageSize = fixtures.DEFAULT_PAGE_SIZE
+	baselineFile = DEFAULT_BASELINE_FILE
+	saveBaseline = False
+	tolerance = DEFAULT_TOLERANCE
+	memory = True
+	repeat = DEFAULT_REPEAT
+	minDuration = DEFAULT_MIN_DURATION
+	try:
+		opts, args = getopt.getopt(argv, "h", ["sizes=", "page-size=", "baseline=", "save-baseline", "tolerance=", "no-memory", "repeat=", "min-duration="])
+	except getopt.GetoptError:
+		print(__doc__)
+		sys.exit(2)
+	for opt, arg in opts:
+		if opt == '-h':
+			print(__doc__)
+			sys.exit()
+		elif opt == '--sizes':
+			sizes = [ int(s) for s in arg.split(',') ]
+		elif opt == '--page-size':
+			pageSize = int(arg)
+		elif opt == '--baseline':
+			baselineFile = arg
+		elif opt == '--save-baseline':
+			saveBaseline = True
+		elif opt == '--tolerance':
+			tolerance = float(arg)
+		elif opt == '--no-memory':
+			memory = False
+		elif opt == '--repeat':
+			repeat = max(1, int(arg))
+		elif opt == '--min-duration':
+			minDuration = float(arg)
+
+	logger = logging.getLogger('benchmark')
+	logger.addHandler(logging.NullHandler())
+	logger.propagate = False
+	annotator = loadAnnotator(logger)
+	with tempfile.TemporaryDirectory() as directory:
+		selectorFile = os.path.join(directory, 'events-selector.csv')
+		fixtures.writeSelector(selectorFile)
+		eventsSelector = annotator.parseEventsSelector(selectorFile)
+
+	baselines = {}
+	if os.path.isfile(baselineFile):
+		with open(baselineFile, mode='r') as infile:
+			baselines = json.load(infile)
+
+	# Warm up the caches (hour cache, interned strings, selector matchers) before timing
+	runStages(annotator, logger, eventsSelector, min(sizes), pageSize, False)
+
+	regressions = 0
+	for size in sizes:
+		baseline = baselines.get(str(size), {})
+		stages, runs = timeStages(annotator, logger, eventsSelector, size, pageSize, repeat, minDuration)
+		for i in range(CONFIRMATIONS):
+			if saveBaseline or not isSlower(stages, baseline, tolerance):
+				break
+			again, moreRuns = timeStages(annotator, logger, eventsSelector, size, pageSize, repeat, minDuration)
+			runs += moreRuns
+			for name in STAGES:
+				if again[name].getRelativeThroughput() > stages[name].getRelativeThroughput():
+					stages[name] = again[name]
+		print('%d events (fastest of %d runs)' % (size, runs))
+		if memory:
+			tracemalloc.start()
+			memoryStages = runStages(annotator, logger, eventsSelector, size, pageSize, True)
+			tracemalloc.stop()
+			for name in STAGES:
+				stages[name].peak = memoryStages[name].peak
+		regressions += compare(size, stages, baseline, tolerance)
+		if saveBaseline:
+			baselines[str(size)] = dict((name, { 'throughput': round(stages[name].getThroughput(), 1), 'relative': round(stages[name].getRelativeThroughput(), 3),
+				'peak': stages[name].peak if memory else None }) for name in STAGES)
+
+	if saveBaseline:
+		with open(baselineFile, mode='w') as outfile:
+			json.dump(baselines, outfile, indent = 1, sort_keys = True)
+		print('baseline saved to ' + baselineFile)
+	if regressions > 0:
+		print('%d regression(s) found' % regressions)
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
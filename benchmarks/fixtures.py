@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""
+Synthetic EventViewer pages and ECCU request lists, in the schema returned by the APIs
+(see sample-event.json), for benchmarks and load tests. The fixtures are generated
+deterministically from a seed, and can be recorded to files.
+
+Usage: python benchmarks/fixtures.py <directory> [number of events] [page size]
+"""
+
+import os
+import sys
+import json
+import random
+import datetime
+
+
+# Event definitions generated, with their share of the events
+FASTPURGE_CPCODE_DEFINITION = '229233'
+FASTPURGE_URL_DEFINITION = '894488'
+PROPERTY_MANAGER_DEFINITION = '943951'
+OTHER_DEFINITION = '100001'
+DEFINITIONS = (
+	(FASTPURGE_CPCODE_DEFINITION, 0.3),
+	(FASTPURGE_URL_DEFINITION, 0.4),
+	(PROPERTY_MANAGER_DEFINITION, 0.1),
+	(OTHER_DEFINITION, 0.2),
+)
+
+# Events selector ID of ECCU requests (see EVENTS_SELECTOR_ECCU)
+ECCU_SELECTOR = '000001'
+
+# Values selected by the events selector: enough CP codes to use the Aho-Corasick matcher
+SELECTED_CPCODES = [ str(100000 + i * 7919) for i in range(20) ]
+SELECTED_HOSTS = [ 'www.customerdomain.com', 'static.customerdomain.com' ]
+SELECTED_PROPERTIES = [ 'www.customerdomain.com', 'api.customerdomain.com' ]
+
+# Default share of the events of a selected definition that match the criteria
+DEFAULT_MATCH_RATIO = 0.1
+
+# Default start time of the events (events are one second apart on average)
+DEFAULT_START = datetime.datetime(2019, 1, 10, 0, 0, 0)
+
+DEFAULT_PAGE_SIZE = 500
+
+NETWORKS = ('production', 'staging')
+USERNAMES = [ 'user%d@customerdomain.com' % i for i in range(10) ]
+
+
+def selectorRows():
+	"""Return the events selector rows matching the generated fixtures.
+	:returns: a List of rows (event definition ID, Event class name, criteria)
+	"""
+	return [
+		[ FASTPURGE_CPCODE_DEFINITION, 'FastPurgeCPCodeEvent', ';'.join(SELECTED_CPCODES) ],
+		[ FASTPURGE_URL_DEFINITION, 'FastPurgeUrlEvent', ';'.join(SELECTED_HOSTS) ],
+		[ PROPERTY_MANAGER_DEFINITION, 'PropertyManagerEvent', ';'.join(SELECTED_PROPERTIES) ],
+		[ ECCU_SELECTOR, 'EccuEvent', ';'.join(SELECTED_PROPERTIES) ],
+	]
+
+
+def writeSelector(filename):
+	"""Write the events selector file matching the generated fixtures.
+	"""
+	with open(filename, mode='w') as outfile:
+		outfile.write('# Events selector of the benchmark fixtures\n')
+		for row in selectorRows():
+			outfile.write(','.join(row) + '\n')
+
+
+def _formatTime(date):
+	return date.strftime('%Y-%m-%dT%H:%M:%S') + '.%03dZ' % (date.microsecond // 1000)
+
+
+def _eventData(rnd, definition, index, match):
+	if definition == FASTPURGE_CPCODE_DEFINITION:
+		cpcodes = [ str(rnd.randint(200000, 999999)) for i in range(rnd.randint(1, 3)) ]
+		if match:
+			cpcodes[0] = rnd.choice(SELECTED_CPCODES)
+		return [
+			{ 'key': 'Purge action', 'value': 'invalidate' },
+			{ 'key': 'Purge network', 'value': rnd.choice(NETWORKS) },
+			{ 'key': 'Purge request', 'value': 'fi-api.ccu.akadns.net. CP codes to Purge - ' + ', '.join(cpcodes) },
+			{ 'key': 'Purge response', 'value': '{"httpStatus":201,"detail":"Request accepted","estimatedSeconds":5,"purgeId":"%d"}' % index },
+		]
+	if definition == FASTPURGE_URL_DEFINITION:
+		host = rnd.choice(SELECTED_HOSTS) if match else 'www.otherdomain%d.com' % rnd.randint(0, 99)
+		urls = [ 'https://%s/%d/%d' % (host, index, i) for i in range(rnd.randint(1, 8)) ]
+		return [
+			{ 'key': 'Purge action', 'value': rnd.choice(('invalidate', 'remove')) },
+			{ 'key': 'Purge network', 'value': rnd.choice(NETWORKS) },
+			{ 'key': 'Purge request', 'value': 'fi-api.ccu.akadns.net. Objects to Purge - ' + ', '.join(urls) },
+			{ 'key': 'Purge response', 'value': '{"httpStatus":201,"detail":"Request accepted","estimatedSeconds":5,"purgeId":"%d"}' % index },
+		]
+	if definition == PROPERTY_MANAGER_DEFINITION:
+		name = rnd.choice(SELECTED_PROPERTIES) if match else 'property%d.otherdomain.com' % rnd.randint(0, 99)
+		return [
+			{ 'key': 'PROPERTY_NAME', 'value': name },
+			{ 'key': 'PROPERTY_VERSION', 'value': str(rnd.randint(1, 200)) },
+			{ 'key': 'USERNAME', 'value': rnd.choice(USERNAMES) },
+			{ 'key': 'NETWORK', 'value': rnd.choice(NETWORKS).upper() },
+		]
+	return [
+		{ 'key': 'IP address', 'value': '192.0.2.%d' % rnd.randint(1, 254) },
+		{ 'key': 'Result', 'value': 'success' },
+	]
+
+
+def generateEventViewerEvents(count, seed = 0, matchRatio = DEFAULT_MATCH_RATIO, start = DEFAULT_START):
+	"""Generate EventViewer events in time order.
+	:param count: number of events
+	:type count: an int
+	:param seed: the random seed (the same seed always returns the same events)
+	:param matchRatio: share of the events of a selected definition that match the selector criteria
+	:type matchRatio: a float
+	:param start: time of the first event
+	:type start: a datetime object
+	:returns: a generator of python JSON objects
+	"""
+	rnd = random.Random(seed)
+	definitions = [ d for d, share in DEFINITIONS ]
+	weights = [ share for d, share in DEFINITIONS ]
+	date = start
+	for i in range(count):
+		date += datetime.timedelta(milliseconds = rnd.randint(0, 2000))
+		definition = rnd.choices(definitions, weights)[0]
+		yield {
+			'eventId': '%08x-%04x-%04x-%04x-%012x' % (rnd.getrandbits(32), rnd.getrandbits(16), rnd.getrandbits(16), rnd.getrandbits(16), i),
+			'eventTime': _formatTime(date),
+			'eventData': _eventData(rnd, definition, i, rnd.random() < matchRatio),
+			'eventType': {
+				'eventTypeId': definition[:3],
+				'eventTypeName': 'Benchmark ' + definition[:3],
+				'eventDefinition': { 'eventDefinitionId': definition, 'eventName': 'Benchmark event ' + definition },
+			},
+			'impersonator': None,
+			'username': rnd.choice(USERNAMES),
+		}
+
+
+def generateEventViewerPages(count, pageSize = DEFAULT_PAGE_SIZE, seed = 0, matchRatio = DEFAULT_MATCH_RATIO, start = DEFAULT_START):
+	"""Generate EventViewer pages (without the 'links' part) holding count events in total.
+	:returns: a generator of python JSON objects with an 'events' array
+	"""
+	events = []
+	for e in generateEventViewerEvents(count, seed, matchRatio, start):
+		events.append(e)
+		if len(events) == pageSize:
+			yield { 'events': events }
+			events = []
+	if events:
+		yield { 'events': events }
+
+
+def generateEccuRequests(count, seed = 0, matchRatio = DEFAULT_MATCH_RATIO, start = DEFAULT_START):
+	"""Generate an ECCU request list, in time order.
+	:param count: number of ECCU requests
+	:type count: an int
+	:returns: a python JSON object with a 'requests' array
+	"""
+	rnd = random.Random(seed)
+	requests = []
+	date = start
+	for i in range(count):
+		date += datetime.timedelta(seconds = rnd.randint(0, 600))
+		match = rnd.random() < matchRatio
+		requests.append({
+			'requestId': 10000000 + i,
+			'requestName': 'invalidate %s' % rnd.choice(('images', 'scripts', 'styles', 'pages')),
+			'propertyName': rnd.choice(SELECTED_PROPERTIES) if match else 'property%d.otherdomain.com' % rnd.randint(0, 99),
+			'propertyType': 'HOST_HEADER',
+			'propertyNameExactMatch': True,
+			'notes': 'benchmark request %d' % i,
+			'status': 'SUCCEEDED',
+			'statusMessage': 'File successfully deployed to Akamai network',
+			'extendedStatusMessage': 'File successfully deployed to Akamai network',
+			'statusUpdateDate': (date + datetime.timedelta(seconds = rnd.randint(60, 1800))).strftime('%Y-%m-%dT%H:%M:%S.000+0000'),
+			'statusUpdateEmails': [ rnd.choice(USERNAMES) ],
+			'requestDate': date.strftime('%Y-%m-%dT%H:%M:%S.000+0000'),
+			'requestor': rnd.choice(USERNAMES),
+		})
+	return { 'requests': requests }
+
+
+def record(directory, count, pageSize = DEFAULT_PAGE_SIZE, seed = 0):
+	"""Write the fixtures to a directory: EventViewer pages (eventviewer-NNNNN.json),
+	the ECCU request list (eccu-requests.json, one request for 10 events) and the events selector.
+	"""
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+	for i, page in enumerate(generateEventViewerPages(count, pageSize, seed)):
+		with open(os.path.join(directory, 'eventviewer-%05d.json' % i), mode='w') as outfile:
+			json.dump(page, outfile)
+	with open(os.path.join(directory, 'eccu-requests.json'), mode='w') as outfile:
+		json.dump(generateEccuRequests(max(1, count // 10), seed), outfile)
+	writeSelector(os.path.join(directory, 'events-selector.csv'))
+
+
+def main(argv):
+	if not argv:
+		print('fixtures.py <directory> [number of events] [page size]')
+		sys.exit(2)
+	count = int(argv[1]) if len(argv) > 1 else 1000
+	pageSize = int(argv[2]) if len(argv) > 2 else DEFAULT_PAGE_SIZE
+	record(argv[0], count, pageSize)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
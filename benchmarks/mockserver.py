@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the Akamai and mPulse APIs used by mpulse-annotator, to load test
+and tune concurrency and rate limits offline. It serves synthetic events (see fixtures.py):
+- GET /event-viewer-api/v1/events?start=...&end=... paginated with 'next' links
+- GET /eccu-api/v1/requests, with an ETag and a Last-Modified date (HTTP 304 to conditional requests)
+- PUT /concerto/services/rest/RepositoryService/v1/Tokens
+- POST /concerto/mpulse/api/annotations/v1, rate limited with HTTP 429 and Retry-After
+- GET /mock/stats with the number of requests per endpoint and status
+Every response can be delayed (--latency, with +/-50% of jitter) and can fail with
+HTTP 500/503 (--error-rate). Responses are gzipped when the client accepts it.
+Authentication headers of Akamai APIs are not checked.
+
+Usage: python benchmarks/mockserver.py [--port 8080] [--events 10000] [--eccu-requests 1000]
+	[--page-size 500] [--latency 0.05] [--error-rate 0.01] [--rate-limit 5] [--burst 5]
+	[--token-lifetime 0] [--verbose]
+
+Then point mpulse-annotator at it (the selector of the fixtures is written to --selector):
+	./mpulse-annotator.py -u http://127.0.0.1:8080 --mpulseurl http://127.0.0.1:8080 -c x -s x -o x -a x -m x
+		-f /tmp/mock-events-selector.csv -t <start> ...
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import uuid
+import hashlib
+import random
+import getopt
+import bisect
+import calendar
+import datetime
+import threading
+from urllib.parse import urlsplit, parse_qs, urlencode
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fixtures
+from eventtime import toEpochSeconds, toEpochMillis
+
+
+EVENTVIEWER_PATH = '/event-viewer-api/v1/events'
+ECCU_PATH = '/eccu-api/v1/requests'
+TOKENS_PATH = '/concerto/services/rest/RepositoryService/v1/Tokens'
+ANNOTATIONS_PATH = '/concerto/mpulse/api/annotations/v1'
+STATS_PATH = '/mock/stats'
+
+DEFAULT_SELECTOR_FILE = '/tmp/mock-events-selector.csv'
+
+# Responses smaller than this number of bytes are not compressed
+GZIP_MIN_SIZE = 1024
+
+
+def endingAt(generate, end, lastTime):
+	"""Generate fixtures whose last item is dated end. The time between two items being random,
+	they are generated a first time to measure the time they span, then again (with the same seed) before end.
+	:param generate: a function taking the start date and returning the fixtures
+	:param end: the date of the last item (in UTC)
+	:type end: a datetime object
+	:param lastTime: a function returning the epoch time in seconds of the last item of the fixtures, None if there are none
+	:returns: the fixtures
+	"""
+	last = lastTime(generate(fixtures.DEFAULT_START))
+	if last is None:
+		return generate(end)
+	span = last - calendar.timegm(fixtures.DEFAULT_START.timetuple())
+	return generate(end - datetime.timedelta(seconds = span))
+
+
+class MockState:
+	"""
+	Data served by the mock server and its configuration, shared by all the request threads.
+	"""
+
+	def __init__(self, events, eccuRequests, pageSize, latency, errorRate, rateLimit, burst, tokenLifetime, seed):
+		self.pageSize = pageSize
+		self.latency = latency
+		self.errorRate = errorRate
+		self.rateLimit = rateLimit
+		self.burst = max(1, burst)
+		self.tokenLifetime = tokenLifetime
+		self.lock = threading.Lock()
+		self.random = random.Random(seed)
+		# EventViewer events and ECCU requests end now
+		now = datetime.datetime.utcnow().replace(microsecond = 0)
+		self.events = endingAt(lambda start: list(fixtures.generateEventViewerEvents(events, seed, start = start)), now,
+			lambda events: toEpochMillis(events[-1]['eventTime']) / 1000.0 if events else None)
+		self.eventTimes = [ toEpochSeconds(e['eventTime']) for e in self.events ]
+		eccuBody = endingAt(lambda start: fixtures.generateEccuRequests(eccuRequests, seed, start = start), now,
+			lambda body: toEpochSeconds(body['requests'][-1]['requestDate']) if body['requests'] else None)
+		self.eccuBody = json.dumps(eccuBody).encode('utf-8')
+		self.eccuETag = '"' + hashlib.sha1(self.eccuBody).hexdigest() + '"'
+		self.eccuLastModified = now.strftime('%a, %d %b %Y %H:%M:%S GMT')
+		self.tokens = {}
+		self.allowance = float(self.burst)
+		self.lastRefill = time.monotonic()
+		self.annotations = 0
+		self.stats = {}
+
+	def count(self, endpoint, status):
+		with self.lock:
+			key = endpoint + ' ' + str(status)
+			self.stats[key] = self.stats.get(key, 0) + 1
+
+	def shouldFail(self):
+		with self.lock:
+			return self.errorRate > 0 and self.random.random() < self.errorRate
+
+	def delay(self):
+		if self.latency > 0:
+			time.sleep(self.latency * random.uniform(0.5, 1.5))
+
+	def acquire(self):
+		"""Take one token of the annotations rate limit, return False when rate limited.
+		"""
+		if self.rateLimit <= 0:
+			return True
+		with self.lock:
+			now = time.monotonic()
+			self.allowance = min(self.burst, self.allowance + (now - self.lastRefill) * self.rateLimit)
+			self.lastRefill = now
+			if self.allowance < 1:
+				return False
+			self.allowance -= 1
+			return True
+
+	def newToken(self):
+		token = str(uuid.uuid4())
+		with self.lock:
+			self.tokens[token] = time.time() + self.tokenLifetime if self.tokenLifetime > 0 else None
+		return token
+
+	def isTokenValid(self, token):
+		with self.lock:
+			if token not in self.tokens:
+				return False
+			expires = self.tokens[token]
+			return expires is None or expires > time.time()
+
+	def getPage(self, start, end, offset):
+		"""Return the events of a time range, from offset, and the offset of the next page (None if last page).
+		"""
+		first = bisect.bisect_left(self.eventTimes, toEpochSeconds(start)) if start else 0
+		last = bisect.bisect_left(self.eventTimes, toEpochSeconds(end)) if end else len(self.events)
+		first += offset
+		page = self.events[first:min(last, first + self.pageSize)]
+		nextOffset = offset + self.pageSize if first + self.pageSize < last else None
+		return page, nextOffset
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+	protocol_version = 'HTTP/1.1'
+
+	# Set by main()
+	state = None
+	verbose = False
+
+	def log_message(self, format, *args):
+		if self.verbose:
+			BaseHTTPRequestHandler.log_message(self, format, *args)
+
+	def _send(self, endpoint, status, body = b'', headers = None):
+		self.state.count(endpoint, status)
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		if len(body) >= GZIP_MIN_SIZE and 'gzip' in self.headers.get('Accept-Encoding', ''):
+			body = gzip.compress(body, compresslevel = 6)
+			self.send_header('Content-Encoding', 'gzip')
+		self.send_header('Content-Length', str(len(body)))
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def _sendJson(self, endpoint, data):
+		self._send(endpoint, 200, json.dumps(data).encode('utf-8'))
+
+	def _readBody(self):
+		length = int(self.headers.get('Content-Length', 0))
+		return self.rfile.read(length) if length > 0 else b''
+
+	def _handle(self, method):
+		url = urlsplit(self.path)
+		body = self._readBody()
+		endpoint = method + ' ' + url.path
+		if url.path == STATS_PATH:
+			with self.state.lock:
+				stats = dict(self.state.stats)
+				stats['annotations'] = self.state.annotations
+			return self._sendJson(endpoint, stats)
+		self.state.delay()
+		if self.state.shouldFail():
+			return self._send(endpoint, random.choice((500, 503)), b'{"detail": "mock server error"}')
+
+		if method == 'GET' and url.path == EVENTVIEWER_PATH:
+			query = parse_qs(url.query)
+			start = query.get('start', [ None ])[0]
+			end = query.get('end', [ None ])[0]
+			offset = int(query.get('offset', [ 0 ])[0])
+			events, nextOffset = self.state.getPage(start, end, offset)
+			links = []
+			if nextOffset is not None:
+				params = dict((k, v) for k, v in (('start', start), ('end', end)) if v)
+				params['offset'] = nextOffset
+				links.append({ 'rel': 'next', 'href': EVENTVIEWER_PATH + '?' + urlencode(params) })
+			return self._sendJson(endpoint, { 'events': events, 'links': links })
+
+		if method == 'GET' and url.path == ECCU_PATH:
+			validators = { 'ETag': self.state.eccuETag, 'Last-Modified': self.state.eccuLastModified }
+			if self.headers.get('If-None-Match') == self.state.eccuETag:
+				return self._send(endpoint, 304, b'', validators)
+			return self._send(endpoint, 200, self.state.eccuBody, validators)
+
+		if method == 'PUT' and url.path == TOKENS_PATH:
+			try:
+				json.loads(body.decode('utf-8'))
+			except ValueError:
+				return self._send(endpoint, 400, b'{"detail": "invalid JSON"}')
+			return self._sendJson(endpoint, { 'token': self.state.newToken() })
+
+		if method == 'POST' and url.path == ANNOTATIONS_PATH:
+			if not self.state.isTokenValid(self.headers.get('X-Auth-Token')):
+				return self._send(endpoint, 401, b'{"detail": "invalid security token"}')
+			if not self.state.acquire():
+				return self._send(endpoint, 429, b'{"detail": "rate limited"}', { 'Retry-After': '1' })
+			try:
+				annotation = json.loads(body.decode('utf-8'))
+			except ValueError:
+				return self._send(endpoint, 400, b'{"detail": "invalid JSON"}')
+			with self.state.lock:
+				self.state.annotations += 1
+				annotationId = self.state.annotations
+			if self.verbose:
+				print('annotation %d: %s' % (annotationId, annotation.get('title')))
+			return self._sendJson(endpoint, { 'id': annotationId })
+
+		return self._send(endpoint, 404, b'{"detail": "not found"}')
+
+	def do_GET(self):
+		self._handle('GET')
+
+	def do_PUT(self):
+		self._handle('PUT')
+
+	def do_POST(self):
+		self._handle('POST')
+
+
+def main(argv):
+	host = '127.0.0.1'
+	port = 8080
+	events = 10000
+	eccuRequests = 1000
+	pageSize = fixtures.DEFAULT_PAGE_SIZE
+	latency = 0.0
+	errorRate = 0.0
+	rateLimit = 0.0
+	burst = 1
+	tokenLifetime = 0
+	selectorFile = DEFAULT_SELECTOR_FILE
+	try:
+		opts, args = getopt.getopt(argv, "h", ["host=", "port=", "events=", "eccu-requests=", "page-size=", "latency=", "error-rate=",
+			"rate-limit=", "burst=", "token-lifetime=", "selector=", "verbose"])
+	except getopt.GetoptError:
+		print(__doc__)
+		sys.exit(2)
+	for opt, arg in opts:
+		if opt == '-h':
+			print(__doc__)
+			sys.exit()
+		elif opt == '--host':
+			host = arg
+		elif opt == '--port':
+			port = int(arg)
+		elif opt == '--events':
+			events = int(arg)
+		elif opt == '--eccu-requests':
+			eccuRequests = int(arg)
+		elif opt == '--page-size':
+			pageSize = int(arg)
+		elif opt == '--latency':
+			latency = float(arg)
+		elif opt == '--error-rate':
+			errorRate = float(arg)
+		elif opt == '--rate-limit':
+			rateLimit = float(arg)
+		elif opt == '--burst':
+			burst = int(arg)
+		elif opt == '--token-lifetime':
+			tokenLifetime = int(arg)
+		elif opt == '--selector':
+			selectorFile = arg
+		elif opt == '--verbose':
+			MockHandler.verbose = True
+
+	MockHandler.state = MockState(events, eccuRequests, pageSize, latency, errorRate, rateLimit, burst, tokenLifetime, 0)
+	fixtures.writeSelector(selectorFile)
+	server = ThreadingHTTPServer((host, port), MockHandler)
+	server.daemon_threads = True
+	print('mock server listening on http://%s:%d with %d events (from %s) and %d ECCU requests, events selector written to %s' %
+		(host, port, events, MockHandler.state.events[0]['eventTime'] if events else '-', eccuRequests, selectorFile))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	server.server_close()
+	print(json.dumps(MockHandler.state.stats, indent = 1, sort_keys = True))
+	print('%d annotation(s) received' % MockHandler.state.annotations)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
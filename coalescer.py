@@ -0,0 +1,186 @@
+from collections import OrderedDict
+
+from event import Event
+
+
+# Maximum number of events waiting in open groups, the least recently updated group is
+# published when it is reached
+DEFAULT_MAX_PENDING_EVENTS = 1000
+
+# Number of seconds the events of a source may arrive out of order (e.g. time slices fetched
+# in parallel): a group is published once the stream time of its source is past its window
+# by this number of seconds, so that late events still join it
+DEFAULT_MAX_LATENESS = 600
+
+
+def _toSeconds(ts):
+	# EventViewer times are in milliseconds, ECCU times in seconds
+	value = int(ts)
+	if value > 100000000000:
+		value = value // 1000
+	return value
+
+
+class CoalescedEvent(Event):
+	"""
+	A single annotation standing for several events of the same class: its time range
+	covers all the events and its text is built by the class of the events
+	(see Event.getCoalescedAnnotationText).
+	"""
+
+	__slots__ = ('events', 'startTime', 'endTime')
+
+	def __init__(self, events):
+		"""
+		:param events: the coalesced events, in time order
+		:type events: a List of Event objects of the same class
+		"""
+		Event.__init__(self, events[0].getEventId())
+		self.tags = events[0].getTags()
+		self.events = events
+		# Times are kept in the unit of the events (milliseconds or seconds)
+		starts = [ int(e.getEventStartTime()) for e in events ]
+		ends = [ int(e.getEventEndTime()) for e in events if e.getEventEndTime() is not None ]
+		self.startTime = str(min(starts))
+		end = max(starts + ends)
+		self.endTime = str(end) if ends or end > min(starts) else None
+
+	def getEvents(self):
+		# An event of the group may itself stand for several events (e.g. aggregated ECCU requests)
+		return [ x for e in self.events for x in e.getEvents() ]
+
+	def getEventStartTime(self):
+		return self.startTime
+
+	def getEventEndTime(self):
+		return self.endTime
+
+	def getAnnotationTitle(self):
+		return self.events[0].getAnnotationTitle()
+
+	def getAnnotationText(self):
+		return type(self.events[0]).getCoalescedAnnotationText(self.events)
+
+	def __str__(self):
+		return "coalesced events: " + ', '.join(str(e.getEventId()) for e in self.events)
+
+
+class _Group:
+
+	__slots__ = ('key', 'source', 'window', 'first', 'last', 'events')
+
+	def __init__(self, key, source, window, ts):
+		self.key = key
+		self.source = source
+		self.window = window
+		self.first = ts
+		self.last = ts
+		self.events = []
+
+
+class EventCoalescer:
+	"""
+	Merge the events of the same class that occur within a sliding time window into a
+	single annotation: an event joins a group when it occurs less than the window before
+	its first event or after its last event, so a burst of events is coalesced whatever its
+	duration as long as there is no gap longer than the window. Only the events that
+	share the same coalescing key (see Event.getCoalescingKey) are merged.
+	A group is published as soon as the stream time of its source (the most recent event
+	time seen) has moved past its window, plus a lateness for the events out of order,
+	or when too many events are pending; the remaining groups at the end of the stream.
+	"""
+
+	def __init__(self, logger, windowOf, maxPending = DEFAULT_MAX_PENDING_EVENTS, maxLateness = DEFAULT_MAX_LATENESS):
+		"""
+		:param logger: the logger
+		:param windowOf: a function returning the coalescing window in seconds of an event
+			(0 or None for events that must not be coalesced)
+		:type windowOf: a callable
+		:param maxPending: maximum number of events held in open groups
+		:type maxPending: an int
+		:param maxLateness: number of seconds the events of a source may arrive out of order
+		:type maxLateness: an int
+		"""
+		self.logger = logger
+		self.windowOf = windowOf
+		self.maxPending = maxPending
+		self.maxLateness = maxLateness
+		self.events = 0
+		self.annotations = 0
+
+	def _emit(self, group):
+		self.annotations += 1
+		if len(group.events) == 1:
+			return group.events[0]
+		events = sorted(group.events, key = lambda e: int(e.getEventStartTime()))
+		self.logger.info("%d %s events coalesced into a single annotation", len(events), type(events[0]).__name__)
+		return CoalescedEvent(events)
+
+	def coalesce(self, events):
+		"""Coalesce a stream of events.
+		:param events: the events
+		:type events: an iterable of Event objects
+		:returns: a generator of Event objects (the events not coalesced and CoalescedEvent objects)
+		"""
+		groups = OrderedDict()		# open groups, least recently updated first
+		groupsByKey = {}
+		groupsBySource = {}			# open groups of each source, least recently updated first
+		streamTime = {}				# most recent event time of each source
+		pending = 0
+
+		def close(g):
+			del groups[id(g)]
+			del groupsBySource[g.source][id(g)]
+			groupsByKey[g.key].remove(g)
+			return self._emit(g)
+
+		for e in events:
+			self.events += 1
+			window = self.windowOf(e)
+			if not window:
+				self.annotations += 1
+				yield e
+				continue
+			ts = _toSeconds(e.getEventStartTime())
+			key = (type(e), e.getCoalescingKey())
+			candidates = groupsByKey.setdefault(key, [])
+			group = None
+			for g in candidates:
+				if g.first - window <= ts <= g.last + window:
+					group = g
+					break
+			if group is None:
+				group = _Group(key, e.SOURCE, window, ts)
+				candidates.append(group)
+			group.events.append(e)
+			group.first = min(group.first, ts)
+			group.last = max(group.last, ts)
+			groups[id(group)] = group
+			groups.move_to_end(id(group))
+			sourceGroups = groupsBySource.setdefault(group.source, OrderedDict())
+			sourceGroups[id(group)] = group
+			sourceGroups.move_to_end(id(group))
+			pending += 1
+
+			# Groups no event can join any more: the least recently updated groups are the oldest ones
+			now = max(ts, streamTime.get(group.source, ts))
+			streamTime[group.source] = now
+			while sourceGroups:
+				g = next(iter(sourceGroups.values()))
+				if g.last + g.window + self.maxLateness >= now:
+					break
+				pending -= len(g.events)
+				yield close(g)
+
+			while pending > self.maxPending:
+				g = next(iter(groups.values()))
+				pending -= len(g.events)
+				yield close(g)
+		for g in sorted(groups.values(), key = lambda g: g.first):
+			yield self._emit(g)
+
+	def getStats(self):
+		"""Return the number of events received and the number of annotations returned.
+		:returns: a python Dictionary
+		"""
+		return { 'events': self.events, 'annotations': self.annotations }
@@ -0,0 +1,314 @@
+import time
+import random
+import datetime
+import threading
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from requests import RequestException
+
+from metrics import ANNOTATIONS_SENT, ANNOTATIONS_FAILED, ANNOTATION_RETRIES
+from profiling import profiler
+
+
+# HTTP status codes that are worth a retry (rate limit and server side errors)
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Status returned for each annotation dispatched
+STATUS_SUCCESS = 'success'	# annotation added to mPulse
+STATUS_RETRY   = 'retry'	# temporary failure, retries exhausted: the annotation can be sent again later
+STATUS_FAILED  = 'failed'	# permanent failure (e.g. HTTP 400), sending it again will not help
+STATUS_SPOOLED = 'spooled'	# temporary failure, the annotation is kept in the spool and will be sent by a later run
+
+
+def parseRetryAfter(value):
+	"""Parse a Retry-After header: a number of seconds or an HTTP date (e.g. Wed, 21 Oct 2015 07:28:00 GMT).
+	:param value: the header value
+	:type value: a String object
+	:returns: the delay in seconds (negative for a date in the past), None if the value is invalid
+	"""
+	try:
+		return float(value)
+	except ValueError:
+		pass
+	try:
+		date = parsedate_to_datetime(value)
+	except (TypeError, ValueError, IndexError):
+		return None
+	if date is None:
+		return None
+	# A date without timezone is in UTC (HTTP dates are always in GMT)
+	if date.tzinfo is None:
+		date = date.replace(tzinfo = datetime.timezone.utc)
+	return (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+
+
+class TokenBucket:
+	"""
+	A thread-safe token bucket rate limiter. Tokens are refilled continuously
+	at 'rate' tokens per second, up to 'capacity' tokens.
+	The rate can be adjusted at runtime (see AnnotationDispatcher).
+	"""
+
+	def __init__(self, rate, capacity = 1):
+		"""
+		:param rate: number of tokens added per second
+		:type rate: a float
+		:param capacity: maximum number of tokens the bucket can hold (burst size)
+		:type capacity: an int
+		"""
+		self.rate = float(rate)
+		self.capacity = float(max(1, capacity))
+		self.tokens = self.capacity
+		self.lastRefill = time.monotonic()
+		self.lock = threading.Lock()
+
+	def _refill(self):
+		now = time.monotonic()
+		self.tokens = min(self.capacity, self.tokens + (now - self.lastRefill) * self.rate)
+		self.lastRefill = now
+
+	def setRate(self, rate):
+		"""Change the refill rate of the bucket.
+		:param rate: the new number of tokens added per second
+		:type rate: a float
+		"""
+		with self.lock:
+			self._refill()
+			self.rate = float(rate)
+
+	def getRate(self):
+		return self.rate
+
+	def drain(self):
+		"""Remove all the tokens currently available (used when the server asks us to slow down).
+		"""
+		with self.lock:
+			self._refill()
+			self.tokens = min(self.tokens, 0.0)
+
+	def acquire(self):
+		"""Block until one token is available and consume it.
+		:returns: the number of seconds spent waiting for the token
+		"""
+		waited = 0.0
+		while True:
+			with self.lock:
+				self._refill()
+				if self.tokens >= 1.0:
+					self.tokens -= 1.0
+					return waited
+				delay = (1.0 - self.tokens) / self.rate
+			time.sleep(delay)
+			waited += delay
+
+
+class AnnotationDispatcher:
+	"""
+	Send annotations to mPulse as fast as the configured token bucket allows.
+	The rate is adapted at runtime: it is halved each time mPulse answers with
+	HTTP 429 and slowly increased back to the configured maximum on success.
+	Requests rejected with HTTP 429 or 5xx are retried with an exponential backoff
+	(or after the delay given by the Retry-After header when present), and requests
+	rejected with HTTP 401 are replayed once with a new security token. An annotation is
+	never sent without a security token: it is given up as retryable instead.
+	"""
+
+	def __init__(self, logger, mpulse, tokens, rate = 1.0, burst = 1, maxRetries = 5, minRate = 0.05, backoff = 2.0, maxBackoff = 300.0):
+		"""
+		:param logger: the logger
+		:param mpulse: the mPulse API handler used to send annotations
+		:type mpulse: a MPulseAPIHandler object
+		:param tokens: the provider of mPulse security tokens
+		:type tokens: a SecurityTokenManager object
+		:param rate: maximum number of annotations sent per second
+		:type rate: a float
+		:param burst: maximum number of annotations that can be sent in a burst
+		:type burst: an int
+		:param maxRetries: maximum number of retries for one annotation
+		:type maxRetries: an int
+		:param minRate: the rate will never be decreased below this value
+		:type minRate: a float
+		:param backoff: initial backoff delay in seconds (doubled on each retry)
+		:type backoff: a float
+		:param maxBackoff: maximum backoff delay in seconds
+		:type maxBackoff: a float
+		"""
+		self.logger = logger
+		self.mpulse = mpulse
+		self.tokens = tokens
+		self.maxRate = float(rate)
+		self.minRate = min(float(minRate), self.maxRate)
+		self.maxRetries = maxRetries
+		self.backoff = backoff
+		self.maxBackoff = maxBackoff
+		self.bucket = TokenBucket(rate, burst)
+		self.lock = threading.Lock()
+		self.sent = 0
+		self.failed = 0
+		self.retries = 0
+		self.startTime = None
+		self.endTime = None
+
+	def getRetryDelay(self, result, attempt):
+		"""Return the delay to wait before retrying a rejected request.
+		:param result: the HTTP response returned by mPulse
+		:param attempt: the number of attempts already made (starting at 1)
+		:type attempt: an int
+		:returns: a delay in seconds
+		"""
+		retryAfter = result.headers.get('Retry-After') if result is not None else None
+		if retryAfter is not None:
+			delay = parseRetryAfter(retryAfter)
+			if delay is not None:
+				return min(self.maxBackoff, max(0.0, delay))
+		delay = min(self.maxBackoff, self.backoff * (2 ** (attempt - 1)))
+		return delay * random.uniform(0.5, 1.0)
+
+	def _slowDown(self):
+		rate = max(self.minRate, self.bucket.getRate() / 2)
+		self.bucket.setRate(rate)
+		self.bucket.drain()
+		self.logger.info('mPulse rate limit reached, annotation rate decreased to %.3f/s', rate)
+
+	def _speedUp(self):
+		rate = self.bucket.getRate()
+		if rate < self.maxRate:
+			self.bucket.setRate(min(self.maxRate, rate + self.minRate))
+
+	def _giveUp(self, title, attempt, status):
+		self.logger.error('Giving up on annotation "%s" after %d attempt(s)', title, attempt)
+		with self.lock:
+			self.failed += 1
+			self.endTime = time.monotonic()
+		ANNOTATIONS_FAILED.inc(status = status)
+		return status
+
+	def _retryLater(self, status, delay):
+		with self.lock:
+			self.retries += 1
+		ANNOTATION_RETRIES.inc(status = status)
+		with profiler.stage('retry-sleep'):
+			time.sleep(delay)
+
+	def dispatch(self, title, text, start, end = None):
+		"""Send a new annotation to mPulse, waiting for the rate limiter and retrying if needed.
+		:param title: the annotation title
+		:type title: a String object
+		:param text: the annotation body text
+		:type text: a String object
+		:param start: start time of the annotation in epoch time format in milliseconds
+		:type start: an int
+		:param end: (optional) end time of the annotation in epoch time format in milliseconds
+		:type end: an int
+		:returns: STATUS_SUCCESS, STATUS_RETRY or STATUS_FAILED
+		"""
+		with self.lock:
+			if self.startTime is None:
+				self.startTime = time.monotonic()
+		attempt = 0
+		tokenRenewed = False
+		while True:
+			attempt += 1
+			with profiler.stage('rate-limit-wait'):
+				self.bucket.acquire()
+			token = self.tokens.getToken()
+			# No security token could be obtained: the annotation will be sent again by a later run
+			if token is None and not self.mpulse.simulate:
+				return self._giveUp(title, attempt, STATUS_RETRY)
+			try:
+				with profiler.stage('publish'):
+					result = self.mpulse.addAnnotation(token, title, text, start, end)
+			except RequestException as ex:
+				# mPulse could not be reached or did not answer in time: retried as a server side error
+				if attempt > self.maxRetries:
+					self.logger.error('Error while sending annotation "%s" to mPulse: %s', title, ex)
+					return self._giveUp(title, attempt, STATUS_RETRY)
+				delay = self.getRetryDelay(None, attempt)
+				self.logger.info('Error while sending annotation to mPulse (%s), retrying in %.1f seconds...', ex, delay)
+				self._retryLater('error', delay)
+				continue
+			# The security token expired or was revoked: replay the request once with a new token
+			if result is not None and result.status_code == 401 and not tokenRenewed:
+				tokenRenewed = True
+				if self.tokens.invalidate(token) is None:
+					return self._giveUp(title, attempt, STATUS_RETRY)
+				attempt -= 1
+				continue
+			# No response means simulation mode
+			if result is None or result.status_code == 200:
+				self._speedUp()
+				with self.lock:
+					self.sent += 1
+					self.endTime = time.monotonic()
+				ANNOTATIONS_SENT.inc()
+				return STATUS_SUCCESS
+			if result.status_code not in RETRYABLE_STATUS_CODES or attempt > self.maxRetries:
+				return self._giveUp(title, attempt, STATUS_RETRY if result.status_code in RETRYABLE_STATUS_CODES else STATUS_FAILED)
+			if result.status_code == 429:
+				self._slowDown()
+			delay = self.getRetryDelay(result, attempt)
+			self.logger.info('Error %d from mPulse, retrying in %.1f seconds...', result.status_code, delay)
+			self._retryLater(str(result.status_code), delay)
+
+	def dispatchEvent(self, e):
+		"""Send the annotation corresponding to an Event object.
+		:param e: the event to be annotated
+		:type e: an Event object
+		:returns: STATUS_SUCCESS, STATUS_RETRY or STATUS_FAILED
+		"""
+		try:
+			return self.dispatch(e.getAnnotationTitle(), e.getAnnotationText(), e.getEventStartTime(), e.getEventEndTime())
+		except Exception as ex:
+			self.logger.error('An error occured while sending annotation for event %s: %s', e.getEventId(), ex)
+			with self.lock:
+				self.failed += 1
+			ANNOTATIONS_FAILED.inc(status = STATUS_RETRY)
+			return STATUS_RETRY
+
+	def dispatchEvents(self, events, workers = 1):
+		"""Send the annotations for a list of events using a bounded pool of workers.
+		The token bucket is shared by all the workers so the configured rate is kept,
+		workers only allow several requests to be in flight at the same time.
+		:param events: the events to be annotated
+		:type events: an iterable of Event objects
+		:param workers: maximum number of annotations in flight
+		:type workers: an int
+		:returns: a generator of (event, status) tuples, in completion order
+		"""
+		if workers <= 1:
+			for e in events:
+				yield e, self.dispatchEvent(e)
+			return
+		inFlight = {}
+		with ThreadPoolExecutor(max_workers = workers) as executor:
+			for e in events:
+				inFlight[executor.submit(self.dispatchEvent, e)] = e
+				# Do not queue more events than workers available
+				if len(inFlight) >= workers:
+					done, pending = wait(inFlight, return_when = FIRST_COMPLETED)
+					for f in done:
+						yield inFlight.pop(f), f.result()
+			while inFlight:
+				done, pending = wait(inFlight, return_when = FIRST_COMPLETED)
+				for f in done:
+					yield inFlight.pop(f), f.result()
+
+	def getEffectiveRate(self):
+		"""Return the rate actually achieved since the first annotation was dispatched.
+		:returns: a float with the number of annotations sent per second
+		"""
+		with self.lock:
+			if self.startTime is None or self.endTime is None or self.sent == 0:
+				return 0.0
+			elapsed = self.endTime - self.startTime
+			if elapsed <= 0:
+				return float(self.sent)
+			return self.sent / elapsed
+
+	def getStats(self):
+		"""Return the dispatcher counters.
+		:returns: a python Dictionary with sent, failed and retries counters, and the effective rate
+		"""
+		return { 'sent': self.sent, 'failed': self.failed, 'retries': self.retries,
+			'rate': self.getEffectiveRate(), 'currentRate': self.bucket.getRate() }
@@ -1,27 +1,80 @@
-import datetime
-import dateutil.parser
-from datetime import tzinfo, timedelta
+from sys import intern
 
-from timezones import LocalTimezone
-from timezones import UTCTimezone
+from eventtime import toEpochSeconds
+from matcher import compileCriteria
 
-LocalTZ = LocalTimezone()
-UTCTZ = UTCTimezone()
+
+# Values shorter than this (e.g. network, action, usernames) are interned: the same
+# strings repeated in thousands of events are then stored only once
+INTERN_MAX_LENGTH = 64
+
+
+def internValue(value):
+	"""Return the interned version of a short string value, the value itself otherwise.
+	"""
+	if isinstance(value, str) and len(value) < INTERN_MAX_LENGTH:
+		return intern(value)
+	return value
+
+
+# Maximum number of distinct values listed in the text of a coalesced annotation
+COALESCED_TEXT_MAX_VALUES = 5
+
+
+def summarizeValues(values):
+	"""Return the distinct values of a list as a short text (e.g. 'a, b, c and 4 more').
+	:param values: the values, in order
+	:type values: an iterable of String objects
+	:returns: a String object
+	"""
+	distinct = list(dict.fromkeys(v for v in values if v is not None))
+	text = ', '.join(distinct[:COALESCED_TEXT_MAX_VALUES])
+	if len(distinct) > COALESCED_TEXT_MAX_VALUES:
+		text += ' and ' + str(len(distinct) - COALESCED_TEXT_MAX_VALUES) + ' more'
+	return text
 
 
 class Event:
 	"""
 	Generic parent event class with mandatory methods to create, 
 	parse and match events, and. to create mPulse annotation.
+	Events are slotted records (no per-object __dict__) since a large number of them 
+	can be alive at the same time.
 	"""
 
+	__slots__ = ('eventId', 'tags')
+
 	TAG_EVENT = "Akamai"
 
+	# Tags preset for every event of the class, shared by all the events
+	TAGS = ()
+
+	# Name of the API the event comes from
+	SOURCE = None
+
 	def __init__(self, eventId = None):
 		self.eventId = eventId
-		self.tags = []
+		self.tags = self.TAGS
 
 	def matchCriteria(self, criteria):
+		"""Return True if this event matches the filter criteria of its events selector.
+		:param criteria: the filter criteria (patterns separated by ';'), preferably compiled once
+		:type criteria: a CriteriaMatcher object or a String object
+		:returns: a boolean
+		"""
+		return True
+
+	@classmethod
+	def prescreen(cls, json, criteria):
+		"""Cheap pre-selection done on the raw JSON event, before the event is instanciated and parsed.
+		Only the fields needed by the criteria are read. Returning True does not mean the event
+		matches (matchCriteria is still called once parsed), returning False means it cannot match.
+		:param json: the raw JSON event as returned by the API
+		:type json: a python JSON object
+		:param criteria: the filter criteria
+		:type criteria: a CriteriaMatcher object or a String object
+		:returns: a boolean
+		"""
 		return True
 
 	def parseJson(self, json):
@@ -65,11 +118,11 @@ class Event:
 		:param tag: the new tag to be added
 		:type tag: a string containing the new tag
 		"""
-		self.tags.append(tag)
+		self.tags = self.tags + (tag,)
 
 	def getTags(self):
-		"""Return a List of tags
-		:returns: a List object with the event tags
+		"""Return the tags
+		:returns: a tuple with the event tags
 		"""
 		return self.tags
 
@@ -87,15 +140,58 @@ class Event:
 	def clearTags(self):
 		"""Remove all the tags set (and preset by the constructor) for this Event.
 		"""
-		self.tags = []
+		self.tags = ()
+
+	def getEvents(self):
+		"""Return the events this event stands for: the event itself, or the events
+		merged into a coalesced event (see coalescer.CoalescedEvent).
+		:returns: a sequence of Event objects
+		"""
+		return (self,)
+
+	def getCoalescingKey(self):
+		"""Return the attributes that must be equal for two events of this class
+		to be coalesced into a single annotation.
+		:returns: a tuple
+		"""
+		return ()
+
+	@classmethod
+	def getCoalescedAnnotationText(cls, events):
+		"""Return the annotation text of several events of this class coalesced into a single annotation.
+		:param events: the coalesced events, in time order
+		:type events: a List of Event objects
+		:returns: a python String object
+		"""
+		return str(len(events)) + " events: " + events[0].getAnnotationTitle() + " " + events[0].getTagsText()
 
 class EventViewerEvent(Event):
 	"""
 	This event class inheritis from Event parent class.
 	All Akamai events that comes from EventViewer API should be instanciated 
 	below EventViewerEvent.
+	The eventData fields are kept as compact (key, value) pairs and only looked up
+	when needed (see getEventDataField).
 	"""
 
+	__slots__ = ('eventTime', 'eventTypeId', 'eventTypeName', 'eventDefinitionId', 'eventName', 'username', 'impersonator', 'eventData')
+
+	SOURCE = "eventviewer"
+
+	@staticmethod
+	def getEventDataValue(json, key):
+		"""Return the value of an eventData field from a raw JSON event.
+		:param json: the raw JSON event as returned by EventViewer API
+		:type json: a python JSON object
+		:param key: the eventData key (e.g. 'Purge request')
+		:type key: a String object
+		:returns: the value, None if the key is not found
+		"""
+		for kv in json['eventData']:
+			if kv['key'] == key:
+				return kv['value']
+		return None
+
 	def parseJson(self, json):
 		"""Parse a JSON object describing an Event.
 		:param json: the Event to be parsed
@@ -103,16 +199,26 @@ class EventViewerEvent(Event):
 		"""
 		self.eventId = json['eventId']
 		epoch_time = json['eventTime']
-		#dt = datetime.datetime.strptime(epoch_time, "%Y-%m-%dT%H:%M:%S.%fZ")		
-		dt = datetime.datetime.strptime(epoch_time, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=UTCTZ).astimezone(LocalTZ)
-		self.eventTime = str(int(dt.strftime("%s")) * 1000)
-		self.eventTypeId = json['eventType']['eventTypeId']
-		self.eventTypeName = json['eventType']['eventTypeName']
-		self.eventDefinitionId = json['eventType']['eventDefinition']['eventDefinitionId']
-		self.eventName = json['eventType']['eventDefinition']['eventName']
-		self.username = json['username']
-		self.impersonator = json['impersonator']
-		self.eventData = json['eventData']
+		self.eventTime = str(toEpochSeconds(epoch_time) * 1000)
+		eventType = json['eventType']
+		self.eventTypeId = internValue(eventType['eventTypeId'])
+		self.eventTypeName = internValue(eventType['eventTypeName'])
+		self.eventDefinitionId = internValue(eventType['eventDefinition']['eventDefinitionId'])
+		self.eventName = internValue(eventType['eventDefinition']['eventName'])
+		self.username = internValue(json['username'])
+		self.impersonator = internValue(json['impersonator'])
+		self.eventData = tuple([ (intern(kv['key']), internValue(kv['value'])) for kv in json['eventData'] ])
+
+	def getEventDataField(self, key):
+		"""Return the value of an eventData field of this event.
+		:param key: the eventData key (e.g. 'Purge request')
+		:type key: a String object
+		:returns: the value, None if the key is not found
+		"""
+		for k, v in self.eventData:
+			if k == key:
+				return v
+		return None
 
 	def getEventStartTime(self):
 		"""Return the event time in Epoch time (in milliseconds)
@@ -140,7 +246,10 @@ class EventViewerEvent(Event):
 		return self.impersonator
 
 	def getEventData(self):
-		return self.eventData
+		"""Return the eventData fields as returned by EventViewer API.
+		:returns: a List of dictionaries with 'key' and 'value'
+		"""
+		return [ { 'key': k, 'value': v } for k, v in self.eventData ]
 
 	def __str__(self):
 		return 	"          eventId: " + self.eventId + \
@@ -171,59 +280,52 @@ class FastPurgeCPCodeEvent(EventViewerEvent):
 	Event definition ID: 229233
 	"""
 
+	__slots__ = ()
+
 	TAG_FAST_PURGE_EVENT = "FastPurgeCPC"
 
-	def __init__(self, eventId = None):
-		EventViewerEvent.__init__(self)
-		self.addTag(Event.TAG_EVENT)
-		self.addTag(self.TAG_FAST_PURGE_EVENT)
+	TAGS = (Event.TAG_EVENT, TAG_FAST_PURGE_EVENT)
 
 	def matchCriteria(self, criteria):
 		Event.matchCriteria(self, criteria)
-		for cpcode in criteria.split(';'):
-			if cpcode in self.purgeRequest:
-				return True
-		return False
+		return compileCriteria(criteria).containsAny(self.getPurgeRequest())
+
+	@classmethod
+	def prescreen(cls, json, criteria):
+		purgeRequest = EventViewerEvent.getEventDataValue(json, 'Purge request')
+		return purgeRequest is not None and compileCriteria(criteria).containsAny(purgeRequest)
 
 	def getPurgeAction(self):
-		return self.purgeAction
+		return self.getEventDataField('Purge action')
 
 	def getPurgeNetwork(self):
-		return self.purgeNetwork
+		return self.getEventDataField('Purge network')
 
 	def getPurgeRequest(self):
-		return self.purgeRequest
+		return self.getEventDataField('Purge request')
 
 	def getPurgeResponse(self):
-		return self.purgeResponse
-
-	def parseJson(self, json):
-		EventViewerEvent.parseJson(self, json)
-		eventData = json['eventData']
-		for kv in eventData:
-			k = kv['key']
-			v = kv['value']
-			if k == 'Purge action':
-				self.purgeAction = v
-			if k == 'Purge network':
-				self.purgeNetwork = v
-			if k == 'Purge request':
-				self.purgeRequest = v
-			if k == 'Purge response':
-				self.purgeResponse = v
+		return self.getEventDataField('Purge response')
 
 	def __str__(self):
 		return EventViewerEvent.__str__(self) + \
-				"\n      purgeAction: " + str(self.purgeAction) + \
-				"\n     purgeNetwork: " + str(self.purgeNetwork) + \
-				"\n     purgeRequest: " + str(self.purgeRequest) + \
-				"\n    purgeResponse: " + str(self.purgeResponse)
+				"\n      purgeAction: " + str(self.getPurgeAction()) + \
+				"\n     purgeNetwork: " + str(self.getPurgeNetwork()) + \
+				"\n     purgeRequest: " + str(self.getPurgeRequest()) + \
+				"\n    purgeResponse: " + str(self.getPurgeResponse())
 
 	def getAnnotationText(self):
 		"""Return the annotation text corresponding to this event and ready to be used in mPulse Annotation API.
 		:returns: a python String object
 		"""		
-		return "Purge request on " + self.purgeNetwork + " network: " + self.purgeRequest + " " + self.getTagsText()
+		return "Purge request on " + self.getPurgeNetwork() + " network: " + self.getPurgeRequest() + " " + self.getTagsText()
+
+	def getCoalescingKey(self):
+		return (self.getPurgeNetwork(), self.getPurgeAction())
+
+	@classmethod
+	def getCoalescedAnnotationText(cls, events):
+		return str(len(events)) + " CP code purges (" + str(events[0].getPurgeAction()) + ") on " + str(events[0].getPurgeNetwork()) + " network " + events[0].getTagsText()
 
 class FastPurgeUrlEvent(EventViewerEvent):
 	""" 
@@ -231,113 +333,120 @@ class FastPurgeUrlEvent(EventViewerEvent):
 	Event definition ID: 894488
 	"""
 
+	__slots__ = ()
+
 	TAG_FAST_PURGE_EVENT = "FastPurgeURL"
 
-	def __init__(self, eventId = None):
-		EventViewerEvent.__init__(self)
-		self.addTag(Event.TAG_EVENT)
-		self.addTag(self.TAG_FAST_PURGE_EVENT)
+	TAGS = (Event.TAG_EVENT, TAG_FAST_PURGE_EVENT)
 
 	def matchCriteria(self, criteria):
 		Event.matchCriteria(self, criteria)
-		for url in criteria.split(';'):
-			if url in self.purgeRequest:
-				return True
-		return False
+		return compileCriteria(criteria).containsAny(self.getPurgeRequest())
+
+	@classmethod
+	def prescreen(cls, json, criteria):
+		purgeRequest = EventViewerEvent.getEventDataValue(json, 'Purge request')
+		return purgeRequest is not None and compileCriteria(criteria).containsAny(purgeRequest)
 
 	def getPurgeAction(self):
-		return self.purgeAction
+		return self.getEventDataField('Purge action')
 
 	def getPurgeNetwork(self):
-		return self.purgeNetwork
+		return self.getEventDataField('Purge network')
 
 	def getPurgeRequest(self):
-		return self.purgeRequest
+		return self.getEventDataField('Purge request')
 
 	def getPurgeResponse(self):
-		return self.purgeResponse
-
-	def parseJson(self, json):
-		EventViewerEvent.parseJson(self, json)
-		eventData = json['eventData']
-		for kv in eventData:
-			k = kv['key']
-			v = kv['value']
-			if k == 'Purge action':
-				self.purgeAction = v
-			if k == 'Purge network':
-				self.purgeNetwork = v
-			if k == 'Purge request':
-				self.purgeRequest = v
-			if k == 'Purge response':
-				self.purgeResponse = v
+		return self.getEventDataField('Purge response')
 
 	def __str__(self):
 		return EventViewerEvent.__str__(self) + \
-				"\n      purgeAction: " + str(self.purgeAction) + \
-				"\n     purgeNetwork: " + str(self.purgeNetwork) + \
-				"\n     purgeRequest: " + str(self.purgeRequest) + \
-				"\n    purgeResponse: " + str(self.purgeResponse)
+				"\n      purgeAction: " + str(self.getPurgeAction()) + \
+				"\n     purgeNetwork: " + str(self.getPurgeNetwork()) + \
+				"\n     purgeRequest: " + str(self.getPurgeRequest()) + \
+				"\n    purgeResponse: " + str(self.getPurgeResponse())
 
 	def getAnnotationText(self):
 		"""Return the annotation text corresponding to this event and ready to be used in mPulse Annotation API.
 		:returns: a python String object
 		"""		
-		return "Purge request on network: " + self.purgeNetwork + " request: " + self.purgeRequest + " " + self.getTagsText()
+		return "Purge request on network: " + self.getPurgeNetwork() + " request: " + self.getPurgeRequest() + " " + self.getTagsText()
+
+	def getCoalescingKey(self):
+		return (self.getPurgeNetwork(), self.getPurgeAction())
+
+	@classmethod
+	def getCoalescedAnnotationText(cls, events):
+		return str(len(events)) + " URL purges (" + str(events[0].getPurgeAction()) + ") on " + str(events[0].getPurgeNetwork()) + " network " + events[0].getTagsText()
 
 class PropertyManagerEvent(EventViewerEvent):
 
+	__slots__ = ()
 
 	TAG_PROPERTY_MANAGER_EVENT = "PropertyManager"
 
-
-	def __init__(self, eventId = None):
-		EventViewerEvent.__init__(self)
-		self.addTag(Event.TAG_EVENT)
-		self.addTag(self.TAG_PROPERTY_MANAGER_EVENT)
+	TAGS = (Event.TAG_EVENT, TAG_PROPERTY_MANAGER_EVENT)
 
 	def matchCriteria(self, criteria):
 		EventViewerEvent.matchCriteria(self, criteria)
-		if criteria == '':
+		matcher = compileCriteria(criteria)
+		if matcher.isEmpty():
 			return True
-		for prop in criteria.split(';'):
-			if prop == self.propertyName:
-				return True
-		return False
+		return matcher.equalsAny(self.getPropertyName())
 
-	def parseJson(self, json):
-		EventViewerEvent.parseJson(self, json)
-		eventData = json['eventData']
-		for kv in eventData:
-			k = kv['key']
-			v = kv['value']
-			if k == 'PROPERTY_NAME':
-				self.propertyName = v
-			if k == 'PROPERTY_VERSION':
-				self.propertyVersion = v
-			if k == 'USERNAME':
-				self.username = v
+	@classmethod
+	def prescreen(cls, json, criteria):
+		matcher = compileCriteria(criteria)
+		if matcher.isEmpty():
+			return True
+		return matcher.equalsAny(EventViewerEvent.getEventDataValue(json, 'PROPERTY_NAME'))
+
+	def getPropertyName(self):
+		return self.getEventDataField('PROPERTY_NAME')
+
+	def getPropertyVersion(self):
+		return self.getEventDataField('PROPERTY_VERSION')
+
+	def getUsername(self):
+		"""Return the user who activated the property (USERNAME field), the event username otherwise.
+		"""
+		username = self.getEventDataField('USERNAME')
+		if username is None:
+			return self.username
+		return username
 
 	def __str__(self):
 		return EventViewerEvent.__str__(self) + \
-				"\n     propertyName: " +  str(self.propertyName) + \
-				"\n  propertyVersion: " +  str(self.propertyVersion) + \
-				"\n         username: " +  str(self.username)
+				"\n     propertyName: " +  str(self.getPropertyName()) + \
+				"\n  propertyVersion: " +  str(self.getPropertyVersion()) + \
+				"\n         username: " +  str(self.getUsername())
 
 	def getAnnotationText(self):
 		"""Return the annotation text corresponding to this event and ready to be used in mPulse Annotation API.
 		:returns: a python String object
 		"""		
-		return "" + self.propertyName + " v" + self.propertyVersion + " activated by " + self.username + " " + self.getTagsText()
+		return "" + self.getPropertyName() + " v" + self.getPropertyVersion() + " activated by " + self.getUsername() + " " + self.getTagsText()
+
+	@classmethod
+	def getCoalescedAnnotationText(cls, events):
+		return str(len(events)) + " property activations: " + summarizeValues(e.getPropertyName() + " v" + e.getPropertyVersion() for e in events) + \
+			" by " + summarizeValues(e.getUsername() for e in events) + " " + events[0].getTagsText()
 
 class EccuEvent(Event):
 
+	__slots__ = ('requestName', 'propertyName', 'propertyType', 'propertyNameExactMatch', 'notes', 'status', 'statusMessage',
+		'extendedStatusMessage', 'eventEndTime', 'statusUpdateEmails', 'eventTime', 'requestor', 'mergedEvents')
+
 	TAG_ECCU_EVENT = "ECCU"
 
+	TAGS = (Event.TAG_EVENT, TAG_ECCU_EVENT)
+
+	SOURCE = "eccu"
+
 	def __init__(self, eventId = None):
-		Event.__init__(self)
-		self.addTag(Event.TAG_EVENT)
-		self.addTag(self.TAG_ECCU_EVENT)
+		Event.__init__(self, eventId)
+		self.mergedEvents = None
 
 	def parseJson(self, json):	
 		"""Parse a JSON object containing an ECCU event description.
@@ -351,26 +460,24 @@ class EccuEvent(Event):
 		except KeyError:
 			self.requestName = None
 		self.propertyName = json['propertyName']
-		self.propertyType = json['propertyType']
-		self.propertyNameExactMatch = str(json['propertyNameExactMatch'])
+		self.propertyType = internValue(json['propertyType'])
+		self.propertyNameExactMatch = intern(str(json['propertyNameExactMatch']))
 		self.notes = json['notes']
-		self.status = json['status']
-		self.statusMessage = json['statusMessage']
+		self.status = internValue(json['status'])
+		self.statusMessage = internValue(json['statusMessage'])
 		self.extendedStatusMessage = json['extendedStatusMessage']
 		
 		# parse statusUpdateDate
 		epoch_time = json['statusUpdateDate']
-		date_time_obj = datetime.datetime.strptime(epoch_time, '%Y-%m-%dT%H:%M:%S.%f%z')
-		self.eventEndTime = str(int(date_time_obj.timestamp()))
+		self.eventEndTime = str(toEpochSeconds(epoch_time))
 
 		self.statusUpdateEmails = json['statusUpdateEmails']
 
 		# parse requestDate
 		epoch_time = json['requestDate']
-		date_time_obj = datetime.datetime.strptime(epoch_time, '%Y-%m-%dT%H:%M:%S.%f%z')
-		self.eventTime = str(int(date_time_obj.timestamp()))
+		self.eventTime = str(toEpochSeconds(epoch_time))
 
-		self.requestor = json['requestor']
+		self.requestor = internValue(json['requestor'])
 
 	def getPropertyName(self):
 		return self.propertyName
@@ -378,6 +485,20 @@ class EccuEvent(Event):
 	def setPropertyName(self, name):
 		self.propertyName = name
 
+	def getEvents(self):
+		"""Return the events this event stands for: the event itself, or all the ECCU events
+		merged into it by the aggregation (see aggregator.aggregateEvents).
+		:returns: a sequence of Event objects
+		"""
+		return (self,) if self.mergedEvents is None else self.mergedEvents
+
+	def setMergedEvents(self, events):
+		"""Record the ECCU events merged into this event (this event included).
+		:param events: the merged events
+		:type events: a List of EccuEvent objects
+		"""
+		self.mergedEvents = tuple(events)
+
 	def getRequestor(self):
 		"""
 		:returns: a String object containing the user who requested this event
@@ -396,12 +517,18 @@ class EccuEvent(Event):
 		"""
 		return self.eventTime
 
+	def setEventStartTime(self, ts):
+		self.eventTime = ts
+
 	def getEventEndTime(self):
 		"""Return the event time in Epoch time (in milliseconds)
 		:returns: event epoch time (in milliseconds)
 		"""
 		return self.eventEndTime
 
+	def setEventEndTime(self, ts):
+		self.eventEndTime = ts
+
 	def getAnnotationTitle(self):
 		"""Return the annotation title corresponding to this event and ready to be used in mPulse Annotation API. 
 		By default it returns the eventName attribute.
@@ -419,12 +546,22 @@ class EccuEvent(Event):
 		result += "on property " + self.propertyName + " requested by " + self.requestor + "." + " " + self.getTagsText()
 		return result
 
+	def getCoalescingKey(self):
+		return (self.requestor,)
+
+	@classmethod
+	def getCoalescedAnnotationText(cls, events):
+		return str(len(events)) + " ECCU requests on properties " + summarizeValues(e.getPropertyName() for e in events) + \
+			" requested by " + str(events[0].getRequestor()) + ". " + events[0].getTagsText()
+
 	def matchCriteria(self, criteria):
 		Event.matchCriteria(self, criteria)
-		for c in criteria.split(';'):
-			if c in self.propertyName:
-				return True
-		return False
+		return compileCriteria(criteria).containsAny(self.propertyName)
+
+	@classmethod
+	def prescreen(cls, json, criteria):
+		propertyName = json.get('propertyName')
+		return propertyName is not None and compileCriteria(criteria).containsAny(propertyName)
 
 	def __str__(self):
 		return Event.__str__(self) + \
@@ -0,0 +1,92 @@
+import datetime
+
+
+# Epoch time (in seconds) of each hour already seen, keyed by 'YYYY-MM-DDTHH'.
+# Events of a page are usually close in time, so most conversions hit this cache.
+_hourCache = {}
+
+# The cache is cleared when it reaches this size
+HOUR_CACHE_SIZE = 10000
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo = datetime.timezone.utc)
+
+
+def _hourToEpoch(hour):
+	"""Return the epoch time of an hour given as 'YYYY-MM-DDTHH' (UTC).
+	"""
+	epoch = _hourCache.get(hour)
+	if epoch is None:
+		if len(_hourCache) >= HOUR_CACHE_SIZE:
+			_hourCache.clear()
+		d = datetime.datetime(int(hour[0:4]), int(hour[5:7]), int(hour[8:10]), int(hour[11:13]), tzinfo = datetime.timezone.utc)
+		epoch = int((d - _EPOCH).total_seconds())
+		_hourCache[hour] = epoch
+	return epoch
+
+
+def _parseOffset(suffix):
+	"""Return the UTC offset in seconds of a timezone suffix ('Z', '+0000', '-05:00' or '').
+	"""
+	if suffix == '' or suffix == 'Z' or suffix == '+0000' or suffix == '+00:00':
+		return 0
+	sign = 1 if suffix[0] == '+' else -1
+	digits = suffix[1:].replace(':', '')
+	if suffix[0] not in '+-' or len(digits) != 4 or not digits.isdigit():
+		raise ValueError('invalid UTC offset: ' + suffix)
+	return sign * (int(digits[0:2]) * 3600 + int(digits[2:4]) * 60)
+
+
+def toEpochMillis(date):
+	"""Convert an ISO-8601 date to an epoch time in milliseconds, without depending on the local timezone.
+	The fixed formats returned by Akamai APIs (e.g. 2018-12-12T16:37:02.621Z or 2019-01-10T09:00:00.000+0000)
+	are sliced directly, any other ISO-8601 format falls back to the datetime module.
+	A date without timezone is considered as UTC.
+	:param date: the date to convert
+	:type date: a String object
+	:returns: an int
+	"""
+	# Fast path for the fixed Akamai formats: 2018-12-12T16:37:02.621Z and 2019-01-10T09:00:00.000+0000
+	n = len(date)
+	if (n == 24 and date[23] == 'Z' or n == 28 and date[23:] == '+0000') and date[19] == '.' and date[13] == ':' and date[16] == ':':
+		try:
+			return (_hourToEpoch(date[0:13]) + int(date[14:16]) * 60 + int(date[17:19])) * 1000 + int(date[20:23])
+		except ValueError:
+			pass
+	if len(date) >= 19 and date[4] == '-' and date[7] == '-' and date[10] == 'T' and date[13] == ':' and date[16] == ':':
+		rest = date[19:]
+		millis = 0
+		if rest[:1] == '.':
+			i = 1
+			while i < len(rest) and rest[i].isdigit():
+				i += 1
+			fraction = rest[1:i]
+			millis = int((fraction + '00')[:3]) if fraction else 0
+			rest = rest[i:]
+		try:
+			offset = _parseOffset(rest)
+			seconds = _hourToEpoch(date[0:13]) + int(date[14:16]) * 60 + int(date[17:19]) - offset
+			return seconds * 1000 + millis
+		except ValueError:
+			pass
+	d = datetime.datetime.fromisoformat(date.replace('Z', '+00:00'))
+	if d.tzinfo is None:
+		d = d.replace(tzinfo = datetime.timezone.utc)
+	return int((d - _EPOCH).total_seconds() * 1000)
+
+
+def toEpochSeconds(date):
+	"""Convert an ISO-8601 date to an epoch time in seconds (see toEpochMillis).
+	:param date: the date to convert
+	:type date: a String object
+	:returns: an int
+	"""
+	return toEpochMillis(date) // 1000
+
+
+def fromEpochSeconds(ts):
+	"""Convert an epoch time in seconds to a UTC date (e.g. 2018-12-13T15:00:00).
+	:param ts: the epoch time in seconds
+	:type ts: an int
+	:returns: a String object
+	"""
+	return (_EPOCH + datetime.timedelta(seconds = int(ts))).strftime('%Y-%m-%dT%H:%M:%S')
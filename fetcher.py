@@ -0,0 +1,178 @@
+import time
+import datetime
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from requests import RequestException
+from urllib3.exceptions import HTTPError
+
+from metrics import observeRequest, PAGES_FETCHED
+from profiling import profiler
+from jsonstream import JsonArrayReader
+
+
+# Date format used by EventViewer API for start/end parameters
+EVENTVIEWER_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# Connect and read timeouts in seconds of the requests to Akamai APIs
+DEFAULT_API_TIMEOUT = (10.0, 60.0)
+
+
+class FetchError(Exception):
+	"""
+	An Akamai API answered with an unexpected HTTP status, or did not answer in time: the events
+	of the response were not fetched, so the source must not be considered complete.
+	"""
+
+
+def splitTimeRange(start, end, slices):
+	"""Split a time range into contiguous time slices of the same duration.
+	:param start: start date of the range (e.g. 2018-12-13T15:00:00)
+	:type start: a String object
+	:param end: end date of the range (e.g. 2018-12-14T15:00:00)
+	:type end: a String object
+	:param slices: number of slices
+	:type slices: an int
+	:returns: a List of (start, end) tuples of String objects
+	"""
+	startDate = datetime.datetime.strptime(start, EVENTVIEWER_DATE_FORMAT)
+	endDate = datetime.datetime.strptime(end, EVENTVIEWER_DATE_FORMAT)
+	if slices <= 1 or endDate <= startDate:
+		return [ (start, end) ]
+	step = (endDate - startDate) / slices
+	bounds = [ startDate + step * i for i in range(slices) ] + [ endDate ]
+	result = []
+	for i in range(slices):
+		s = bounds[i].strftime(EVENTVIEWER_DATE_FORMAT)
+		e = bounds[i + 1].strftime(EVENTVIEWER_DATE_FORMAT)
+		if s != e:
+			result.append((s, e))
+	return result
+
+
+class EventViewerFetcher:
+	"""
+	Fetch EventViewer API pages in the background.
+	As soon as a page has been downloaded and decoded, the request for the next page
+	is sent while the current page is parsed.
+	The requested time range can also be split into time slices that are paginated
+	in parallel. The number of pages downloaded at the same time is bounded.
+	Pages are decoded while they are downloaded (the 'links' of a page may follow its events),
+	then their events are handed over to a select function (e.g. parseEvents) in the caller
+	thread, so that only the selected events of a page are kept once it is parsed.
+	"""
+
+	def __init__(self, logger, sess, baseUrl, maxInFlight = 4, select = None, timeout = DEFAULT_API_TIMEOUT):
+		"""
+		:param logger: the logger
+		:param sess: a session to send HTTP request to EventViewer API.
+		:type sess: Session
+		:param baseUrl: the base URL of the Akamai API (e.g. https://akab-XXXX.luna.akamaiapis.net)
+		:type baseUrl: a String object
+		:param maxInFlight: maximum number of pages downloaded at the same time
+		:type maxInFlight: an int
+		:param select: (optional) a function called with an iterator of the decoded events of a page,
+			returning the events to keep (all the events by default)
+		:param timeout: (optional) the connect and read timeouts in seconds of each request
+		:type timeout: a (float, float) tuple
+		"""
+		self.logger = logger
+		self.sess = sess
+		self.baseUrl = baseUrl
+		self.maxInFlight = max(1, maxInFlight)
+		self.select = select if select is not None else list
+		self.timeout = timeout
+
+	def fetchPage(self, url_path):
+		"""Download and decode one EventViewer page.
+		:param url_path: the URL path of the page
+		:type url_path: a String object
+		:returns: the page: a python Dictionary with the decoded 'events', the number of events
+			of the page ('count') and the other members of the page (e.g. 'links')
+		:raises FetchError: if EventViewer API did not return the page
+		"""
+		self.logger.info("request EventViewer v1 API on URL %s", url_path)
+		startTime = time.monotonic()
+		result = None
+		try:
+			with profiler.stage('fetch'):
+				result = self.sess.get(urljoin(self.baseUrl, url_path), stream = True, timeout = self.timeout)
+		except RequestException as e:
+			raise FetchError('EventViewer API request failed on URL %s: %s' % (url_path, e))
+		finally:
+			observeRequest('eventviewer', startTime, result)
+		try:
+			if (result.status_code == 200):
+				PAGES_FETCHED.inc()
+				# The body is gunzipped (requests asks for gzip) and decoded as it is read
+				result.raw.decode_content = True
+				reader = JsonArrayReader(result.raw, 'events')
+				events = list(profiler.iterate('decode', reader))
+				page = reader.fields
+				page['events'] = events
+				page['count'] = reader.count
+				return page
+			raise FetchError('Error %d returned by EventViewer API on URL %s' % (result.status_code, url_path))
+		except (RequestException, HTTPError) as e:
+			# The body is read from the raw response: a read timeout is raised by urllib3
+			raise FetchError('EventViewer API response could not be read on URL %s: %s' % (url_path, e))
+		finally:
+			result.close()
+
+	def parsePage(self, data):
+		"""Replace the decoded events of a page by the events kept by the select function.
+		:param data: a page returned by fetchPage
+		:returns: the page
+		"""
+		data['events'] = self.select(iter(data['events']))
+		return data
+
+	def getNextLink(self, data):
+		"""Return the 'next' href from the links part of a page.
+		:param data: a decoded EventViewer page
+		:returns: a String object, None if this is the last page
+		"""
+		if data.get('links') is None:
+			return None
+		for link in data['links']:
+			if link['rel'] == 'next':
+				return link['href']
+		return None
+
+	def getPages(self, start, end = None, slices = 1):
+		"""Return the EventViewer pages for a time range.
+		Pages of different time slices are returned in no particular order.
+		:param start: start date after which the events should be returned (e.g. 2018-12-13T15:00:00)
+		:type start: a String object
+		:param end: (optional) end date before which the events should be returned
+		:type end: a String object
+		:param slices: number of time slices fetched in parallel (only when start and end are set)
+		:type slices: an int
+		:returns: a generator of EventViewer pages (see fetchPage) with the selected 'events'
+		:raises FetchError: if a page could not be fetched (the pages after it are not fetched either)
+		"""
+		url_path = '/event-viewer-api/v1/events'
+		if start and end:
+			paths = [ url_path + '?start=' + s + '&end=' + e for s, e in splitTimeRange(start, end, slices) ]
+		elif start:
+			paths = [ url_path + '?start=' + start ]
+		else:
+			paths = [ url_path ]
+
+		with ThreadPoolExecutor(max_workers = self.maxInFlight) as executor:
+			pending = set()
+			waiting = list(paths)
+			while waiting or pending:
+				while waiting and len(pending) < self.maxInFlight:
+					pending.add(executor.submit(self.fetchPage, waiting.pop(0)))
+				done, pending = wait(pending, return_when = FIRST_COMPLETED)
+				for f in done:
+					data = f.result()
+					# Request the next page before parsing the current one
+					next_href = self.getNextLink(data)
+					if next_href:
+						if len(pending) < self.maxInFlight:
+							pending.add(executor.submit(self.fetchPage, next_href))
+						else:
+							waiting.insert(0, next_href)
+					yield self.parsePage(data)
@@ -0,0 +1,141 @@
+import json
+import codecs
+from json.decoder import WHITESPACE
+
+
+# Number of bytes read from the response at a time
+DEFAULT_CHUNK_SIZE = 64*1024
+
+_NUMBER_CHARACTERS = '0123456789.eE+-'
+
+
+class _TextBuffer:
+	"""
+	The part of a JSON document read so far and not decoded yet.
+	"""
+
+	def __init__(self, stream, chunkSize):
+		self.stream = stream
+		self.chunkSize = chunkSize
+		self.decoder = codecs.getincrementaldecoder('utf-8')()
+		self.text = ''
+		self.pos = 0
+		self.eof = False
+
+	def fill(self):
+		"""Read the next chunk of the document, return False at the end of the document.
+		"""
+		if self.eof:
+			return False
+		chunk = self.stream.read(self.chunkSize)
+		self.eof = not chunk
+		self.text = self.text[self.pos:] + self.decoder.decode(chunk or b'', final = self.eof)
+		self.pos = 0
+		return True
+
+	def peek(self):
+		"""Return the next character that is not a whitespace, None at the end of the document.
+		"""
+		while True:
+			self.pos = WHITESPACE.match(self.text, self.pos).end()
+			if self.pos < len(self.text):
+				return self.text[self.pos]
+			if not self.fill():
+				return None
+
+	def expect(self, characters):
+		"""Consume the next character that is not a whitespace and return it.
+		:param characters: the characters expected
+		:type characters: a String object
+		"""
+		c = self.peek()
+		if c is None or c not in characters:
+			raise ValueError('invalid JSON document: expected one of %r at %r' % (characters, self.text[self.pos:self.pos + 20]))
+		self.pos += 1
+		return c
+
+	def decode(self, scanOnce):
+		"""Decode the next JSON value, reading more of the document until the value is complete.
+		:param scanOnce: the scanner of a JSONDecoder
+		"""
+		if self.peek() is None:
+			raise ValueError('invalid JSON document: unexpected end of document')
+		while True:
+			text = self.text
+			try:
+				value, end = scanOnce(text, self.pos)
+				# A number ending with the buffer or followed by a part of a number may continue in the next chunk
+				if (end < len(text) and text[end] not in _NUMBER_CHARACTERS) or self.eof:
+					self.pos = end
+					return value
+			except (StopIteration, json.JSONDecodeError):
+				# The value may be incomplete (e.g. a string not terminated yet)
+				if self.eof:
+					raise ValueError('invalid JSON document at %r' % text[self.pos:self.pos + 20])
+			self.fill()
+
+	def iterArray(self, scanOnce):
+		"""Decode the items of an array one at a time, up to the end of the array (its '[' being consumed).
+		:param scanOnce: the scanner of a JSONDecoder
+		"""
+		if self.peek() == ']':
+			self.pos += 1
+			return
+		while True:
+			value = self.decode(scanOnce)
+			yield value
+			# Most of the time the separator directly follows the item
+			text = self.text
+			pos = self.pos
+			c = text[pos] if pos < len(text) else None
+			if c == ',' or c == ']':
+				self.pos = pos + 1
+			else:
+				c = self.expect(',]')
+			if c == ']':
+				return
+
+
+class JsonArrayReader:
+	"""
+	Decode the items of an array of a JSON object (e.g. the 'events' of an EventViewer page)
+	one at a time while the document is read, so that neither the whole document nor the whole
+	decoded array are held in memory. Items are decoded by the C scanner of the json module.
+	The other members of the object (e.g. 'links') are available in fields once the items
+	have been read.
+	"""
+
+	def __init__(self, stream, arrayKey, chunkSize = DEFAULT_CHUNK_SIZE):
+		"""
+		:param stream: a binary file-like object with the JSON document (e.g. the raw HTTP response)
+		:param arrayKey: the name of the array member
+		:type arrayKey: a String object
+		:param chunkSize: the number of bytes read at a time
+		:type chunkSize: an int
+		"""
+		self.stream = stream
+		self.arrayKey = arrayKey
+		self.chunkSize = chunkSize
+		self.fields = {}
+		self.count = 0
+
+	def __iter__(self):
+		buffer = _TextBuffer(self.stream, self.chunkSize)
+		scanOnce = json.JSONDecoder().scan_once
+		buffer.expect('{')
+		if buffer.peek() == '}':
+			return
+		while True:
+			key = buffer.decode(scanOnce)
+			if not isinstance(key, str):
+				raise ValueError('invalid JSON document: object key expected')
+			buffer.expect(':')
+			if key == self.arrayKey and buffer.peek() == '[':
+				buffer.pos += 1
+				for item in buffer.iterArray(scanOnce):
+					self.count += 1
+					yield item
+			else:
+				self.fields[key] = buffer.decode(scanOnce)
+			if buffer.expect(',}') == '}':
+				return
@@ -0,0 +1,138 @@
+from collections import deque
+
+
+# Under this number of patterns, a substring scan per pattern (done in C by the 'in' operator)
+# is faster than walking the Aho-Corasick automaton in Python
+AHO_CORASICK_MIN_PATTERNS = 16
+
+
+class AhoCorasick:
+	"""
+	Aho-Corasick automaton to find if any of a set of patterns is contained in a text,
+	with a single pass over the text whatever the number of patterns.
+	"""
+
+	def __init__(self, patterns):
+		"""
+		:param patterns: the patterns to look for (must not be empty strings)
+		:type patterns: an iterable of String objects
+		"""
+		# State 0 is the root. For each state: transitions, failure link and whether a pattern ends here
+		self.goto = [ {} ]
+		self.fail = [ 0 ]
+		self.output = [ False ]
+		for pattern in patterns:
+			self._add(pattern)
+		self._build()
+
+	def _add(self, pattern):
+		state = 0
+		for c in pattern:
+			nextState = self.goto[state].get(c)
+			if nextState is None:
+				nextState = len(self.goto)
+				self.goto.append({})
+				self.fail.append(0)
+				self.output.append(False)
+				self.goto[state][c] = nextState
+			state = nextState
+		self.output[state] = True
+
+	def _build(self):
+		todo = deque(self.goto[0].values())
+		while todo:
+			state = todo.popleft()
+			for c, nextState in self.goto[state].items():
+				todo.append(nextState)
+				f = self.fail[state]
+				while f and c not in self.goto[f]:
+					f = self.fail[f]
+				f = self.goto[f].get(c, 0)
+				self.fail[nextState] = f
+				self.output[nextState] = self.output[nextState] or self.output[f]
+
+	def search(self, text):
+		"""Return True if at least one pattern is contained in the text.
+		:param text: the text to search into
+		:type text: a String object
+		:returns: a boolean
+		"""
+		goto = self.goto
+		fail = self.fail
+		output = self.output
+		state = 0
+		for c in text:
+			while state and c not in goto[state]:
+				state = fail[state]
+			state = goto[state].get(c, 0)
+			if output[state]:
+				return True
+		return False
+
+
+class CriteriaMatcher:
+	"""
+	The filter criteria of an events selector (e.g. '123456;654321'), compiled once
+	so that every event can be matched against all the patterns in a single lookup:
+	a hash set for exact matches and an Aho-Corasick automaton for substring matches.
+	"""
+
+	def __init__(self, criteria):
+		"""
+		:param criteria: the filter criteria, patterns are separated by ';'
+		:type criteria: a String object
+		"""
+		self.criteria = criteria
+		self.patterns = criteria.split(';')
+		self.exact = frozenset(self.patterns)
+		# An empty pattern is contained in any text
+		self.matchAll = '' in self.exact
+		substrings = [ p for p in self.exact if p != '' ]
+		if len(substrings) >= AHO_CORASICK_MIN_PATTERNS:
+			self.automaton = AhoCorasick(substrings)
+			self.substrings = None
+		else:
+			self.automaton = None
+			self.substrings = substrings
+
+	def isEmpty(self):
+		"""Return True if the criteria is an empty string.
+		"""
+		return self.criteria == ''
+
+	def equalsAny(self, text):
+		"""Return True if the text is equal to one of the patterns.
+		:param text: the text to be matched
+		:type text: a String object
+		:returns: a boolean
+		"""
+		return text in self.exact
+
+	def containsAny(self, text):
+		"""Return True if the text contains one of the patterns.
+		:param text: the text to be matched
+		:type text: a String object
+		:returns: a boolean
+		"""
+		if self.matchAll:
+			return True
+		if self.automaton is not None:
+			return self.automaton.search(text)
+		for p in self.substrings:
+			if p in text:
+				return True
+		return False
+
+	def __str__(self):
+		return self.criteria
+
+
+def compileCriteria(criteria):
+	"""Return a CriteriaMatcher for the criteria, compiling it if needed.
+	:param criteria: the filter criteria
+	:type criteria: a String object or a CriteriaMatcher object
+	:returns: a CriteriaMatcher object
+	"""
+	if isinstance(criteria, CriteriaMatcher):
+		return criteria
+	return CriteriaMatcher(criteria)
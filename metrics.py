@@ -0,0 +1,257 @@
+import time
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# Prefix of the name of all the metrics
+METRICS_PREFIX = 'mpulse_annotator_'
+
+# Address the metrics server listens on by default: metrics are only exposed to the local host
+# unless another address is given (e.g. 0.0.0.0 for a Prometheus server on another host)
+DEFAULT_METRICS_HOST = '127.0.0.1'
+
+# Buckets (in seconds) of the API latency histograms
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labelsKey(labels):
+	return tuple(sorted(labels.items()))
+
+
+def _formatLabels(key, extra = ()):
+	pairs = list(key) + list(extra)
+	if not pairs:
+		return ''
+	return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs) + '}'
+
+
+def _summaryKeys(values):
+	# Values without labels are summarized as a single value
+	if list(values.keys()) == [ () ]:
+		return None
+	return dict((key, ','.join('%s=%s' % kv for kv in key)) for key in values)
+
+
+def _formatValue(value):
+	if value == float('inf'):
+		return '+Inf'
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+	"""
+	A metric with a value per set of labels. Updates are thread-safe.
+	"""
+
+	TYPE = None
+
+	def __init__(self, name, help):
+		self.name = METRICS_PREFIX + name
+		self.help = help
+		self.lock = threading.Lock()
+		self.values = {}
+
+	def render(self):
+		"""Return the metric in Prometheus text exposition format.
+		:returns: a List of String objects (lines)
+		"""
+		lines = [ '# HELP ' + self.name + ' ' + self.help, '# TYPE ' + self.name + ' ' + self.TYPE ]
+		with self.lock:
+			for key, value in sorted(self.values.items()):
+				lines.append(self.name + _formatLabels(key) + ' ' + _formatValue(value))
+		return lines
+
+	def getSummary(self):
+		"""Return the values of the metric, keyed by labels (e.g. 'endpoint=eccu,status=200'),
+		or the value itself for a metric without labels.
+		:returns: a python Dictionary or a number
+		"""
+		with self.lock:
+			keys = _summaryKeys(self.values)
+			if keys is None:
+				return self.values[()]
+			return dict((keys[key], value) for key, value in self.values.items())
+
+
+class Counter(Metric):
+
+	TYPE = 'counter'
+
+	def inc(self, value = 1, **labels):
+		key = _labelsKey(labels)
+		with self.lock:
+			self.values[key] = self.values.get(key, 0) + value
+
+
+class Gauge(Metric):
+
+	TYPE = 'gauge'
+
+	def set(self, value, **labels):
+		key = _labelsKey(labels)
+		with self.lock:
+			self.values[key] = value
+
+
+class Histogram(Metric):
+
+	TYPE = 'histogram'
+
+	def __init__(self, name, help, buckets = DEFAULT_LATENCY_BUCKETS):
+		Metric.__init__(self, name, help)
+		self.buckets = tuple(buckets) + (float('inf'),)
+
+	def observe(self, value, **labels):
+		key = _labelsKey(labels)
+		with self.lock:
+			counts = self.values.get(key)
+			if counts is None:
+				# Count per bucket, then sum and count of the observations
+				counts = self.values[key] = [ 0 ] * (len(self.buckets) + 2)
+			for i, bound in enumerate(self.buckets):
+				if value <= bound:
+					counts[i] += 1
+					break
+			counts[-2] += value
+			counts[-1] += 1
+
+	def render(self):
+		lines = [ '# HELP ' + self.name + ' ' + self.help, '# TYPE ' + self.name + ' ' + self.TYPE ]
+		with self.lock:
+			for key, counts in sorted(self.values.items()):
+				cumulated = 0
+				for i, bound in enumerate(self.buckets):
+					cumulated += counts[i]
+					lines.append(self.name + '_bucket' + _formatLabels(key, [ ('le', _formatValue(bound)) ]) + ' ' + str(cumulated))
+				lines.append(self.name + '_sum' + _formatLabels(key) + ' ' + _formatValue(counts[-2]))
+				lines.append(self.name + '_count' + _formatLabels(key) + ' ' + str(counts[-1]))
+		return lines
+
+	def getSummary(self):
+		with self.lock:
+			keys = _summaryKeys(self.values)
+			summary = {}
+			for key, counts in self.values.items():
+				count = counts[-1]
+				summary[key] = { 'count': count, 'sum': round(counts[-2], 6), 'avg': round(counts[-2] / count, 6) if count else 0.0 }
+			if keys is None:
+				return summary[()]
+			return dict((keys[key], value) for key, value in summary.items())
+
+
+class MetricsRegistry:
+	"""
+	The metrics of the application, exposed in Prometheus text format (see MetricsServer)
+	and summarized as JSON at the end of each run.
+	"""
+
+	def __init__(self):
+		self.metrics = []
+
+	def _register(self, metric):
+		self.metrics.append(metric)
+		return metric
+
+	def counter(self, name, help):
+		return self._register(Counter(name, help))
+
+	def gauge(self, name, help):
+		return self._register(Gauge(name, help))
+
+	def histogram(self, name, help, buckets = DEFAULT_LATENCY_BUCKETS):
+		return self._register(Histogram(name, help, buckets))
+
+	def render(self):
+		"""Return all the metrics in Prometheus text exposition format.
+		:returns: a String object
+		"""
+		lines = []
+		for metric in self.metrics:
+			lines += metric.render()
+		return '\n'.join(lines) + '\n'
+
+	def getSummary(self):
+		"""Return all the metrics values (counters and gauges per labels, count/sum/avg of histograms).
+		:returns: a python Dictionary
+		"""
+		return dict((metric.name[len(METRICS_PREFIX):], metric.getSummary()) for metric in self.metrics)
+
+
+# Metrics of the application
+registry = MetricsRegistry()
+
+API_REQUESTS = registry.counter('api_requests_total', 'API requests per endpoint and HTTP status')
+API_LATENCY = registry.histogram('api_request_duration_seconds', 'API request duration in seconds per endpoint')
+PAGES_FETCHED = registry.counter('pages_fetched_total', 'EventViewer pages fetched')
+EVENTS_RECEIVED = registry.counter('events_received_total', 'Events returned by Akamai APIs per source')
+EVENTS_PARSED = registry.counter('events_parsed_total', 'Events parsed per selector')
+EVENTS_MATCHED = registry.counter('events_matched_total', 'Events matching the criteria per selector')
+EVENTS_DROPPED = registry.counter('events_dropped_total', 'Events of a selector not matching the criteria (including the events dropped before parsing)')
+ANNOTATIONS_SENT = registry.counter('annotations_sent_total', 'Annotations added to mPulse')
+ANNOTATIONS_FAILED = registry.counter('annotations_failed_total', 'Annotations given up, per status (retry or failed)')
+ANNOTATION_RETRIES = registry.counter('annotation_retries_total', 'Annotation requests retried per HTTP status (error when mPulse could not be reached)')
+QUEUE_DEPTH = registry.gauge('queue_depth', 'Parsed events waiting to be published')
+LOG_RECORDS_DROPPED = registry.counter('log_records_dropped_total', 'Log records dropped per level because the logging queue was full')
+SPOOLED_ANNOTATIONS = registry.gauge('spooled_annotations', 'Annotations waiting in the spool to be sent again')
+DEAD_LETTERS = registry.gauge('dead_letters', 'Annotations given up and kept in the dead-letter queue')
+
+
+def observeRequest(endpoint, startTime, result):
+	"""Record the duration and the HTTP status of an API request.
+	:param endpoint: the endpoint name (e.g. eventviewer)
+	:type endpoint: a String object
+	:param startTime: the time.monotonic() value when the request was sent
+	:type startTime: a float
+	:param result: the HTTP response, None if the request failed
+	"""
+	API_LATENCY.observe(time.monotonic() - startTime, endpoint = endpoint)
+	API_REQUESTS.inc(endpoint = endpoint, status = str(result.status_code) if result is not None else 'error')
+
+
+class MetricsServer:
+	"""
+	Expose the metrics on an HTTP endpoint: /metrics in Prometheus text format,
+	/metrics.json as a JSON summary. The server runs in a background thread.
+	"""
+
+	def __init__(self, logger, port, host = DEFAULT_METRICS_HOST, metricsRegistry = registry):
+		"""
+		:param logger: the logger
+		:param port: the TCP port to listen on
+		:type port: an int
+		:param host: the address to listen on (the loopback interface by default, '' for all interfaces)
+		:type host: a String object
+		"""
+		self.logger = logger
+
+		class Handler(BaseHTTPRequestHandler):
+
+			def do_GET(self):
+				if self.path == '/metrics':
+					body = metricsRegistry.render().encode('utf-8')
+					contentType = 'text/plain; version=0.0.4; charset=utf-8'
+				elif self.path == '/metrics.json':
+					body = json.dumps(metricsRegistry.getSummary()).encode('utf-8')
+					contentType = 'application/json'
+				else:
+					self.send_error(404)
+					return
+				self.send_response(200)
+				self.send_header('Content-Type', contentType)
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				return
+
+		self.server = ThreadingHTTPServer((host, port), Handler)
+		self.server.daemon_threads = True
+		self.thread = threading.Thread(target = self.server.serve_forever, name = 'metrics', daemon = True)
+		self.thread.start()
+		self.logger.info('metrics available on http://%s:%d/metrics', host or '0.0.0.0', port)
+
+	def close(self):
+		self.server.shutdown()
+		self.server.server_close()
@@ -1,24 +1,63 @@
 #!/usr/bin/env python
 
 import sys, getopt
+import os
+import signal
+import random
+import threading
 import requests
 import sys
 import json
+import sqlite3
 import logging
 import time
-import csv
+import atexit
+import copy
 import datetime
 import dateutil.parser
 from akamai.edgegrid import EdgeGridAuth, EdgeRc
+from requests import RequestException
+from urllib3.exceptions import HTTPError
 from urllib.parse import urljoin
-from event import Event, FastPurgeCPCodeEvent, FastPurgeUrlEvent, PropertyManagerEvent, EccuEvent
-from mpulseapihandler import MPulseAPIHandler
-from logging.handlers import RotatingFileHandler
+from event import EccuEvent
+from mpulseapihandler import MPulseAPIHandler, DEFAULT_MPULSE_URL
+from tokenmanager import SecurityTokenManager
+from dispatcher import AnnotationDispatcher, STATUS_SUCCESS, STATUS_RETRY, STATUS_FAILED, STATUS_SPOOLED
+from fetcher import EventViewerFetcher, FetchError, DEFAULT_API_TIMEOUT
+from pipeline import SourceMerger, EventRouter
+from aggregator import aggregateEvents, eccuExactKey, eccuTimeWindowKey
+from eventtime import toEpochSeconds as isoToEpochSeconds, fromEpochSeconds
+from jsonstream import JsonArrayReader
+from statestore import StateStore
+from backfill import BackfillPlan, ECCU_WORK_ITEM, DEFAULT_SLICE_DURATION
+from coalescer import EventCoalescer
+import metrics
+from metrics import MetricsServer, DEFAULT_METRICS_HOST, observeRequest, EVENTS_RECEIVED, EVENTS_PARSED, EVENTS_MATCHED, EVENTS_DROPPED
+from profiling import profiler, TimedAuth, PROFILE_MODES
+from asynclog import AsyncLog
+from selector import SelectorIndex, loadEventPlugins, snapshotOf, parseEventsSelector as parseSelectorFile
+from tenants import loadTenants, TenantSelector
+from spool import AnnotationSpool
 
 
 # Default filename for logger
 DEFAULT_LOGGER_FILE = 'logs/mpulse-annotator.log'
 
+# Default level of the log (DEBUG, INFO, WARNING, ERROR or CRITICAL)
+DEFAULT_LOG_LEVEL = 'DEBUG'
+
+# Default filename for the state database (checkpoints and published events)
+DEFAULT_STATE_FILE = 'state/mpulse-annotator.db'
+
+# Default filename for the mPulse security token cache
+DEFAULT_TOKEN_CACHE_FILE = 'state/mpulse-token.json'
+
+# Default filename for the backfill work plan
+DEFAULT_BACKFILL_PLAN_FILE = 'state/backfill-plan.json'
+
+# Default number of backfill time slices fetched at the same time
+DEFAULT_BACKFILL_FETCHERS = 4
+
 # Default filename for the events selector configuration file
 EVENTS_SELECTOR_FILE = 'events-selector.csv'
 
@@ -27,8 +66,40 @@ EVENTS_SELECTOR_ECCU         = '000001'
 EVENTS_SELECTOR_PMACTIVATION = '238252'
 EVENTS_SELECTOR_FASTPURGE    = '229233'
 
-# Delay in seconds between calls to create mPulse annotation (to avoid rate limit)
-ANNOTATION_CREATE_DELAY 	 = 20
+# Maximum number of mPulse annotations created per second (the dispatcher slows down when rate limited)
+DEFAULT_ANNOTATION_RATE 	 = 1.0
+
+# Maximum number of mPulse annotations that can be created in a burst
+DEFAULT_ANNOTATION_BURST 	 = 5
+
+# Maximum number of mPulse annotations requests in flight at the same time
+DEFAULT_PUBLISH_WORKERS 	 = 4
+
+# Maximum number of EventViewer pages downloaded at the same time
+DEFAULT_PAGES_IN_FLIGHT 	 = 4
+
+# Number of time slices the EventViewer time range is split into (requires an end time)
+DEFAULT_TIME_SLICES 		 = 1
+
+# Maximum number of parsed events waiting to be published (the fetchers pause when it is reached)
+DEFAULT_QUEUE_SIZE 			 = 100
+
+# Time window in seconds used to aggregate ECCU events (0 to only aggregate events with the same start/end times)
+DEFAULT_ECCU_AGGREGATION_WINDOW = 0
+
+# Time window in seconds used to coalesce events of the same class into a single annotation,
+# unless set for a selector in the events selector file (0 to publish one annotation per event)
+DEFAULT_COALESCING_WINDOW 	 = 0
+
+# Delay in seconds between two polls of EventViewer and ECCU APIs in daemon mode
+DEFAULT_POLL_INTERVAL 		 = 60
+
+# Random variation of the poll interval (as a fraction of the interval) to spread the API calls
+DEFAULT_POLL_JITTER 		 = 0.1
+
+# The checkpoint of a source is kept this number of seconds behind the time it was queried at,
+# for events indexed late by the API (events already published are skipped anyway)
+CHECKPOINT_SAFETY_MARGIN 	 = 300
 
 
 # Global variables
@@ -37,77 +108,97 @@ global baseUrl
 
 
 def initLogger():
-	"""Initialize the logger.	
-	:param filename: logger filename
-	:type filename: a String object
+	"""Initialize the logger: records are written to the log file by a background thread
+	(see AsyncLog), the records still queued are written when the program exits.
+	:returns: an AsyncLog object, to change the level and the format of the log
 	"""
 	global l
 	l = logging.getLogger("Rotating Log")
-	l.setLevel(logging.DEBUG)
-	handler = RotatingFileHandler(DEFAULT_LOGGER_FILE, maxBytes=10*1024*1024, backupCount=10)
-	formatter = logging.Formatter('%(asctime)-12s [%(levelname)s] %(message)s')  
-	handler.setFormatter(formatter)
-	l.addHandler(handler)
-
-
-def decomment(csvfile):
-    for row in csvfile:
-        raw = row.split('#')[0].strip()
-        if raw: yield raw
+	l.setLevel(DEFAULT_LOG_LEVEL)
+	log = AsyncLog(l, DEFAULT_LOGGER_FILE)
+	atexit.register(log.close)
+	return log
 
 
 def parseEventsSelector(csvfile):
-	"""Parse the events selector CSV file. 
-	The CSV has two columns: the event definition ID, and the Event class name to be loaded 
-	for this particular type of event. 
-	The CSV file can contained comments (starting with '#') that will be ignored.
+	"""Parse the events selector CSV file (see selector.parseEventsSelector).
 	:param csvfile: the CSV file path and file name
 	:type csvfile: a String object
-	:returns: a python Dictionary where key is the event type ID and value is the class name
+	:returns: a python Dictionary where key is the event type ID and value the class, the compiled criteria
+		and the coalescing window (None if not set)
+	"""
+	return parseSelectorFile(l, csvfile)
+
+
+def countSelection(parsed, matched, dropped):
+	"""Add the number of events parsed, matched and dropped per selector to the metrics.
+	Counts are accumulated by the caller for a whole page, so that metrics are updated once per page.
+	:param parsed: a python Dictionary with the number of events parsed per selector ID
+	:param matched: a python Dictionary with the number of events matched per selector ID
+	:param dropped: a python Dictionary with the number of events dropped per selector ID
 	"""
-	selector = {}
-	with open(csvfile, mode='r') as infile:
-		reader = csv.reader(decomment(infile))
-		for row in reader:
-			if row[1] == 'FastPurgeCPCodeEvent':
-				selector[row[0]] = [ FastPurgeCPCodeEvent, row[2] ]
-				l.debug("Selector '" + row[1] + "' added to event selectors list with criteria '" + row[2] + "'")
-			if row[1] == 'FastPurgeUrlEvent':
-				l.debug("Selector '" + row[1] + "' added to event selectors list with criteria '" + row[2] + "'")
-				selector[row[0]] = [ FastPurgeUrlEvent, row[2] ]
-			if row[1] == 'PropertyManagerEvent':
-				l.debug("Selector '" + row[1] + "' added to event selectors list with criteria '" + row[2] + "'")
-				selector[row[0]] = [ PropertyManagerEvent, row[2] ]
-			if row[1] == 'EccuEvent':
-				l.debug("Selector '" + row[1] + "' added to event selectors list with criteria '" + row[2] + "'")
-				selector[row[0]] = [ EccuEvent, row[2] ]
-	return selector
+	for counter, counts in ((EVENTS_PARSED, parsed), (EVENTS_MATCHED, matched), (EVENTS_DROPPED, dropped)):
+		for selectorId, count in counts.items():
+			counter.inc(count, selector = selectorId)
 
 
 def parseEvents(json_object, eventsSelector):
 	""" Parse a JSON object with a list of events obtained from EventViewer API.
-	:param json_object: a JSON object that contains the array of events as returned by EventViewer API
+	:param json_object: a JSON object that contains the array of events as returned by EventViewer API,
+		or an iterator of the events (see JsonArrayReader)
 	:type json_object: a native Python JSON object
 	:param eventsSelector: a dictionary to select events during parsing
 	:type eventsSelector: a python dictionary type
 	:returns: an array of Event objects
 	"""
 	events = []
+	parsed = {}
+	matched = {}
+	dropped = {}
+	# Time spent in parsing and in matchCriteria is only measured when profiling
+	timed = profiler.enabled
+	parseSeconds = 0.0
+	matchSeconds = 0.0
 	for event in json_object:
+		if timed:
+			startTime = time.perf_counter()
 		eventDefinitionId = event['eventType']['eventDefinition']['eventDefinitionId']
-		if eventDefinitionId in eventsSelector:
-			e = eventsSelector[eventDefinitionId][0]() # Instanciate object using dynamic class name
+		selector = eventsSelector.get(eventDefinitionId)
+		if selector is not None:
+			eventClass, criteria = selector[0:2]
 			try: 
-				e.parseJson(event)
-				if e.matchCriteria(eventsSelector[eventDefinitionId][1]):
-					events.append(e)
+				# Only instanciate and parse the events that may match the criteria
+				if not eventClass.prescreen(event, criteria):
+					dropped[eventDefinitionId] = dropped.get(eventDefinitionId, 0) + 1
+				else:
+					e = eventClass() # Instanciate object using dynamic class name
+					e.parseJson(event)
+					parsed[eventDefinitionId] = parsed.get(eventDefinitionId, 0) + 1
+					if timed:
+						matchTime = time.perf_counter()
+						matches = e.matchCriteria(criteria)
+						matchSeconds += time.perf_counter() - matchTime
+					else:
+						matches = e.matchCriteria(criteria)
+					if matches:
+						events.append(e)
+						matched[eventDefinitionId] = matched.get(eventDefinitionId, 0) + 1
+					else:
+						dropped[eventDefinitionId] = dropped.get(eventDefinitionId, 0) + 1
 			except:
-				l.error('An error occured while parsing event: ' + event['eventId'])
+				l.error('An error occured while parsing event: %s', event['eventId'])
+		if timed:
+			parseSeconds += time.perf_counter() - startTime
+	countSelection(parsed, matched, dropped)
+	if timed:
+		profiler.record('match', matchSeconds, sum(parsed.values()))
+		profiler.record('parse', parseSeconds - matchSeconds)
 	return events
 
 def parseEccuEvents(json_object, fromTimeStamp, eventsSelector):
 	""" Parse a JSON object with a list of events obtained from ECCU Event API.
-	:param json_object: a JSON object that contains the array of events as returned by ECCU API
+	:param json_object: a JSON object that contains the array of events as returned by ECCU API,
+		or an iterator of the events (see JsonArrayReader)
 	:type json_object: a native Python JSON object
 	:param fromTimeStamp: timestamp to select events (only events started after this timestamp will be returned)
 	:type fromTimeStamp: an int
@@ -116,21 +207,84 @@ def parseEccuEvents(json_object, fromTimeStamp, eventsSelector):
 	:returns: an array of Event objects
 	"""
 	events = []
+	parsed = 0
+	dropped = 0
+	# Time spent in parsing and in matchCriteria is only measured when profiling
+	timed = profiler.enabled
+	parseSeconds = 0.0
+	matchSeconds = 0.0
 	for event in json_object:
+		if timed:
+			startTime = time.perf_counter()
 		eventDefinitionId = EVENTS_SELECTOR_ECCU
-		if eventDefinitionId in eventsSelector:
-			e = eventsSelector[eventDefinitionId][0]() # Instanciate object using dynamic class name
+		selector = eventsSelector.get(eventDefinitionId)
+		if selector is not None:
+			eventClass, criteria = selector[0:2]
 			try: 
-				e.parseJson(event)
-				if e.getEventStartTime() >= fromTimeStamp:
-					if e.matchCriteria(eventsSelector[eventDefinitionId][1]):
-						events.append(e)
+				# Only instanciate and parse the events that may match the criteria
+				if not eventClass.prescreen(event, criteria):
+					dropped += 1
+				else:
+					e = eventClass() # Instanciate object using dynamic class name
+					e.parseJson(event)
+					parsed += 1
+					if e.getEventStartTime() >= fromTimeStamp:
+						if timed:
+							matchTime = time.perf_counter()
+							matches = e.matchCriteria(criteria)
+							matchSeconds += time.perf_counter() - matchTime
+						else:
+							matches = e.matchCriteria(criteria)
+						if matches:
+							events.append(e)
+						else:
+							dropped += 1
 			except:
-				l.error('An error occured while parsing event ID: ' + event['eventId'])
+				l.error('An error occured while parsing event ID: %s', event['eventId'])
+		if timed:
+			parseSeconds += time.perf_counter() - startTime
+	countSelection({ EVENTS_SELECTOR_ECCU: parsed }, { EVENTS_SELECTOR_ECCU: len(events) }, { EVENTS_SELECTOR_ECCU: dropped })
+	if timed:
+		profiler.record('match', matchSeconds, parsed)
+		profiler.record('parse', parseSeconds - matchSeconds)
 	return events
 
 
-def getECCUEvents(sess, start, eventsSelector):
+def newOrChangedECCURequests(requests, start, index, changes):
+	"""Skip the ECCU requests already in the index with the same status and requested before the start
+	timestamp (they would be dropped once parsed), and collect the new or changed requests.
+	:param requests: the ECCU requests as returned by ECCU API
+	:type requests: an iterable of native Python JSON objects
+	:param start: the timestamp from which events should be selected
+	:type start: a string with a unix timestamp
+	:param index: the ECCU requests already seen (see StateStore.getEccuRequests)
+	:type index: a python Dictionary
+	:param changes: the List the new or changed (requestId, requestDate, status) are appended to
+	:type changes: a List
+	:returns: a generator of native Python JSON objects
+	"""
+	start = int(start)
+	skipped = 0
+	for request in requests:
+		try:
+			requestId = str(request['requestId'])
+			status = request.get('status')
+			known = index.get(requestId)
+			if known is None or known[1] != status:
+				changes.append((requestId, isoToEpochSeconds(request['requestDate']), status))
+			elif known[0] < start:
+				skipped += 1
+				continue
+		except (KeyError, TypeError, ValueError):
+			# Left to parseEccuEvents, which reports invalid requests
+			pass
+		yield request
+	if skipped > 0:
+		l.info("%d unchanged ECCU request(s) skipped", skipped)
+		EVENTS_DROPPED.inc(skipped, selector = EVENTS_SELECTOR_ECCU)
+
+
+def getECCUEvents(sess, start, eventsSelector, state = None, conditional = False):
 	""" Query the ECCU API and return a list of Event objects
 	
 	:param sess: a session to send HTTP request to EventViewer API.
@@ -139,7 +293,14 @@ def getECCUEvents(sess, start, eventsSelector):
 	:type start: a string with a unix timestamp (since January 1st, 1970 at UTC)
 	:param eventsSelector:
 	:type eventsSelector:
+	:param state: (optional) the state store with the index of the ECCU requests already seen:
+		only new requests, requests whose status changed and recent requests are parsed
+	:type state: a StateStore object
+	:param conditional: True to send a conditional request (with the validators of the last response):
+		nothing is returned if the ECCU requests did not change
+	:type conditional: a boolean
 	:rtype: a Dictionnary of Event objects
+	:raises FetchError: if ECCU API did not return the requests
 	"""
 	global l
 	global baseUrl
@@ -148,189 +309,856 @@ def getECCUEvents(sess, start, eventsSelector):
 	# Build the initial URL path to make API call
 	url_path = '/eccu-api/v1/requests'
 
-	l.info("request Enhanced Content Control Utility API v1 on URL " + url_path)
-	result = sess.get(urljoin(baseUrl, url_path))
-	if (result.status_code == 200):
-		data = result.json()
-		l.info(str(len(data['requests'])) + " event(s) returned")
-		selectedEvents = parseEccuEvents(data['requests'], start, eventsSelector)
-		events = events + selectedEvents
+	headers = {}
+	if conditional and state is not None:
+		etag, lastModified = state.getValidators('eccu')
+		if etag is not None:
+			headers['If-None-Match'] = etag
+		if lastModified is not None:
+			headers['If-Modified-Since'] = lastModified
+
+	l.info("request Enhanced Content Control Utility API v1 on URL %s", url_path)
+	startTime = time.monotonic()
+	result = None
+	try:
+		with profiler.stage('fetch'):
+			result = sess.get(urljoin(baseUrl, url_path), headers = headers, stream = True, timeout = DEFAULT_API_TIMEOUT)
+	except RequestException as e:
+		raise FetchError('ECCU API request failed on URL %s: %s' % (url_path, e))
+	finally:
+		observeRequest('eccu', startTime, result)
+	try:
+		if (result.status_code == 304):
+			l.info("ECCU requests not modified since the last poll")
+		elif (result.status_code == 200):
+			# Requests are decoded and parsed one at a time while the response is read
+			result.raw.decode_content = True
+			reader = JsonArrayReader(result.raw, 'requests')
+			requests = profiler.iterate('decode', reader)
+			changes = []
+			if state is not None:
+				requests = newOrChangedECCURequests(requests, start, state.getEccuRequests(), changes)
+			events = parseEccuEvents(requests, start, snapshotOf(eventsSelector))
+			l.info("%d event(s) returned, %d new or changed", reader.count, len(changes))
+			EVENTS_RECEIVED.inc(reader.count, source = 'eccu')
+			if state is not None:
+				state.saveEccuRequests(changes)
+				if conditional:
+					state.setValidators('eccu', result.headers.get('ETag'), result.headers.get('Last-Modified'))
+		else:
+			# The source fails: its checkpoint is not moved and the requests are fetched again by the next run
+			raise FetchError('Error %d returned by ECCU API on URL %s' % (result.status_code, url_path))
+	except (RequestException, HTTPError) as e:
+		# The body is read from the raw response: a read timeout is raised by urllib3
+		raise FetchError('ECCU API response could not be read on URL %s: %s' % (url_path, e))
+	finally:
+		result.close()
 
-	l.info("Total: " + str(len(events)) + " event(s) selected and parsed after start date '" + start + "'")
+	l.info("Total: %d event(s) selected and parsed after start date '%s'", len(events), start)
 	return events
 
-def aggregateECCUEvents(events):
+def aggregateECCUEvents(events, window = DEFAULT_ECCU_AGGREGATION_WINDOW):
 	"""
 	This function will try to reduce the number of EccuEvents by aggregating the events when they share: same request name, start/end times, and same requestor. 
+	When a time window is set, events sharing the same request name and requestor are aggregated 
+	when they were requested within the same time window, whatever their start/end times.
 	:param events: an array of EccuEvents
+	:param window: (optional) the aggregation time window in seconds
+	:type window: an int
+	:returns: the array of aggregated EccuEvents
 	"""
+	key = eccuTimeWindowKey(window) if window > 0 else eccuExactKey
 	try:
-		for e1 in events:
-			for e2 in events:
-				# Make sure e1 and e2 are not the same
-				if e1.getEventId() != e2.getEventId():
-					# If 2 events shares same request name, start time, end time and requestor, they can easily be merged
-					if e1.getRequestName() == e2.getRequestName() and e1.getEventStartTime() == e2.getEventStartTime() and e1.getEventEndTime() == e2.getEventEndTime() and e1.getRequestor() == e2.getRequestor():
-						l.info('Found 2 ECCU events that could be merged: "' + e1.getAnnotationText() + '" and "' + e2.getAnnotationText() + '"')				
-						propName = e1.getPropertyName() + ', ' + e2.getPropertyName()
-						e1.setPropertyName(propName)
-						events.remove(e2)
+		with profiler.stage('aggregate'):
+			aggregated = aggregateEvents(events, key)
 	except:
 		l.error('An unexpected error occured while trying to aggregate ECCU Events!')
+		return events
+	result = []
+	for e, count in aggregated:
+		if count > 1:
+			l.info('Found %d ECCU events that could be merged: "%s"', count, e.getAnnotationText())
+		result.append(e)
+	return result
 
 
-def getEventViewerEvents(sess, start, eventsSelector):
-	""" Query EventCenter API and return a list of Event objects.
+def getAggregatedECCUEvents(sess, start, eventsSelector, window = DEFAULT_ECCU_AGGREGATION_WINDOW, state = None, conditional = False):
+	""" Query the ECCU API and return the list of Event objects once aggregated (see aggregateECCUEvents).
+	:param sess: a session to send HTTP request to ECCU API.
+	:type sess: Session
+	:param start: the timestamp from which events should be selected 
+	:type start: a string with a unix timestamp (since January 1st, 1970 at UTC)
+	:param eventsSelector: a dictionary to select events during parsing
+	:param window: (optional) the aggregation time window in seconds
+	:type window: an int
+	:param state: (optional) the state store with the index of the ECCU requests (see getECCUEvents)
+	:param conditional: True to send a conditional request (see getECCUEvents)
+	:rtype: a List of EccuEvent objects
+	"""
+	events = getECCUEvents(sess, start, eventsSelector, state, conditional)
+	return aggregateECCUEvents(events, window)
+
+
+def aggregateTenantECCUEvents(tenantSelector, events, window, routes):
+	""" Route the ECCU events to the tenants whose criteria they match, then aggregate the events of each tenant
+	(see aggregateECCUEvents). Each tenant aggregates its own copies of the events, so that an aggregated event
+	only stands for (and is annotated with the properties of) the events of its tenant.
+	:param tenantSelector: the union of the events selectors of the tenants, the events were parsed with
+	:type tenantSelector: a TenantSelector object
+	:param events: the ECCU events, not aggregated
+	:type events: a List of EccuEvent objects
+	:param window: the aggregation time window in seconds
+	:type window: an int
+	:param routes: a python Dictionary filled with the tenant name of each aggregated event (see publishTenantEvents)
+	:rtype: a List of EccuEvent objects
+	"""
+	result = []
+	for tenant, criteria in tenantSelector.routesOf(EVENTS_SELECTOR_ECCU):
+		for e in aggregateECCUEvents([ copy.copy(e) for e in events if e.matchCriteria(criteria) ], window):
+			routes[e] = tenant.name
+			result.append(e)
+	return result
+
+
+def getEventViewerEvents(sess, start, eventsSelector, end = None, maxInFlight = 1, slices = 1):
+	""" Query EventCenter API and return the selected Event objects as soon as their page is parsed.
+	Only the pages being downloaded and parsed are kept in memory: the next pages are
+	not requested until the caller has consumed the events already returned.
 	:param sess: a session to send HTTP request to EventViewer API.
 	:type sess: Session
 	:param start: start date after which the events should be returned (e.g. 2018-12-13T15:00:00)
-	:returns: the list of events founds
-	:rtype: a Dictionnary of Event objects
+	:param end: (optional) end date before which the events should be returned
+	:param maxInFlight: maximum number of pages downloaded at the same time
+	:type maxInFlight: an int
+	:param slices: number of time slices fetched in parallel (only when end is set)
+	:type slices: an int
+	:returns: the events found
+	:rtype: a generator of Event objects
 	"""
 	global l
 	global baseUrl
-	events = []
-	
-	# Build the initial URL path to make API call
-	url_path = '/event-viewer-api/v1/events'
-	if start:
-		url_path = url_path + '?start=' + start
-	
-	l.info("request EventViewer v1 API on URL " + url_path)
-	result = sess.get(urljoin(baseUrl, url_path))
-	if (result.status_code == 200):
-		data = result.json()
-		l.info(str(len(data['events'])) + " event(s) returned")
-		selectedEvents = parseEvents(data['events'], eventsSelector)
-		events = events + selectedEvents
-		l.info(str(len(selectedEvents)) + " event(s) selected and parsed")
-
-		# Iterate on links part
-		while data['links'] is not None:
-
-			next_href = None
-
-			# Get the 'next' href from the links part
-			for link in data['links']:
-				if link['rel'] == 'next':
-					next_href = link['href']
-
-			if next_href:
-				url_path = next_href
-				l.info("request EventViewer v1 API on URL " + url_path)
-				result = sess.get(urljoin(baseUrl, url_path))
-				if (result.status_code == 200):
-					data = result.json()
-					l.info(str(len(data['events'])) + " event(s) returned")
-					selectedEvents = parseEvents(data['events'], eventsSelector)
-					events = events + selectedEvents
-					l.info(str(len(selectedEvents)) + " event(s) selected and parsed")
-			else:
-				break
-
-	l.info("Total: " + str(len(events)) + " event(s) selected and parsed after start date '" + start + "'")
-	return events
+	total = 0
+
+	# Events of a page are selected and parsed while the next page is downloaded
+	fetcher = EventViewerFetcher(l, sess, baseUrl, maxInFlight, lambda events: parseEvents(events, snapshotOf(eventsSelector)))
+	for data in fetcher.getPages(start, end, slices):
+		l.info("%d event(s) returned", data['count'])
+		EVENTS_RECEIVED.inc(data['count'], source = 'eventviewer')
+		selectedEvents = data['events']
+		l.info("%d event(s) selected and parsed", len(selectedEvents))
+		total += len(selectedEvents)
+		yield from selectedEvents
+
+	l.info("Total: %d event(s) selected and parsed after start date '%s'", total, start)
+
+
+def toEpochSeconds(ts):
+	"""Convert an epoch timestamp to seconds.
+	:param ts: an epoch timestamp in seconds or milliseconds
+	:type ts: a String object
+	:returns: an int
+	"""
+	value = int(ts)
+	# Timestamps in milliseconds are converted to seconds
+	if value > 100000000000:
+		value = value // 1000
+	return value
+
+
+def dateToEpoch(date):
+	"""Convert a date as given on the command line to an epoch timestamp.
+	:param date: a UTC date (e.g. 2018-12-13T15:00:00)
+	:type date: a String object
+	:returns: an int with the epoch time in seconds
+	"""
+	return isoToEpochSeconds(date)
+
+
+def epochToDate(ts):
+	"""Convert an epoch timestamp to a date as given on the command line.
+	:param ts: an epoch time in seconds
+	:type ts: an int
+	:returns: a String object (e.g. 2018-12-13T15:00:00)
+	"""
+	return fromEpochSeconds(ts)
+
+
+def formatTimestamp(ts):
+	"""Return a human readable UTC representation of an epoch timestamp.
+	:param ts: an epoch timestamp in seconds or milliseconds
+	:type ts: a String object
+	:returns: a String object (e.g. 2018-12-13 15:00:00 UTC)
+	"""
+	return datetime.datetime.utcfromtimestamp(toEpochSeconds(ts)).strftime('%Y-%m-%d %H:%M:%S') + " UTC"
+
+
+def logAnnotation(e):
+	"""Log the annotation that is about to be sent for an event.
+	:param e: the event to be annotated
+	:type e: an Event object
+	"""
+	if not l.isEnabledFor(logging.INFO):
+		return
+	start = e.getEventStartTime()
+	end = e.getEventEndTime()
+	if end is None:
+		l.info('The following annotation will be sent to mPulse API:\n  Title: %s\n   Text: %s\n  Start: %s (%s)',
+			e.getAnnotationTitle(), e.getAnnotationText(), start, formatTimestamp(start))
+	else:
+		l.info('The following annotation will be sent to mPulse API:\n  Title: %s\n   Text: %s\n  Start: %s (%s)\n    End: %s (%s)',
+			e.getAnnotationTitle(), e.getAnnotationText(), start, formatTimestamp(start), end, formatTimestamp(end))
+
+
+def saveMetricsSummary(filename = None):
+	"""Log the JSON summary of the metrics (see metrics.py) at the end of a run, and write it to a file.
+	:param filename: (optional) the path and file name of the summary, replaced at each run
+	:type filename: a String object
+	"""
+	summary = metrics.registry.getSummary()
+	summary['time'] = int(time.time())
+	text = json.dumps(summary, sort_keys = True)
+	l.info("metrics summary: %s", text)
+	if filename is None:
+		return
+	try:
+		tmpFile = filename + '.tmp'
+		with open(tmpFile, mode='w') as outfile:
+			outfile.write(text + '\n')
+		os.replace(tmpFile, filename)
+	except OSError as e:
+		l.error('Unable to write metrics summary %s: %s', filename, e)
+
+
+def printDeadLetters(state):
+	"""Print the annotations of the dead-letter queue, one JSON object per line.
+	:param state: the state store
+	:type state: a StateStore object
+	"""
+	deadLetters = state.getDeadLetters()
+	for spoolId, tenant, title, text, start, end, attempts, error, created, failed in deadLetters:
+		print(json.dumps({ 'id': spoolId, 'tenant': tenant, 'title': title, 'text': text, 'start': start, 'end': end,
+			'attempts': attempts, 'error': error, 'created': epochToDate(created), 'failed': epochToDate(failed) }))
+	spooled, count = state.getSpoolCounts()
+	print('%d annotation(s) in the dead-letter queue, %d annotation(s) waiting in the spool' % (count, spooled), file = sys.stderr)
+
+
+def selectorIdOf(e):
+	"""Return the ID of the events selector of an event (its event definition ID, EVENTS_SELECTOR_ECCU for ECCU events).
+	:type e: an Event object
+	:returns: a String object
+	"""
+	return EVENTS_SELECTOR_ECCU if isinstance(e, EccuEvent) else e.getEventDefinitionId()
 
 
+def coalescingWindowOf(eventsSelector, defaultWindow):
+	"""Return a function giving the coalescing window of an event: the window set for its
+	selector in the events selector file, the default window otherwise.
+	:param eventsSelector: a dictionary to select events during parsing
+	:param defaultWindow: the default coalescing window in seconds
+	:type defaultWindow: an int
+	:returns: a function taking an Event object and returning an int
+	"""
+	def windowOf(e):
+		selector = eventsSelector.get(selectorIdOf(e))
+		if selector is None or selector[2] is None:
+			return defaultWindow
+		return selector[2]
+	return windowOf
+
+
+def publishEvents(dispatcher, events, workers, state = None, callback = None, coalescer = None, tenant = None, spool = None):
+	"""Send one annotation per event (or per group of coalesced events) to mPulse.
+	:param dispatcher: the dispatcher used to send the annotations
+	:type dispatcher: an AnnotationDispatcher object
+	:param events: the events to be annotated
+	:type events: an iterable of Event objects
+	:param workers: maximum number of annotations in flight
+	:type workers: an int
+	:param state: (optional) the state store used to skip the events already published and track progress
+	:type state: a StateStore object
+	:param callback: (optional) a function called with each event and its status once processed
+		(events already published are reported with STATUS_SUCCESS)
+	:type callback: a callable
+	:param coalescer: (optional) the coalescer merging bursts of events into a single annotation
+	:type coalescer: an EventCoalescer object
+	:param tenant: (optional) the tenant name in multi-tenant mode: events are recorded as published per tenant
+	:type tenant: a String object
+	:param spool: (optional) the spool each annotation is written to before it is sent (requires state): an annotation
+		that cannot be sent is kept in the spool (STATUS_SPOOLED) and its events are not fetched again
+	:type spool: an AnnotationSpool object
+	:returns: a python Dictionary with the number of events per status
+	"""
+	results = { STATUS_SUCCESS: 0, STATUS_RETRY: 0, STATUS_FAILED: 0, STATUS_SPOOLED: 0 }
+	spoolIds = {}		# spool ID of each annotation in flight
+	claims = {}			# events claimed for each annotation in flight sent without spooling
+
+	def publishedKey(e):
+		return e.SOURCE if tenant is None else tenant + '/' + e.SOURCE
+
+	def skip(e):
+		l.info("annotation for event %s already published, skipped", e.getEventId())
+		for x in e.getEvents():
+			state.trackEvent(x.SOURCE, toEpochSeconds(x.getEventStartTime()), True)
+			if callback is not None:
+				callback(x, STATUS_SUCCESS)
+
+	def unpublished(events):
+		for e in events:
+			# An aggregated event is published again unless all the events merged into it were published
+			if state is not None and all(state.isPublished(publishedKey(x), x.getEventId()) for x in e.getEvents()):
+				skip(e)
+				continue
+			yield e
+
+	def claim(e):
+		# Returns False if the events of the annotation were recorded as published by another run
+		published = [ (publishedKey(x), x.getEventId()) for x in e.getEvents() ]
+		if spool is not None:
+			spoolId = spool.add(e, published, tenant or '')
+			if spoolId is False:
+				return False
+			if spoolId is not None:
+				spoolIds[id(e)] = spoolId
+				return True
+		if state is not None:
+			try:
+				published = state.claimPublished(published)
+			except sqlite3.Error as ex:
+				# The annotation is sent anyway, its events being recorded once sent
+				l.error("unable to claim the events of annotation %s, sending it anyway: %s", e.getEventId(), ex)
+				return True
+			if not published:
+				return False
+			claims[id(e)] = published
+		return True
+
+	def claimed(events):
+		# The events of an annotation are recorded as published right before it is sent: when runs
+		# overlap, the annotation is only sent by the run that recorded them first
+		for e in events:
+			if not claim(e):
+				skip(e)
+				continue
+			logAnnotation(e)
+			yield e
+
+	selected = unpublished(events)
+	if coalescer is not None:
+		selected = coalescer.coalesce(selected)
+	for annotation, status in dispatcher.dispatchEvents(claimed(selected), workers):
+		# Events of a spooled annotation are already recorded as published
+		spoolId = spoolIds.pop(id(annotation), None)
+		claimedEvents = claims.pop(id(annotation), None)
+		if spoolId is not None:
+			status = spool.settle(spoolId, status)
+		elif claimedEvents is not None and status != STATUS_SUCCESS:
+			# The events are left to a later run
+			try:
+				state.releasePublished(claimedEvents)
+			except sqlite3.Error as ex:
+				l.error("unable to release the events of annotation %s, they will not be published again: %s", annotation.getEventId(), ex)
+		if status != STATUS_SUCCESS:
+			l.error("annotation for event %s not added (%s)", annotation.getEventId(), status)
+		# A coalesced annotation stands for several events
+		for e in annotation.getEvents():
+			results[status] += 1
+			if state is not None:
+				if status == STATUS_SUCCESS and spoolId is None and claimedEvents is None:
+					state.markPublished(publishedKey(e), e.getEventId())
+				state.trackEvent(e.SOURCE, toEpochSeconds(e.getEventStartTime()), status != STATUS_RETRY)
+			if callback is not None:
+				callback(e, status)
+	return results
+
+
+def publishTenantEvents(tenants, tenantSelector, events, workers, state = None, spool = None, routes = None):
+	"""Route each event to the tenants whose events selector matches it, and publish the annotations
+	of each tenant concurrently, through its own queue, dispatcher (security token and rate limit) and coalescer.
+	:param tenants: the tenants
+	:type tenants: a List of Tenant objects
+	:param tenantSelector: the union of the events selectors of the tenants, the events were parsed with
+	:type tenantSelector: a TenantSelector object
+	:param events: the events to be annotated
+	:type events: an iterable of Event objects
+	:param workers: maximum number of annotations in flight, per tenant
+	:type workers: an int
+	:param state: (optional) the state store used to skip the events already published and track progress
+	:type state: a StateStore object
+	:param spool: (optional) the spool each annotation is written to before it is sent (see publishEvents)
+	:type spool: an AnnotationSpool object
+	:param routes: (optional) the tenant name of the events already routed (see aggregateTenantECCUEvents)
+	:type routes: a python Dictionary where key is the Event object and value the tenant name
+	:returns: a python Dictionary with the number of events per status (all tenants) and a boolean, False if the 
+		publication of a tenant failed
+	"""
+	def routesOf(e):
+		if routes:
+			name = routes.pop(e, None)
+			if name is not None:
+				return [ name ]
+		return [ tenant.name for tenant, criteria in tenantSelector.routesOf(selectorIdOf(e)) if e.matchCriteria(criteria) ]
+
+	router = EventRouter(l, DEFAULT_QUEUE_SIZE)
+	coalescers = {}
+	for tenant in tenants:
+		coalescer = coalescers[tenant.name] = EventCoalescer(l, coalescingWindowOf(tenant.selector, tenant.coalescingWindow))
+		router.addConsumer(tenant.name, lambda events, tenant = tenant, coalescer = coalescer:
+			publishEvents(tenant.dispatcher, events, workers, state, coalescer = coalescer, tenant = tenant.name, spool = spool))
+	tenantResults = router.route(events, routesOf)
+
+	results = { STATUS_SUCCESS: 0, STATUS_RETRY: 0, STATUS_FAILED: 0, STATUS_SPOOLED: 0 }
+	for name, stats in router.getStats().items():
+		coalescerStats = coalescers[name].getStats()
+		l.info("tenant '%s': %d event(s) routed, %d published as %d annotation(s)", name, stats['events'], coalescerStats['events'], coalescerStats['annotations'])
+		for status, count in tenantResults.get(name, {}).items():
+			results[status] += count
+	return results, len(tenantResults) == len(tenants)
+
+
+def annotate(sess, dispatcher, eventsSelector, state, fromtime, totime, pagesInFlight, timeSlices, eccuWindow, publishWorkers, coalescingWindow = DEFAULT_COALESCING_WINDOW, tenants = None):
+	"""Query EventViewer and ECCU APIs once, publish the annotations and save the checkpoints.
+	Each source resumes from its checkpoint when it is more recent than the start time.
+	:param sess: a session to send HTTP request to Akamai APIs.
+	:type sess: Session
+	:param dispatcher: the dispatcher used to send the annotations
+	:type dispatcher: an AnnotationDispatcher object
+	:param eventsSelector: a dictionary to select events during parsing
+	:param state: the state store with checkpoints and published events
+	:type state: a StateStore object
+	:param fromtime: start date after which the events should be returned (e.g. 2018-12-13T15:00:00), may be empty
+	:param totime: (optional) end date before which the events should be returned
+	:param pagesInFlight: maximum number of EventViewer pages downloaded at the same time
+	:param timeSlices: number of time slices fetched in parallel
+	:param eccuWindow: the ECCU aggregation time window in seconds
+	:param publishWorkers: maximum number of annotations in flight
+	:param coalescingWindow: the default coalescing window in seconds (see coalescingWindowOf)
+	:param tenants: (optional) the tenants of a multi-tenant run, dispatcher being None and eventsSelector
+		the union of their selectors (see publishTenantEvents)
+	:type tenants: a List of Tenant objects
+	:returns: a python Dictionary with the number of events per status
+	"""
+	pollTime = int(time.time())
+	if totime is not None:
+		pollTime = min(pollTime, dateToEpoch(totime))
+	elif timeSlices > 1:
+		totime = epochToDate(pollTime)
+
+	fromtimeEventViewer = fromtime
+	checkpoint = state.getCheckpoint('eventviewer')
+	if checkpoint is not None and (fromtime == '' or checkpoint > dateToEpoch(fromtime)):
+		fromtimeEventViewer = epochToDate(checkpoint)
+		l.info("resuming EventViewer events from checkpoint %s", fromtimeEventViewer)
+	fromtimeTS = str(dateToEpoch(fromtime)) if fromtime != '' else '0'
+	checkpoint = state.getCheckpoint('eccu')
+	if checkpoint is not None and checkpoint > int(fromtimeTS):
+		fromtimeTS = str(checkpoint)
+		l.info("resuming ECCU events from checkpoint %s", formatTimestamp(fromtimeTS))
+
+	# Annotations left by the previous runs are sent first
+	spool = AnnotationSpool(l, state)
+	if tenants is None:
+		spool.drain(dispatcher, publishWorkers)
+	else:
+		for tenant in tenants:
+			spool.drain(tenant.dispatcher, publishWorkers, tenant.name)
+
+	# EventViewer and ECCU APIs are queried concurrently and their events are published 
+	# while the next pages are still being fetched and parsed
+	sources = SourceMerger(l, DEFAULT_QUEUE_SIZE)
+	sources.addSource('eventviewer', lambda: getEventViewerEvents(sess, fromtimeEventViewer, eventsSelector, totime, pagesInFlight, timeSlices))
+	if tenants is None:
+		sources.addSource('eccu', lambda: getAggregatedECCUEvents(sess, fromtimeTS, eventsSelector, eccuWindow, state, True))
+	else:
+		# ECCU events are routed to the tenants before being aggregated
+		eccuRoutes = {}
+		sources.addSource('eccu', lambda: aggregateTenantECCUEvents(eventsSelector,
+			getECCUEvents(sess, fromtimeTS, eventsSelector, state, True), eccuWindow, eccuRoutes))
+	if tenants is None:
+		coalescer = EventCoalescer(l, coalescingWindowOf(eventsSelector, coalescingWindow))
+		results = publishEvents(dispatcher, sources, publishWorkers, state, coalescer = coalescer, spool = spool)
+		coalescerStats = coalescer.getStats()
+		l.info("%d event(s) published as %d annotation(s)", coalescerStats['events'], coalescerStats['annotations'])
+		complete = True
+	else:
+		results, complete = publishTenantEvents(tenants, eventsSelector, sources, publishWorkers, state, spool, eccuRoutes)
+	spool.updateMetrics()
+
+	# A source that failed may have skipped some events: its checkpoint is not moved,
+	# nor the checkpoints of any source when the publication of a tenant failed
+	for name, sourceStats in sources.getStats().items():
+		# The validators of ECCU requests are only saved once they are parsed: they are kept when
+		# the request failed, and forgotten when the events returned were not all published
+		if name == 'eccu' and sourceStats['error'] is None and (not sourceStats['done'] or not complete or state.hasPending(name)):
+			# ECCU requests will be downloaded again (not conditionally) to retry the events not published
+			state.setValidators(name, None, None)
+		if sourceStats['done'] and complete:
+			state.trackEvent(name, pollTime - CHECKPOINT_SAFETY_MARGIN, True)
+			checkpoint = state.saveCheckpoint(name)
+			l.info("checkpoint of source '%s' saved at %s", name, formatTimestamp(checkpoint))
+	return results
+
+
+def backfill(sess, dispatcher, eventsSelector, state, plan, pagesInFlight, fetchers, eccuWindow, publishWorkers, coalescingWindow = DEFAULT_COALESCING_WINDOW):
+	"""Publish the annotations of a past time range, following a resumable work plan.
+	The time slices of the plan are fetched in parallel and each of them is marked as done 
+	once all its events have been published. The events returned by two slices (at their
+	boundaries) are only published once. Checkpoints are not modified.
+	:param sess: a session to send HTTP request to Akamai APIs.
+	:type sess: Session
+	:param dispatcher: the dispatcher used to send the annotations
+	:type dispatcher: an AnnotationDispatcher object
+	:param eventsSelector: a dictionary to select events during parsing
+	:param state: the state store with published events
+	:type state: a StateStore object
+	:param plan: the backfill work plan
+	:type plan: a BackfillPlan object
+	:param pagesInFlight: maximum number of EventViewer pages downloaded at the same time, per slice
+	:param fetchers: number of time slices fetched at the same time
+	:param eccuWindow: the ECCU aggregation time window in seconds
+	:param publishWorkers: maximum number of annotations in flight
+	:param coalescingWindow: the default coalescing window in seconds (see coalescingWindowOf)
+	:returns: a python Dictionary with the number of events per status
+	"""
+	lock = threading.Lock()
+	seen = set()			# events already returned by a slice
+	itemOf = {}				# work item of each event waiting to be published
+	expected = {}			# number of events to be processed per work item
+	processed = {}			# number of events processed per work item
+	retried = set()			# work items with events that will have to be published again
+
+	def tagged(item, events):
+		for e in events:
+			with lock:
+				key = (e.SOURCE, e.getEventId())
+				if key in seen:
+					continue
+				seen.add(key)
+				# The events merged into an aggregated event are processed (and reported) one by one
+				for x in e.getEvents():
+					itemOf[id(x)] = item
+				expected[item] = expected.get(item, 0) + len(e.getEvents())
+			yield e
+
+	def eccuEvents():
+		endTS = dateToEpoch(plan.plan['to'])
+		for e in getAggregatedECCUEvents(sess, str(dateToEpoch(plan.plan['from'])), eventsSelector, eccuWindow, state):
+			if int(e.getEventStartTime()) < endTS:
+				yield e
+
+	spool = AnnotationSpool(l, state)
+	spool.drain(dispatcher, publishWorkers)
+
+	sources = SourceMerger(l, DEFAULT_QUEUE_SIZE, fetchers)
+	pending = []
+	for start, end in plan.getPendingSlices():
+		sources.addSource(start, lambda start = start, end = end: tagged(start, getEventViewerEvents(sess, start, eventsSelector, end, pagesInFlight)))
+		pending.append(start)
+	if not plan.isDone(ECCU_WORK_ITEM):
+		sources.addSource(ECCU_WORK_ITEM, lambda: tagged(ECCU_WORK_ITEM, eccuEvents()))
+		pending.append(ECCU_WORK_ITEM)
+	done, total = plan.getProgress()
+	l.info("backfill from %s to %s: %d/%d work item(s) already done", plan.plan['from'], plan.plan['to'], done, total)
+
+	def sweep():
+		# A work item is done once entirely fetched without error and all its events were processed
+		stats = sources.getStats()
+		for item in list(pending):
+			if stats[item]['error'] is None and stats[item]['done'] and processed.get(item, 0) >= expected.get(item, 0) and item not in retried:
+				pending.remove(item)
+				plan.markDone(item)
+				done, total = plan.getProgress()
+				l.info("backfill work item %s done (%d/%d)", item, done, total)
+
+	def onResult(e, status):
+		with lock:
+			item = itemOf.pop(id(e))
+			processed[item] = processed.get(item, 0) + 1
+			if status == STATUS_RETRY:
+				retried.add(item)
+			sweep()
+
+	coalescer = EventCoalescer(l, coalescingWindowOf(eventsSelector, coalescingWindow))
+	results = publishEvents(dispatcher, sources, publishWorkers, state, onResult, coalescer, spool = spool)
+	spool.updateMetrics()
+	with lock:
+		sweep()
+	if pending:
+		stats = sources.getStats()
+		for item in pending:
+			if stats[item]['error'] is not None:
+				l.error("backfill work item %s failed: %s", item, stats[item]['error'])
+		l.error("%d backfill work item(s) not done, run the same backfill again to resume", len(pending))
+	return results
+
 
 def main(argv):
 	
 	global l
 	global baseUrl
 
-	initLogger()
+	log = initLogger()
 	l.info("mpulse-annotator is starting...")
 
+	# 'backfill' command: publish the annotations of a past time range (--from and --to)
+	# 'deadletters' and 'replay' commands: list and replay the annotations of the dead-letter queue
+	command = argv[0] if len(argv) > 0 and argv[0] in ('backfill', 'deadletters', 'replay') else None
+	backfillMode = command == 'backfill'
+	if command is not None:
+		argv = argv[1:]
+
 	# Read and parse the command line arguments
 	baseUrl = ''				# -u command line argument
 	clientToken = ''			# -c command line argument
 	clientSecret = ''			# -s command line argument
 	accessToken = ''			# -o command line argument
 	fromtime = ''				# -t command line argument
+	totime = None				# -e command line argument
 	apitoken = ''      			# -a command line argument
 	mpulsetenant = ''			# -m command line argument
 	eventsSelectorFile = None	# -f command line argument
+	stateFile = DEFAULT_STATE_FILE	# -d command line argument
+	tokenCacheFile = DEFAULT_TOKEN_CACHE_FILE	# -k command line argument
+	daemon = False				# --daemon command line argument
+	backfillPlanFile = DEFAULT_BACKFILL_PLAN_FILE	# --plan command line argument
+	backfillSlice = DEFAULT_SLICE_DURATION		# --slice command line argument
+	backfillFetchers = DEFAULT_BACKFILL_FETCHERS	# --fetchers command line argument
+	pollInterval = DEFAULT_POLL_INTERVAL	# -i command line argument
 	simulateAdd = False         # -x command line argument
+	annotationRate = DEFAULT_ANNOTATION_RATE	# -r command line argument
+	annotationBurst = DEFAULT_ANNOTATION_BURST	# -b command line argument
+	publishWorkers = DEFAULT_PUBLISH_WORKERS	# -w command line argument
+	pagesInFlight = DEFAULT_PAGES_IN_FLIGHT		# -p command line argument
+	timeSlices = DEFAULT_TIME_SLICES			# -n command line argument
+	eccuWindow = DEFAULT_ECCU_AGGREGATION_WINDOW	# -g command line argument
+	coalescingWindow = DEFAULT_COALESCING_WINDOW	# --coalesce command line argument
+	mpulseUrl = DEFAULT_MPULSE_URL	# --mpulseurl command line argument
+	metricsPort = None			# --metrics-port command line argument
+	metricsHost = DEFAULT_METRICS_HOST	# --metrics-host command line argument
+	metricsFile = None			# --metrics-file command line argument
+	profileMode = None			# --profile command line argument
+	tenantsFile = None			# --tenants command line argument
+	replayIds = None			# --id command line argument
 	try:
-	  opts, args = getopt.getopt(argv,"hu:c:s:o:t:a:m:f:x",["baseurl","clienttoken", "clientsecret","accesstoken","fromtime=","apitoken","mpulsetenant","eventsselector","simulate"])
+	  opts, args = getopt.getopt(argv,"hu:c:s:o:t:e:a:m:f:xr:b:w:p:n:g:d:i:k:",["baseurl","clienttoken", "clientsecret","accesstoken","fromtime=","apitoken","mpulsetenant","eventsselector","simulate","rate=","burst=","workers=","totime=","pages=","slices=","eccuwindow=","statefile=","daemon","interval=","tokencache=","from=","to=","plan=","slice=","fetchers=","coalesce=","mpulseurl=","metrics-port=","metrics-host=","metrics-file=","profile=","log-level=","log-json","tenants=","id="])
 	except getopt.GetoptError:
-	  print('mpulse-annotator.py -u <baseurl> -c <clienttoken> -s <clientsecret> -o <accesstoken> -t <fromtime> -a <apitoken> -m <mpulsetenant> -f <events-selector-file>')
+	  print('mpulse-annotator.py -u <baseurl> -c <clienttoken> -s <clientsecret> -o <accesstoken> -t <fromtime> [-e <totime>] -a <apitoken> -m <mpulsetenant> -f <events-selector-file> -r <annotations-per-second> -b <burst> -w <workers> -p <pages-in-flight> -n <time-slices> -g <eccu-window> -d <state-file> -k <token-cache-file> [--coalesce <seconds>] [--profile timers|cprofile|sampling] [--log-level <level>] [--log-json] [--tenants <tenants-file>] [--daemon -i <poll-interval>]')
 	  sys.exit(2)
 	for opt, arg in opts:
 	  if opt == '-h':
-	     print('mpulse-annotator.py -u <baseurl> -c <clienttoken> -s <clientsecret> -o <accesstoken> -t <fromtime> -a <apitoken> -m <mpulsetenant> -f <events-selector-file>')
+	     print('mpulse-annotator.py -u <baseurl> -c <clienttoken> -s <clientsecret> -o <accesstoken> -t <fromtime> [-e <totime>] -a <apitoken> -m <mpulsetenant> -f <events-selector-file> -r <annotations-per-second> -b <burst> -w <workers> -p <pages-in-flight> -n <time-slices> -g <eccu-window> -d <state-file> -k <token-cache-file> [--coalesce <seconds>] [--profile timers|cprofile|sampling] [--log-level <level>] [--log-json] [--tenants <tenants-file>] [--daemon -i <poll-interval>]')
 	     sys.exit()
 	  elif opt in ("-u", "--baseurl"):
-	     baseUrl = 'https://%s' % arg
+	     # A scheme can be given to use another server (e.g. http://localhost:8080 for a mock server)
+	     baseUrl = arg if '://' in arg else 'https://%s' % arg
 	  elif opt in ("-c", "--clienttoken"):
 	     clientToken = arg
 	  elif opt in ("-s", "--clientsecret"):
 	     clientSecret = arg
 	  elif opt in ("-o", "--accesstoken"):
 	     accessToken = arg
-	  elif opt in ("-t", "--fromtime"):
+	  elif opt in ("-t", "--fromtime", "--from"):
 	     fromtime = arg
-	     l.info('events will be filtered starting from ' + fromtime)
+	     l.info('events will be filtered starting from %s', fromtime)
+	  elif opt in ("-e", "--totime", "--to"):
+	     totime = arg
+	     l.info('events will be filtered until %s', totime)
 	  elif opt in ("-a", "--apitoken"):
 	     apitoken = arg
-	     l.info("using mPulse API token: " + apitoken)
+	     l.info("using mPulse API token: %s", apitoken)
 	  elif opt in ("-m", "--mpulsetenant"):
 	     mpulsetenant = arg
-	     l.info("using mPulse tenant: " + mpulsetenant)
+	     l.info("using mPulse tenant: %s", mpulsetenant)
 	  elif opt in ("-f", "--eventsselector"):
 	     eventsSelectorFile = arg
-	     l.info("using events selector file: " + eventsSelectorFile)
+	     l.info("using events selector file: %s", eventsSelectorFile)
 	  elif opt in ("-x"):
 	  	 simulateAdd = True
+	  elif opt in ("-r", "--rate"):
+	     annotationRate = float(arg)
+	     l.info("annotations will be sent at a maximum rate of %s per second", arg)
+	  elif opt in ("-b", "--burst"):
+	     annotationBurst = int(arg)
+	     l.info("annotations will be sent in bursts of up to %s", arg)
+	  elif opt in ("-w", "--workers"):
+	     publishWorkers = int(arg)
+	     l.info("up to %s annotation(s) will be sent concurrently", arg)
+	  elif opt in ("-p", "--pages"):
+	     pagesInFlight = int(arg)
+	     l.info("up to %s EventViewer page(s) will be downloaded concurrently", arg)
+	  elif opt in ("-n", "--slices"):
+	     timeSlices = int(arg)
+	     l.info("EventViewer time range will be split into %s time slice(s)", arg)
+	  elif opt in ("-g", "--eccuwindow"):
+	     eccuWindow = int(arg)
+	     l.info("ECCU events requested within the same %s seconds will be aggregated", arg)
+	  elif opt in ("-d", "--statefile"):
+	     stateFile = arg
+	     l.info("using state file: %s", stateFile)
+	  elif opt in ("-k", "--tokencache"):
+	     tokenCacheFile = arg
+	     l.info("using mPulse security token cache: %s", tokenCacheFile)
+	  elif opt == "--log-level":
+	     try:
+	        log.setLevel(arg)
+	     except ValueError:
+	        print('mpulse-annotator.py: --log-level must be one of DEBUG, INFO, WARNING, ERROR or CRITICAL')
+	        sys.exit(2)
+	  elif opt == "--log-json":
+	     log.setJson()
+	  elif opt == "--profile":
+	     if arg not in PROFILE_MODES:
+	        print('mpulse-annotator.py: --profile must be one of ' + ', '.join(PROFILE_MODES))
+	        sys.exit(2)
+	     profileMode = arg
+	  elif opt == "--metrics-port":
+	     metricsPort = int(arg)
+	  elif opt == "--metrics-host":
+	     metricsHost = arg
+	  elif opt == "--metrics-file":
+	     metricsFile = arg
+	     l.info("metrics summary will be written to %s", metricsFile)
+	  elif opt == "--mpulseurl":
+	     mpulseUrl = arg
+	     l.info("using mPulse API base URL: %s", mpulseUrl)
+	  elif opt == "--coalesce":
+	     coalescingWindow = int(arg)
+	     l.info("events of the same class occurring within %s seconds will be coalesced into a single annotation", arg)
+	  elif opt == "--tenants":
+	     tenantsFile = arg
+	     l.info("using multi-tenant configuration file: %s", tenantsFile)
+	  elif opt == "--id":
+	     try:
+	        replayIds = [ int(i) for i in arg.split(',') ]
+	     except ValueError:
+	        print('mpulse-annotator.py: --id must be a list of dead letter IDs separated by commas (e.g. --id 12,15)')
+	        print('mpulse-annotator.py replay -d <state-file> [--id <id>[,<id>...]]')
+	        sys.exit(2)
+	  elif opt == "--plan":
+	     backfillPlanFile = arg
+	  elif opt == "--slice":
+	     backfillSlice = int(arg)
+	  elif opt == "--fetchers":
+	     backfillFetchers = int(arg)
+	  elif opt == "--daemon":
+	     daemon = True
+	  elif opt in ("-i", "--interval"):
+	     pollInterval = int(arg)
+
+	if command in ('deadletters', 'replay'):
+		state = StateStore(stateFile)
+		if command == 'deadletters':
+			printDeadLetters(state)
+		else:
+			count = state.replayDeadLetters(replayIds)
+			l.info("%d annotation(s) moved from the dead-letter queue back to the spool", count)
+			print('%d annotation(s) moved back to the spool, they will be sent by the next run' % count)
+		state.close()
+		return
 
+	metricsServer = MetricsServer(l, metricsPort, metricsHost) if metricsPort else None
+	if profileMode is not None:
+		l.info("profiling enabled (%s)", profileMode)
+		profiler.enable(profileMode)
 
-	# Get a mPulse API handler and retrieve a security token valid for this session
 	if simulateAdd:
 		l.info('[SIMULATE] Important: No annotation will be added to mPulse dashboard (simulation mode)')
-	mpulse = MPulseAPIHandler(l, simulateAdd)
-	mpulsetoken = mpulse.getSecurityToken(apitoken, mpulsetenant)
+	loadEventPlugins(l)
+	tenants = None
+	if tenantsFile is not None:
+		if backfillMode:
+			print('mpulse-annotator.py: --tenants is not supported by the backfill command')
+			sys.exit(2)
+		# Events are fetched and parsed once, then published to each tenant with its own token and rate limit
+		try:
+			tenants = loadTenants(l, tenantsFile, annotationRate, annotationBurst, coalescingWindow, tokenCacheFile)
+		except (OSError, ValueError, KeyError, IndexError) as e:
+			l.error("unable to load the tenants of %s: %s", tenantsFile, e)
+			print('mpulse-annotator.py: unable to load the tenants of ' + tenantsFile + ': ' + str(e))
+			sys.exit(2)
+		for tenant in tenants:
+			tenant.open(simulateAdd, publishWorkers, mpulseUrl)
+		dispatcher = None
+		eventsSelector = TenantSelector(l, tenants)
+	else:
+		# Get a mPulse API handler and retrieve a security token valid for this session
+		mpulse = MPulseAPIHandler(l, simulateAdd, publishWorkers, mpulseUrl)
+		tokens = SecurityTokenManager(l, mpulse, apitoken, mpulsetenant, tokenCacheFile)
+		tokens.getToken()
+		dispatcher = AnnotationDispatcher(l, mpulse, tokens, annotationRate, annotationBurst)
 
-	# Create a dictionary to select events during parsing of API call responses
-	if eventsSelectorFile is None:
-		eventsSelectorFile = EVENTS_SELECTOR_FILE
-	l.info('loading events selector from file ' + eventsSelectorFile)
-	eventsSelector = parseEventsSelector(EVENTS_SELECTOR_FILE)
+		# Create a dictionary to select events during parsing of API call responses
+		if eventsSelectorFile is None:
+			eventsSelectorFile = EVENTS_SELECTOR_FILE
+		l.info('loading events selector from file %s', eventsSelectorFile)
+		eventsSelector = SelectorIndex(l, eventsSelectorFile)
 
 	sess = requests.Session()
-	l.info("session created on " + baseUrl + ", using client token '" + clientToken + "' and start time '" + fromtime + "'")
+	l.info("session created on %s, using client token '%s' and start time '%s'", baseUrl, clientToken, fromtime)
 	#sess.auth = EdgeGridAuth.from_edgerc(edgerc, edgercSection)
 	sess.auth = EdgeGridAuth(client_token = clientToken, client_secret = clientSecret, access_token = accessToken)
+	if profileMode is not None:
+		sess.auth = TimedAuth(sess.auth)
 	
-	events = []
-	events = getEventViewerEvents(sess, fromtime, eventsSelector)
-	for e in events:
-		l.info('The following annotation will be sent to mPulse API:')
-		l.info('  Title: ' + e.getAnnotationTitle())
-		l.info('   Text: ' + e.getAnnotationText())
-		l.info('  Start: ' + e.getEventStartTime())
-		mpulse.addAnnotation(mpulsetoken, e.getAnnotationTitle(), e.getAnnotationText(), e.getEventStartTime())
-		l.info('Pause ' + str(ANNOTATION_CREATE_DELAY) + ' seconds...')
-		time.sleep(ANNOTATION_CREATE_DELAY)
-
-	date_time_obj = datetime.datetime.strptime(fromtime + '.000+0000', '%Y-%m-%dT%H:%M:%S.%f%z')
-	fromtimeTS = str(int(date_time_obj.timestamp()))
-	events = getECCUEvents(sess, fromtimeTS, eventsSelector)
-	aggregateECCUEvents(events)
-	for e in events:
-		l.info('The following annotation will be sent to mPulse API:')
-		l.info("  Title: " + e.getAnnotationTitle())
-		l.info("   Text: " + e.getAnnotationText())
-		ts = e.getEventStartTime()
-		l.info("  Start: " + ts + " (" + datetime.datetime.utcfromtimestamp(int(ts)).strftime('%Y-%m-%d %H:%M:%S') + " UTC)")
-		if e.getEventEndTime() is not None:
-			ts = e.getEventEndTime()
-			l.info("    End: " + ts + " (" + datetime.datetime.utcfromtimestamp(int(ts)).strftime('%Y-%m-%d %H:%M:%S') + " UTC)")
-			mpulse.addAnnotation(mpulsetoken, e.getAnnotationTitle(), e.getAnnotationText(), e.getEventStartTime(), e.getEventEndTime())
-		else:
-			mpulse.addAnnotation(mpulsetoken, e.getAnnotationTitle(), e.getAnnotationText(), e.getEventStartTime())
-		l.info('Pause ' + str(ANNOTATION_CREATE_DELAY) + ' seconds...')
-		time.sleep(ANNOTATION_CREATE_DELAY)
+	if simulateAdd:
+		# Nothing is persisted in simulation mode since no annotation is actually published
+		state = StateStore(':memory:')
+	else:
+		state = StateStore(stateFile)
+	if backfillMode:
+		if fromtime == '' or totime is None:
+			print('mpulse-annotator.py backfill --from <fromtime> --to <totime> [--slice <seconds>] [--fetchers <number>] [--plan <plan-file>] ...')
+			sys.exit(2)
+		plan = BackfillPlan(backfillPlanFile, fromtime, totime, backfillSlice)
+		backfill(sess, dispatcher, eventsSelector, state, plan, pagesInFlight, backfillFetchers, eccuWindow, publishWorkers, coalescingWindow)
+		saveMetricsSummary(metricsFile)
+	elif not daemon:
+		if fromtime == '' and state.getCheckpoint('eventviewer') is None:
+			l.error("no start time (-t) given and no checkpoint found")
+			print('mpulse-annotator.py: a start time (-t) is required for the first run')
+			sys.exit(2)
+		annotate(sess, dispatcher, eventsSelector, state, fromtime, totime, pagesInFlight, timeSlices, eccuWindow, publishWorkers, coalescingWindow, tenants)
+		saveMetricsSummary(metricsFile)
+	else:
+		if fromtime == '' and state.getCheckpoint('eventviewer') is None:
+			l.error("no start time (-t) given and no checkpoint found")
+			print('mpulse-annotator.py: a start time (-t) is required for the first run')
+			sys.exit(2)
+		# Sessions, selectors and mPulse token are kept between polls, stop gracefully on SIGTERM/SIGINT
+		stopping = threading.Event()
+		def stop(signum, frame):
+			l.info("signal %d received, stopping after the current poll...", signum)
+			stopping.set()
+		signal.signal(signal.SIGTERM, stop)
+		signal.signal(signal.SIGINT, stop)
+		l.info("daemon mode: polling every %d seconds", pollInterval)
+		# New CP codes or properties are picked up without restarting
+		eventsSelector.watch()
+		while not stopping.is_set():
+			annotate(sess, dispatcher, eventsSelector, state, fromtime, totime, pagesInFlight, timeSlices, eccuWindow, publishWorkers, coalescingWindow, tenants)
+			saveMetricsSummary(metricsFile)
+			delay = pollInterval * random.uniform(1 - DEFAULT_POLL_JITTER, 1 + DEFAULT_POLL_JITTER)
+			l.info("next poll in %.1f seconds", delay)
+			stopping.wait(delay)
 
+	eventsSelector.close()
+	state.close()
+	sess.close()
+	if tenants is None:
+		tokens.close()
+		mpulse.close()
+	else:
+		for tenant in tenants:
+			tenant.close()
+	if metricsServer is not None:
+		metricsServer.close()
+	profiler.stop(l, os.path.dirname(DEFAULT_LOGGER_FILE))
+	if tenants is None:
+		stats = dispatcher.getStats()
+		l.info("%d annotation(s) sent, %d failed, %d retried, effective rate %.3f annotation(s)/s", stats['sent'], stats['failed'], stats['retries'], stats['rate'])
+	else:
+		for tenant in tenants:
+			stats = tenant.dispatcher.getStats()
+			l.info("tenant '%s': %d annotation(s) sent, %d failed, %d retried, effective rate %.3f annotation(s)/s", tenant.name, stats['sent'], stats['failed'], stats['retries'], stats['rate'])
 	l.info("mpulse-annotator is stopping...")
 
 
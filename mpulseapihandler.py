@@ -1,12 +1,46 @@
+import time
 import requests
 import logging
 import json 
+from requests.adapters import HTTPAdapter
+
+from metrics import observeRequest
+
+# Base URL of mPulse APIs
+DEFAULT_MPULSE_URL = 'https://mpulse.soasta.com'
+
+# Connect and read timeouts in seconds of the requests to mPulse
+DEFAULT_MPULSE_TIMEOUT = (5.0, 30.0)
 
 class MPulseAPIHandler:
 
-	def __init__(self, logger, simulate = False):
+	def __init__(self, logger, simulate = False, poolSize = 10, baseUrl = DEFAULT_MPULSE_URL, timeout = DEFAULT_MPULSE_TIMEOUT):
+		"""
+		:param logger: the logger
+		:param simulate: if True, no annotation will be sent to mPulse
+		:type simulate: a boolean
+		:param poolSize: maximum number of keep-alive connections kept open to mPulse
+		:type poolSize: an int
+		:param baseUrl: the base URL of mPulse APIs (e.g. a local mock server for load tests)
+		:type baseUrl: a String
+		:param timeout: (optional) the connect and read timeouts in seconds of each request
+		:type timeout: a (float, float) tuple
+		"""
 		self.logger = logger
 		self.simulate = simulate
+		self.baseUrl = baseUrl.rstrip('/')
+		self.timeout = timeout
+		# A single session is shared by all the calls (and threads) so that 
+		# TCP and TLS connections to mPulse are reused
+		self.session = requests.Session()
+		adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = poolSize)
+		self.session.mount('https://', adapter)
+		self.session.mount('http://', adapter)
+
+	def close(self):
+		"""Close the connections kept open to mPulse.
+		"""
+		self.session.close()
 
 
 	def getSecurityToken(self, apiToken, tenant):
@@ -20,15 +54,23 @@ class MPulseAPIHandler:
 		:returns: a String with the security token, None in case of error
 		"""
 		payload = "{\"apiToken\": \"" + apiToken + "\", \"tenant\": \"" + tenant + "\"}"
-		self.logger.info("requesting an mPulse security token with: " + payload)
-		url = 'https://mpulse.soasta.com/concerto/services/rest/RepositoryService/v1/Tokens'
-		result = requests.put(url, data = payload, headers={'Content-Type':'application/json'})
+		self.logger.info("requesting an mPulse security token with: %s", payload)
+		url = self.baseUrl + '/concerto/services/rest/RepositoryService/v1/Tokens'
+		startTime = time.monotonic()
+		result = None
+		try:
+			result = self.session.put(url, data = payload, headers={'Content-Type':'application/json'}, timeout = self.timeout)
+		except requests.RequestException as e:
+			self.logger.error('No security token returned: %s', e)
+			return None
+		finally:
+			observeRequest('mpulse-tokens', startTime, result)
 		if (result.status_code == 200):
 			json_data = result.json()
-			self.logger.info('mPulse security token returned: ' + str(json_data['token']) )
+			self.logger.info('mPulse security token returned: %s', json_data['token'])
 			return str(json_data['token'])
 		else:
-			self.logger.error('Error ' + str(result.status_code) + ': no security token returned')
+			self.logger.error('Error %d: no security token returned', result.status_code)
 			return None
 
 	def addAnnotation(self, token, title, text, start, end = None):
@@ -44,23 +86,31 @@ class MPulseAPIHandler:
 		:type start: an int 
 		:param end: (optional) end time of the annotation in epoch time format in milliseconds
 		:type end: an int 
+		:returns: the HTTP response returned by mPulse, None in simulation mode
+		:raises requests.RequestException: if mPulse could not be reached or did not answer in time
 		"""
 		if end is None:
 			payload = "{\"title\":\"" + title + "\", \"start\": \"" + str(start) + "\", \"text\":\"" + text + "\"}"
 		else:
 			payload = "{\"title\":\"" + title + "\", \"start\": \"" + str(start) + "\", \"end\":\"" + str(end) + "\", \"text\":\"" + text + "\"}"
 		if self.simulate:
-			self.logger.info("[SIMULATE] adding new annotation: " + payload)	
-			return
-		self.logger.info("adding new annotation: " + payload)	
+			self.logger.info("[SIMULATE] adding new annotation: %s", payload)	
+			return None
+		self.logger.info("adding new annotation: %s", payload)	
 
 		#self.logger.info("WARNING: mpulse API handler disabled!")
 		#return
-		url = "https://mpulse.soasta.com/concerto/mpulse/api/annotations/v1"
-		result = requests.post(url, data = payload, headers={'Content-Type':'application/json', 'X-Auth-Token': token })
+		url = self.baseUrl + "/concerto/mpulse/api/annotations/v1"
+		startTime = time.monotonic()
+		result = None
+		try:
+			result = self.session.post(url, data = payload, headers={'Content-Type':'application/json', 'X-Auth-Token': token }, timeout = self.timeout)
+		finally:
+			observeRequest('mpulse-annotations', startTime, result)
 		if (result.status_code == 200):
 			json_data = result.json()
 			self.logger.info('annotation successfully added')
 		else:
-			self.logger.error('Error ' + str(result.status_code) + ': annotation not added!')
+			self.logger.error('Error %d: annotation not added!', result.status_code)
+		return result
 
@@ -0,0 +1,206 @@
+import time
+import queue
+import threading
+from collections import deque
+
+from metrics import QUEUE_DEPTH
+
+
+# Marker put in the queue by a producer thread when it is done
+_END = object()
+
+
+class SourceMerger:
+	"""
+	Consume several event sources concurrently (one background thread per source,
+	up to a maximum number of threads) and return their items through a single bounded queue.
+	Producer threads block when the queue is full (backpressure), so the memory
+	used never exceeds maxSize items, whatever the size of the sources.
+	Sources are isolated from each other: an error raised by a source is logged and
+	only stops this source, and a slow source does not delay the items of the others.
+	"""
+
+	def __init__(self, logger, maxSize = 100, maxConcurrent = None):
+		"""
+		:param logger: the logger
+		:param maxSize: maximum number of items waiting in the queue
+		:type maxSize: an int
+		:param maxConcurrent: (optional) maximum number of sources consumed at the same time, 
+			the other sources wait for a thread to be available (all sources at once if None)
+		:type maxConcurrent: an int
+		"""
+		self.logger = logger
+		self.maxConcurrent = maxConcurrent
+		self.queue = queue.Queue(maxsize = maxSize)
+		self.stop = threading.Event()
+		self.sources = []
+		self.stats = {}
+
+	def addSource(self, name, source):
+		"""Register a new source.
+		:param name: the source name (e.g. eventviewer)
+		:type name: a String object
+		:param source: a function returning an iterable of items (e.g. a generator of Event objects),
+			called from the source thread
+		:type source: a callable
+		"""
+		self.sources.append((name, source))
+		self.stats[name] = { 'events': 0, 'seconds': 0.0, 'error': None, 'done': False }
+
+	def _put(self, item):
+		# Do not block forever if the consumer is gone
+		while not self.stop.is_set():
+			try:
+				self.queue.put(item, timeout = 0.5)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+	def _produce(self, name, source):
+		stats = self.stats[name]
+		startTime = time.monotonic()
+		complete = False
+		try:
+			for item in source():
+				if not self._put(item):
+					return
+				stats['events'] += 1
+			complete = True
+		except Exception as e:
+			stats['error'] = str(e)
+			self.logger.error("Source '%s' failed: %s", name, e)
+		finally:
+			stats['seconds'] = time.monotonic() - startTime
+			stats['done'] = complete
+			self.logger.info("Source '%s' done: %d event(s) in %.3f seconds", name, stats['events'], stats['seconds'])
+
+	def _work(self, sources):
+		while not self.stop.is_set():
+			try:
+				name, source = sources.popleft()
+			except IndexError:
+				break
+			self._produce(name, source)
+		self._put(_END)
+
+	def __iter__(self):
+		"""Start the sources and return their items as soon as they are available.
+		:returns: a generator of items, in no particular order between sources
+		"""
+		sources = deque(self.sources)
+		running = len(self.sources)
+		if self.maxConcurrent is not None:
+			running = min(running, self.maxConcurrent)
+		for i in range(running):
+			thread = threading.Thread(target = self._work, args = (sources,), name = 'source-' + str(i), daemon = True)
+			thread.start()
+		try:
+			while running > 0:
+				item = self.queue.get()
+				QUEUE_DEPTH.set(self.queue.qsize())
+				if item is _END:
+					running -= 1
+					continue
+				yield item
+		finally:
+			self.stop.set()
+			QUEUE_DEPTH.set(0)
+
+	def getStats(self):
+		"""Return the statistics of each source.
+		:returns: a python Dictionary where key is the source name and value a Dictionary
+			with the number of events returned, the duration in seconds, the error (if any)
+			and whether the source was entirely consumed
+		"""
+		return self.stats
+
+
+class EventRouter:
+	"""
+	Route the items of a single stream to several consumers (e.g. the publishing pipeline of
+	each mPulse tenant). Each consumer reads its own bounded queue from a background thread,
+	so that a consumer waiting for its rate limit does not delay the items of the others until
+	its queue is full (backpressure). An item routed to several consumers is shared, not copied.
+	A consumer that failed is logged and no longer routed to.
+	"""
+
+	def __init__(self, logger, maxSize = 100):
+		"""
+		:param logger: the logger
+		:param maxSize: maximum number of items waiting in the queue of each consumer
+		:type maxSize: an int
+		"""
+		self.logger = logger
+		self.maxSize = maxSize
+		self.consumers = {}
+		self.results = {}
+		self.stats = {}
+
+	def addConsumer(self, name, consume):
+		"""Register a new consumer.
+		:param name: the consumer name (e.g. the tenant name)
+		:type name: a String object
+		:param consume: a function taking an iterable of items and returning a result,
+			called from the consumer thread
+		:type consume: a callable
+		"""
+		self.consumers[name] = (queue.Queue(maxsize = self.maxSize), consume, threading.Event())
+		self.stats[name] = { 'events': 0, 'error': None }
+
+	def _drain(self, items):
+		while True:
+			item = items.get()
+			if item is _END:
+				return
+			yield item
+
+	def _consume(self, name, items, consume, failed):
+		try:
+			self.results[name] = consume(self._drain(items))
+		except Exception as e:
+			self.stats[name]['error'] = str(e)
+			self.logger.error("Consumer '%s' failed: %s", name, e)
+			failed.set()
+
+	def _put(self, items, item, failed):
+		while not failed.is_set():
+			try:
+				items.put(item, timeout = 0.5)
+				return
+			except queue.Full:
+				pass
+
+	def route(self, items, routesOf):
+		"""Route each item to its consumers, then wait for all the consumers to be done.
+		:param items: the items to be routed
+		:type items: an iterable
+		:param routesOf: a function returning the names of the consumers of an item
+		:type routesOf: a callable
+		:returns: a python Dictionary where key is the consumer name and value its result
+			(consumers that failed have no result)
+		"""
+		threads = []
+		for name, (pending, consume, failed) in self.consumers.items():
+			thread = threading.Thread(target = self._consume, args = (name, pending, consume, failed), name = 'consumer-' + name, daemon = True)
+			thread.start()
+			threads.append(thread)
+		try:
+			for item in items:
+				for name in routesOf(item):
+					pending, consume, failed = self.consumers[name]
+					self._put(pending, item, failed)
+					self.stats[name]['events'] += 1
+		finally:
+			for pending, consume, failed in self.consumers.values():
+				self._put(pending, _END, failed)
+			for thread in threads:
+				thread.join()
+		return self.results
+
+	def getStats(self):
+		"""Return the statistics of each consumer.
+		:returns: a python Dictionary where key is the consumer name and value a Dictionary
+			with the number of items routed to the consumer and the error (if any)
+		"""
+		return self.stats
@@ -0,0 +1,244 @@
+import os
+import sys
+import time
+import json
+import pstats
+import cProfile
+import threading
+from requests.auth import AuthBase
+
+
+# Profiling modes: stage timers only, timers and cProfile, timers and sampled stacks
+PROFILE_TIMERS = 'timers'
+PROFILE_CPROFILE = 'cprofile'
+PROFILE_SAMPLING = 'sampling'
+PROFILE_MODES = (PROFILE_TIMERS, PROFILE_CPROFILE, PROFILE_SAMPLING)
+
+# Interval in seconds between two stack samples
+DEFAULT_SAMPLING_INTERVAL = 0.005
+
+# Marker of the end of an iteration
+_END = object()
+
+
+class _NullTimer:
+	"""Timer used when profiling is disabled: it does nothing."""
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _StageTimer:
+
+	__slots__ = ('profiler', 'name', 'startTime')
+
+	def __init__(self, profiler, name):
+		self.profiler = profiler
+		self.name = name
+
+	def __enter__(self):
+		self.startTime = time.perf_counter()
+		return self
+
+	def __exit__(self, *args):
+		self.profiler.record(self.name, time.perf_counter() - self.startTime)
+		return False
+
+
+class Profiler:
+	"""
+	Low overhead timers of the pipeline stages (fetch, sign, decode, parse, match, aggregate,
+	publish and the rate limit and retry waits), optionally completed with cProfile (all threads)
+	or with stacks sampled periodically (written in the collapsed format of flamegraph.pl and speedscope).
+	Stages run in several threads: their durations are cumulated thread time, not wall time.
+	When profiling is disabled, timers cost a single attribute lookup.
+	"""
+
+	def __init__(self):
+		self.enabled = False
+		self.mode = None
+		self.lock = threading.Lock()
+		self.stages = {}
+		self.startTime = None
+		self.profiles = []
+		self.samples = {}
+		self.sampler = None
+		self.stopSampling = threading.Event()
+
+	def enable(self, mode = PROFILE_TIMERS, samplingInterval = DEFAULT_SAMPLING_INTERVAL):
+		"""Start profiling (must be called before the worker threads are started).
+		:param mode: PROFILE_TIMERS, PROFILE_CPROFILE or PROFILE_SAMPLING
+		:type mode: a String object
+		:param samplingInterval: interval in seconds between two stack samples (PROFILE_SAMPLING)
+		:type samplingInterval: a float
+		"""
+		self.enabled = True
+		self.mode = mode
+		self.startTime = time.perf_counter()
+		if mode == PROFILE_CPROFILE:
+			# cProfile only profiles the thread it is enabled in: one profile per thread
+			threading.setprofile(self._profileThread)
+			profile = cProfile.Profile()
+			self.profiles.append(profile)
+			profile.enable()
+		elif mode == PROFILE_SAMPLING:
+			self.sampler = threading.Thread(target = self._sample, args = (samplingInterval,), name = 'profiler', daemon = True)
+			self.sampler.start()
+
+	def _profileThread(self, frame, event, arg):
+		# Called once by each new thread, replaced by the thread own profile
+		sys.setprofile(None)
+		profile = cProfile.Profile()
+		try:
+			profile.enable()
+		except ValueError:
+			# Python 3.12+ only allows one active cProfile: only the main thread is profiled
+			return
+		with self.lock:
+			self.profiles.append(profile)
+
+	def _sample(self, interval):
+		ownId = threading.get_ident()
+		while not self.stopSampling.wait(interval):
+			names = dict((t.ident, t.name) for t in threading.enumerate())
+			for threadId, frame in sys._current_frames().items():
+				if threadId == ownId:
+					continue
+				stack = []
+				while frame is not None:
+					code = frame.f_code
+					stack.append(code.co_name + ' (' + os.path.basename(code.co_filename) + ':' + str(code.co_firstlineno) + ')')
+					frame = frame.f_back
+				stack.append(names.get(threadId, 'thread'))
+				key = ';'.join(reversed(stack))
+				self.samples[key] = self.samples.get(key, 0) + 1
+
+	def stage(self, name):
+		"""Return a context manager timing a stage.
+		:param name: the stage name (e.g. fetch)
+		:type name: a String object
+		"""
+		if not self.enabled:
+			return _NULL_TIMER
+		return _StageTimer(self, name)
+
+	def iterate(self, name, iterable):
+		"""Return an iterator timing the production of each item of an iterable (e.g. a streaming decoder).
+		The stage is recorded once the iteration is over.
+		:param name: the stage name (e.g. decode)
+		:type name: a String object
+		"""
+		if not self.enabled:
+			return iterable
+		return self._iterate(name, iterable)
+
+	def _iterate(self, name, iterable):
+		seconds = 0.0
+		iterator = iter(iterable)
+		try:
+			while True:
+				startTime = time.perf_counter()
+				item = next(iterator, _END)
+				seconds += time.perf_counter() - startTime
+				if item is _END:
+					break
+				yield item
+		finally:
+			self.record(name, seconds)
+
+	def record(self, name, seconds, calls = 1):
+		"""Add the duration of a stage measured by the caller.
+		:param name: the stage name (e.g. match)
+		:type name: a String object
+		:param seconds: the duration in seconds
+		:type seconds: a float
+		:param calls: the number of calls measured
+		:type calls: an int
+		"""
+		with self.lock:
+			stage = self.stages.get(name)
+			if stage is None:
+				stage = self.stages[name] = [ 0, 0.0 ]
+			stage[0] += calls
+			stage[1] += seconds
+
+	def getStages(self):
+		"""Return the cumulated duration of each stage.
+		:returns: a python Dictionary where key is the stage name and value a Dictionary with calls and seconds
+		"""
+		with self.lock:
+			return dict((name, { 'calls': calls, 'seconds': round(seconds, 6) }) for name, (calls, seconds) in self.stages.items())
+
+	def report(self, logger):
+		"""Log the duration of each stage, longest first.
+		"""
+		elapsed = time.perf_counter() - self.startTime
+		logger.info('profile: %.3f seconds elapsed (stage durations are cumulated over all threads)', elapsed)
+		logger.info('profile: %-16s %10s %12s %12s %8s', 'stage', 'calls', 'seconds', 'avg ms', '% time')
+		for name, stage in sorted(self.getStages().items(), key = lambda s: -s[1]['seconds']):
+			calls = stage['calls']
+			seconds = stage['seconds']
+			logger.info('profile: %-16s %10d %12.3f %12.3f %7.1f%%', name, calls, seconds, seconds * 1000 / calls if calls else 0, 100 * seconds / elapsed if elapsed > 0 else 0)
+
+	def stop(self, logger, directory):
+		"""Stop profiling, log the report and write the profile files to a directory:
+		profile-<time>.json (stage durations), profile-<time>.pstats (cProfile mode)
+		or profile-<time>.folded (sampling mode, collapsed stacks for flamegraph.pl or speedscope).
+		:param directory: the output directory (e.g. the logs directory)
+		:type directory: a String object
+		:returns: a List of the files written
+		"""
+		if not self.enabled:
+			return []
+		if self.mode == PROFILE_CPROFILE:
+			threading.setprofile(None)
+			for profile in self.profiles:
+				profile.disable()
+		elif self.mode == PROFILE_SAMPLING:
+			self.stopSampling.set()
+			self.sampler.join()
+		self.report(logger)
+
+		if directory and not os.path.isdir(directory):
+			os.makedirs(directory)
+		prefix = os.path.join(directory, 'profile-' + time.strftime('%Y%m%d-%H%M%S'))
+		files = [ prefix + '.json' ]
+		with open(prefix + '.json', mode='w') as outfile:
+			json.dump({ 'mode': self.mode, 'elapsed': round(time.perf_counter() - self.startTime, 6), 'stages': self.getStages() }, outfile, indent = 1)
+		if self.mode == PROFILE_CPROFILE:
+			stats = pstats.Stats(*self.profiles)
+			stats.dump_stats(prefix + '.pstats')
+			files.append(prefix + '.pstats')
+		elif self.mode == PROFILE_SAMPLING:
+			with open(prefix + '.folded', mode='w') as outfile:
+				for stack, count in sorted(self.samples.items()):
+					outfile.write(stack + ' ' + str(count) + '\n')
+			files.append(prefix + '.folded')
+		self.enabled = False
+		for f in files:
+			logger.info('profile written to %s', f)
+		return files
+
+
+class TimedAuth(AuthBase):
+	"""
+	Wrap a requests authentication (e.g. EdgeGridAuth) to time the signature of the requests.
+	"""
+
+	def __init__(self, auth, name = 'sign'):
+		self.auth = auth
+		self.name = name
+
+	def __call__(self, r):
+		with profiler.stage(self.name):
+			return self.auth(r)
+
+
+# Profiler of the application, disabled unless enabled from the command line
+profiler = Profiler()
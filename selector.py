@@ -0,0 +1,185 @@
+import os
+import csv
+import threading
+from collections.abc import Mapping
+from event import Event, FastPurgeCPCodeEvent, FastPurgeUrlEvent, PropertyManagerEvent, EccuEvent
+from matcher import CriteriaMatcher
+
+
+# Entry point group of the Event classes provided by other packages, e.g. in setup.py:
+# entry_points = { 'mpulse_annotator.events': [ 'MyEvent = mypackage.events:MyEvent' ] }
+EVENT_CLASSES_ENTRY_POINT = 'mpulse_annotator.events'
+
+# Interval in seconds between two checks of the modification time of the events selector file
+DEFAULT_SELECTOR_CHECK_INTERVAL = 5.0
+
+# Event classes that can be named in the events selector file, by class name
+EVENT_CLASSES = {}
+
+
+def registerEventClass(eventClass, name = None):
+	"""Make an Event class available to the events selector file.
+	:param eventClass: a subclass of Event
+	:param name: the name used in the events selector file (the class name by default)
+	:type name: a String object
+	"""
+	if not (isinstance(eventClass, type) and issubclass(eventClass, Event)):
+		raise TypeError(repr(eventClass) + ' is not an Event class')
+	EVENT_CLASSES[name or eventClass.__name__] = eventClass
+
+
+for eventClass in (FastPurgeCPCodeEvent, FastPurgeUrlEvent, PropertyManagerEvent, EccuEvent):
+	registerEventClass(eventClass)
+
+
+def _entryPoints(group):
+	try:
+		from importlib.metadata import entry_points
+	except ImportError:
+		# Python < 3.8: no plugins
+		return []
+	entryPoints = entry_points()
+	if hasattr(entryPoints, 'select'):
+		return entryPoints.select(group = group)
+	return entryPoints.get(group, [])
+
+
+def loadEventPlugins(logger, group = EVENT_CLASSES_ENTRY_POINT):
+	"""Register the Event classes declared by the installed packages in an entry point group.
+	A plugin that cannot be loaded is logged and ignored.
+	:param group: the entry point group
+	:type group: a String object
+	:returns: the names of the classes registered
+	"""
+	names = []
+	for entryPoint in _entryPoints(group):
+		try:
+			registerEventClass(entryPoint.load(), entryPoint.name)
+			names.append(entryPoint.name)
+			logger.info("event class '%s' loaded from %s", entryPoint.name, entryPoint.value)
+		except Exception as e:
+			logger.error("unable to load event class '%s' from %s: %s", entryPoint.name, entryPoint.value, e)
+	return names
+
+
+def decomment(csvfile):
+    for row in csvfile:
+        raw = row.split('#')[0].strip()
+        if raw: yield raw
+
+
+def parseEventsSelector(logger, csvfile):
+	"""Parse the events selector CSV file.
+	The CSV has three columns: the event definition ID, the name of the Event class to be loaded
+	for this particular type of event (see EVENT_CLASSES) and the filter criteria.
+	An optional fourth column sets the coalescing window in seconds of the selector (see EventCoalescer).
+	The CSV file can contained comments (starting with '#') that will be ignored.
+	:param csvfile: the CSV file path and file name
+	:type csvfile: a String object
+	:returns: a python Dictionary where key is the event type ID and value a tuple with the class, the compiled criteria
+		and the coalescing window (None if not set)
+	"""
+	selector = {}
+	with open(csvfile, mode='r') as infile:
+		reader = csv.reader(decomment(infile))
+		for row in reader:
+			eventClass = EVENT_CLASSES.get(row[1])
+			if eventClass is None:
+				logger.warning("Selector '%s' ignored: unknown event class '%s'", row[0], row[1])
+				continue
+			window = int(row[3]) if len(row) > 3 and row[3].strip() != '' else None
+			selector[row[0]] = (eventClass, CriteriaMatcher(row[2]), window)
+			logger.debug("Selector '%s' added to event selectors list with criteria '%s'", row[1], row[2])
+	return selector
+
+
+class SelectorIndex(Mapping):
+	"""
+	The events selector of an events selector file, keyed by event definition ID, rebuilt when
+	the file is modified. The new selector is parsed aside and swapped in a single assignment:
+	readers are never blocked and see either the previous or the new selector. A file that
+	cannot be parsed is logged and the previous selector is kept.
+	Lookups go to the current selector; a page of events should be parsed with a single
+	snapshot() so that all its events are selected by the same version.
+	"""
+
+	def __init__(self, logger, csvfile):
+		"""
+		:param logger: the logger
+		:param csvfile: the events selector file path and file name
+		:type csvfile: a String object
+		"""
+		self.logger = logger
+		self.csvfile = csvfile
+		self.mtime = os.stat(csvfile).st_mtime_ns
+		self.selectors = parseEventsSelector(logger, csvfile)
+		self.lock = threading.Lock()
+		self.watcher = None
+		self.stopWatching = threading.Event()
+
+	def __getitem__(self, key):
+		return self.selectors[key]
+
+	def __iter__(self):
+		return iter(self.selectors)
+
+	def __len__(self):
+		return len(self.selectors)
+
+	def get(self, key, default = None):
+		return self.selectors.get(key, default)
+
+	def snapshot(self):
+		"""Return the current selector, which is never modified (a reload replaces it).
+		:returns: a python Dictionary (see parseEventsSelector)
+		"""
+		return self.selectors
+
+	def reloadIfChanged(self):
+		"""Parse the events selector file again if its modification time changed.
+		:returns: True if a new selector is in use
+		"""
+		with self.lock:
+			try:
+				mtime = os.stat(self.csvfile).st_mtime_ns
+			except OSError:
+				# The file may be being replaced
+				return False
+			if mtime == self.mtime:
+				return False
+			self.mtime = mtime
+			try:
+				selectors = parseEventsSelector(self.logger, self.csvfile)
+			except (OSError, ValueError, IndexError) as e:
+				self.logger.error('unable to reload events selector %s, keeping the previous one: %s', self.csvfile, e)
+				return False
+			self.selectors = selectors
+		self.logger.info('events selector reloaded from %s: %d selector(s)', self.csvfile, len(selectors))
+		return True
+
+	def _watch(self, interval):
+		while not self.stopWatching.wait(interval):
+			self.reloadIfChanged()
+
+	def watch(self, interval = DEFAULT_SELECTOR_CHECK_INTERVAL):
+		"""Check the events selector file periodically from a background thread.
+		:param interval: interval in seconds between two checks
+		:type interval: a float
+		"""
+		if self.watcher is None:
+			self.watcher = threading.Thread(target = self._watch, args = (interval,), name = 'selector-watcher', daemon = True)
+			self.watcher.start()
+
+	def close(self):
+		if self.watcher is not None:
+			self.stopWatching.set()
+			self.watcher.join()
+			self.watcher = None
+
+
+def snapshotOf(eventsSelector):
+	"""Return a snapshot of an events selector (see SelectorIndex), or the selector itself if it is a Dictionary.
+	"""
+	if isinstance(eventsSelector, dict):
+		return eventsSelector
+	return eventsSelector.snapshot()
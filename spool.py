@@ -0,0 +1,187 @@
+import time
+import random
+import sqlite3
+from event import Event
+from dispatcher import STATUS_SUCCESS, STATUS_RETRY, STATUS_FAILED, STATUS_SPOOLED
+from metrics import SPOOLED_ANNOTATIONS, DEAD_LETTERS
+
+
+# Number of times an annotation is dispatched (each dispatch retrying several times, see
+# AnnotationDispatcher) before it is moved to the dead-letter queue
+DEFAULT_SPOOL_MAX_ATTEMPTS = 8
+
+# Initial delay in seconds before a spooled annotation is sent again (doubled on each attempt), and maximum delay
+DEFAULT_SPOOL_BACKOFF = 60.0
+DEFAULT_SPOOL_MAX_BACKOFF = 6 * 3600.0
+
+# Delay in seconds during which the annotations drained by a run are not sent by an overlapping run
+# (after a crash, they are sent again once this delay is over)
+DEFAULT_SPOOL_LEASE = 3600.0
+
+
+class SpooledAnnotation(Event):
+	"""
+	An annotation read from the spool, already rendered: it is sent as is.
+	"""
+
+	__slots__ = ('spoolId', 'title', 'text', 'start', 'end', 'attempts')
+
+	def __init__(self, spoolId, title, text, start, end, attempts):
+		Event.__init__(self, 'spool-' + str(spoolId))
+		self.spoolId = spoolId
+		self.title = title
+		self.text = text
+		self.start = start
+		self.end = end
+		self.attempts = attempts
+
+	def getAnnotationTitle(self):
+		return self.title
+
+	def getAnnotationText(self):
+		return self.text
+
+	def getEventStartTime(self):
+		return self.start
+
+	def getEventEndTime(self):
+		return self.end
+
+
+class AnnotationSpool:
+	"""
+	Durable outbound spool of the annotations, stored in the state database (see StateStore).
+	Each annotation is written to the spool before it is sent and removed once mPulse accepted it.
+	An annotation that could not be sent (mPulse outage, crash) stays in the spool and is sent
+	again by the next runs with an exponential backoff, instead of its events being fetched again.
+	Annotations rejected permanently (e.g. HTTP 400), or still failing after a number of attempts,
+	are moved to a dead-letter queue where they can be inspected and replayed.
+	"""
+
+	def __init__(self, logger, state, maxAttempts = DEFAULT_SPOOL_MAX_ATTEMPTS, backoff = DEFAULT_SPOOL_BACKOFF, maxBackoff = DEFAULT_SPOOL_MAX_BACKOFF):
+		"""
+		:param logger: the logger
+		:param state: the state store
+		:type state: a StateStore object
+		:param maxAttempts: number of times an annotation is dispatched before it is given up
+		:type maxAttempts: an int
+		:param backoff: initial delay in seconds before an annotation is sent again
+		:type backoff: a float
+		:param maxBackoff: maximum delay in seconds before an annotation is sent again
+		:type maxBackoff: a float
+		"""
+		self.logger = logger
+		self.state = state
+		self.maxAttempts = maxAttempts
+		self.backoff = backoff
+		self.maxBackoff = maxBackoff
+
+	def getRetryDelay(self, attempts):
+		"""Return the delay before an annotation is sent again.
+		:param attempts: the number of times the annotation was dispatched
+		:type attempts: an int
+		:returns: a delay in seconds
+		"""
+		delay = min(self.maxBackoff, self.backoff * (2 ** (attempts - 1)))
+		return delay * random.uniform(0.5, 1.0)
+
+	def add(self, annotation, published, tenant = ''):
+		"""Write an annotation to the spool before it is sent, its events being recorded as published.
+		:param annotation: the annotation (an event or coalesced events)
+		:type annotation: an Event object
+		:param published: the events the annotation stands for
+		:type published: a List of (source, eventId) tuples
+		:param tenant: the tenant name ('' for a single tenant)
+		:type tenant: a String object
+		:returns: the spool ID, None if the annotation could not be rendered or written to the spool
+			(it is then sent without being spooled, as without a spool), False if all its events were
+			already recorded as published by another run (it must not be sent)
+		"""
+		try:
+			title = annotation.getAnnotationTitle()
+			text = annotation.getAnnotationText()
+		except Exception as e:
+			self.logger.error('An error occured while spooling annotation for event %s: %s', annotation.getEventId(), e)
+			return None
+		try:
+			spoolId = self.state.spoolAnnotation(tenant, title, text, annotation.getEventStartTime(), annotation.getEventEndTime(), published)
+			return spoolId if spoolId is not None else False
+		except sqlite3.Error as e:
+			# e.g. database locked or disk full: the annotation is sent anyway, its events being recorded once sent
+			self.logger.error('unable to spool annotation for event %s, sending it without spooling: %s', annotation.getEventId(), e)
+			return None
+
+	def settle(self, spoolId, status, attempts = 0):
+		"""Update the spool with the outcome of a dispatch: the annotation is removed if it was sent,
+		kept for a later run if it can be sent again, moved to the dead-letter queue otherwise.
+		:param spoolId: the spool ID of the annotation
+		:type spoolId: an int
+		:param status: the status returned by the dispatcher
+		:type status: a String object
+		:param attempts: the number of times the annotation was dispatched before
+		:type attempts: an int
+		:returns: STATUS_SUCCESS, STATUS_SPOOLED or STATUS_FAILED
+		"""
+		attempts += 1
+		try:
+			if status == STATUS_SUCCESS:
+				self.state.unspoolAnnotation(spoolId)
+				return STATUS_SUCCESS
+			if status == STATUS_RETRY and attempts < self.maxAttempts:
+				delay = self.getRetryDelay(attempts)
+				self.state.retrySpooledAnnotation(spoolId, attempts, time.time() + delay, status)
+				self.logger.info('annotation %d kept in the spool, next attempt in %.0f seconds', spoolId, delay)
+				return STATUS_SPOOLED
+			self.state.deadLetterAnnotation(spoolId, attempts, status)
+		except sqlite3.Error as e:
+			# e.g. database locked or disk full: the annotation is left in the spool as it was, and sent again by a later run
+			self.logger.error('unable to update annotation %d in the spool: %s', spoolId, e)
+			return STATUS_SUCCESS if status == STATUS_SUCCESS else STATUS_SPOOLED
+		self.logger.error('annotation %d moved to the dead-letter queue after %d attempt(s) (%s)', spoolId, attempts, status)
+		return STATUS_FAILED
+
+	def drain(self, dispatcher, workers = 1, tenant = ''):
+		"""Send the annotations of a tenant waiting in the spool whose retry delay is over.
+		The drain stops at the first annotation that still cannot be sent (mPulse is probably
+		still unavailable), the other annotations being sent by the next run.
+		:param dispatcher: the dispatcher used to send the annotations
+		:type dispatcher: an AnnotationDispatcher object
+		:param workers: maximum number of annotations in flight
+		:type workers: an int
+		:param tenant: the tenant name ('' for a single tenant)
+		:type tenant: a String object
+		:returns: a python Dictionary with the number of annotations per status
+		"""
+		results = { STATUS_SUCCESS: 0, STATUS_SPOOLED: 0, STATUS_FAILED: 0 }
+		# The annotations are leased: an overlapping run does not send them as well
+		annotations = [ SpooledAnnotation(*row) for row in self.state.getSpooledAnnotations(tenant, lease = DEFAULT_SPOOL_LEASE) ]
+		if not annotations:
+			return results
+		self.logger.info('sending %d annotation(s) from the spool', len(annotations))
+		stopped = []
+		settled = set()
+
+		def untilFailure(annotations):
+			for annotation in annotations:
+				if stopped:
+					return
+				yield annotation
+
+		for annotation, status in dispatcher.dispatchEvents(untilFailure(annotations), workers):
+			status = self.settle(annotation.spoolId, status, annotation.attempts)
+			settled.add(annotation.spoolId)
+			results[status] += 1
+			if status == STATUS_SPOOLED:
+				stopped.append(annotation)
+		# The annotations not sent are left to the next run
+		self.state.releaseSpooledAnnotations([ annotation.spoolId for annotation in annotations if annotation.spoolId not in settled ])
+		if stopped:
+			self.logger.info('mPulse still failing, %d annotation(s) left in the spool', len(annotations) - results[STATUS_SUCCESS] - results[STATUS_FAILED])
+		return results
+
+	def updateMetrics(self):
+		"""Update the number of annotations in the spool and in the dead-letter queue in the metrics.
+		"""
+		spooled, deadLetters = self.state.getSpoolCounts()
+		SPOOLED_ANNOTATIONS.set(spooled)
+		DEAD_LETTERS.set(deadLetters)
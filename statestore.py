@@ -0,0 +1,353 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class StateStore:
+	"""
+	Local state persisted in a SQLite database between runs:
+	- the checkpoint of each source (the event time from which the next run should resume)
+	- the ID of every event an annotation was published for, so that it is never published twice
+	- the index of the ECCU requests already seen (request date and status), so that unchanged
+	  requests are not parsed again
+	- the validators (ETag and Last-Modified) of the last response of a source, for conditional requests
+	- the spool of the annotations not sent yet, and the dead-letter queue of the annotations given up
+	"""
+
+	def __init__(self, filename):
+		"""
+		:param filename: the SQLite database path and file name (created if needed)
+		:type filename: a String object
+		"""
+		directory = os.path.dirname(filename)
+		if directory and not os.path.isdir(directory):
+			os.makedirs(directory)
+		self.filename = filename
+		self.lock = threading.Lock()
+		# Progress of the current run, per source
+		self.lastDone = {}
+		self.firstPending = {}
+		# ECCU requests index, loaded once
+		self.eccuRequests = None
+		self.db = sqlite3.connect(filename, check_same_thread = False, isolation_level = None)
+		self.db.execute('PRAGMA journal_mode=WAL')
+		self.db.execute('PRAGMA synchronous=NORMAL')
+		self.db.execute('CREATE TABLE IF NOT EXISTS checkpoints (source TEXT PRIMARY KEY, eventTime INTEGER NOT NULL, updated INTEGER NOT NULL)')
+		self.db.execute('CREATE TABLE IF NOT EXISTS published (source TEXT NOT NULL, eventId TEXT NOT NULL, published INTEGER NOT NULL, PRIMARY KEY (source, eventId)) WITHOUT ROWID')
+		self.db.execute('CREATE TABLE IF NOT EXISTS eccu_requests (requestId TEXT PRIMARY KEY, requestDate INTEGER NOT NULL, status TEXT, updated INTEGER NOT NULL) WITHOUT ROWID')
+		self.db.execute('CREATE TABLE IF NOT EXISTS validators (source TEXT PRIMARY KEY, etag TEXT, lastModified TEXT, updated INTEGER NOT NULL)')
+		# Spool IDs are never reused, a dead letter keeps its ID when it is replayed
+		self.db.execute('CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, tenant TEXT NOT NULL, title TEXT, text TEXT, startTime, endTime, '
+			'attempts INTEGER NOT NULL, nextAttempt REAL NOT NULL, error TEXT, created INTEGER NOT NULL)')
+		self.db.execute('CREATE TABLE IF NOT EXISTS deadletters (id INTEGER PRIMARY KEY, tenant TEXT NOT NULL, title TEXT, text TEXT, startTime, endTime, '
+			'attempts INTEGER NOT NULL, error TEXT, created INTEGER NOT NULL, failed INTEGER NOT NULL)')
+
+	def close(self):
+		with self.lock:
+			self.db.close()
+
+	@contextmanager
+	def _transaction(self):
+		# Must be called with the lock held: the statements of the block are committed together, or rolled back on error
+		self.db.execute('BEGIN IMMEDIATE')
+		try:
+			yield
+			self.db.execute('COMMIT')
+		except:
+			self.db.execute('ROLLBACK')
+			raise
+
+	def getCheckpoint(self, source):
+		"""Return the checkpoint of a source.
+		:param source: the source name (e.g. eventviewer)
+		:type source: a String object
+		:returns: an epoch time in seconds, None if there is no checkpoint yet
+		"""
+		with self.lock:
+			row = self.db.execute('SELECT eventTime FROM checkpoints WHERE source = ?', (source,)).fetchone()
+		return row[0] if row is not None else None
+
+	def setCheckpoint(self, source, eventTime):
+		"""Move the checkpoint of a source forward (a checkpoint never goes backward).
+		:param source: the source name (e.g. eventviewer)
+		:type source: a String object
+		:param eventTime: the new checkpoint as an epoch time in seconds
+		:type eventTime: an int
+		"""
+		with self.lock:
+			self.db.execute('INSERT INTO checkpoints (source, eventTime, updated) VALUES (?, ?, ?) '
+				'ON CONFLICT(source) DO UPDATE SET eventTime = excluded.eventTime, updated = excluded.updated '
+				'WHERE excluded.eventTime > checkpoints.eventTime', (source, int(eventTime), int(time.time())))
+
+	def trackEvent(self, source, eventTime, done):
+		"""Record the progress of the current run for a source (see saveCheckpoint).
+		:param source: the source name (e.g. eventviewer)
+		:type source: a String object
+		:param eventTime: the event time as an epoch time in seconds
+		:type eventTime: an int
+		:param done: False if the event will have to be processed again by a later run
+		:type done: a boolean
+		"""
+		eventTime = int(eventTime)
+		with self.lock:
+			if done:
+				if eventTime > self.lastDone.get(source, eventTime - 1):
+					self.lastDone[source] = eventTime
+			elif eventTime < self.firstPending.get(source, eventTime + 1):
+				self.firstPending[source] = eventTime
+
+	def hasPending(self, source):
+		"""Return True if some events of the current run will have to be processed again (see trackEvent).
+		:param source: the source name (e.g. eccu)
+		:type source: a String object
+		:returns: a boolean
+		"""
+		with self.lock:
+			return source in self.firstPending
+
+	def saveCheckpoint(self, source):
+		"""Move the checkpoint of a source to the most recent event processed by the current run,
+		or to the oldest event that could not be processed so that the next run tries it again.
+		The progress recorded for the source is then reset.
+		:param source: the source name (e.g. eventviewer)
+		:type source: a String object
+		:returns: the checkpoint saved as an epoch time in seconds, None if nothing was saved
+		"""
+		with self.lock:
+			eventTime = self.firstPending.pop(source, self.lastDone.get(source))
+			self.lastDone.pop(source, None)
+		if eventTime is not None:
+			self.setCheckpoint(source, eventTime)
+		return eventTime
+
+	def isPublished(self, source, eventId):
+		"""Return True if an annotation was already published for this event.
+		:param source: the source name (e.g. eventviewer)
+		:type source: a String object
+		:param eventId: the event ID
+		:type eventId: a String object
+		:returns: a boolean
+		"""
+		with self.lock:
+			row = self.db.execute('SELECT 1 FROM published WHERE source = ? AND eventId = ?', (source, str(eventId))).fetchone()
+		return row is not None
+
+	def markPublished(self, source, eventId):
+		"""Record that an annotation was published for this event.
+		:param source: the source name (e.g. eventviewer)
+		:type source: a String object
+		:param eventId: the event ID
+		:type eventId: a String object
+		"""
+		with self.lock:
+			self.db.execute('INSERT OR IGNORE INTO published (source, eventId, published) VALUES (?, ?, ?)', (source, str(eventId), int(time.time())))
+
+	def claimPublished(self, published):
+		"""Record events as published before their annotation is sent, unless they already are: when runs
+		overlap, an annotation is only sent by the run that claimed its events (see releasePublished).
+		:param published: the events an annotation stands for
+		:type published: a List of (source, eventId) tuples
+		:returns: the events claimed, a List of (source, eventId) tuples (empty if all of them were already published)
+		"""
+		now = int(time.time())
+		claimed = []
+		with self.lock, self._transaction():
+			for source, eventId in published:
+				cursor = self.db.execute('INSERT OR IGNORE INTO published (source, eventId, published) VALUES (?, ?, ?)', (source, str(eventId), now))
+				if cursor.rowcount == 1:
+					claimed.append((source, eventId))
+		return claimed
+
+	def releasePublished(self, published):
+		"""Forget the events claimed for an annotation that could not be sent, so that a later run publishes them.
+		:param published: the events claimed (see claimPublished)
+		:type published: a List of (source, eventId) tuples
+		"""
+		with self.lock:
+			self.db.executemany('DELETE FROM published WHERE source = ? AND eventId = ?', [ (source, str(eventId)) for source, eventId in published ])
+
+	def getEccuRequests(self):
+		"""Return the index of the ECCU requests already seen.
+		:returns: a python Dictionary where key is the request ID and value a (requestDate, status) tuple,
+			requestDate being an epoch time in seconds
+		"""
+		with self.lock:
+			if self.eccuRequests is None:
+				self.eccuRequests = dict((requestId, (requestDate, status)) for requestId, requestDate, status in
+					self.db.execute('SELECT requestId, requestDate, status FROM eccu_requests'))
+			return self.eccuRequests
+
+	def saveEccuRequests(self, requests):
+		"""Add new ECCU requests to the index, or update their status.
+		:param requests: the requests seen
+		:type requests: a List of (requestId, requestDate, status) tuples
+		"""
+		if not requests:
+			return
+		updated = int(time.time())
+		with self.lock:
+			with self._transaction():
+				self.db.executemany('INSERT INTO eccu_requests (requestId, requestDate, status, updated) VALUES (?, ?, ?, ?) '
+					'ON CONFLICT(requestId) DO UPDATE SET requestDate = excluded.requestDate, status = excluded.status, updated = excluded.updated',
+					[ (requestId, requestDate, status, updated) for requestId, requestDate, status in requests ])
+			if self.eccuRequests is not None:
+				for requestId, requestDate, status in requests:
+					self.eccuRequests[requestId] = (requestDate, status)
+
+	def getValidators(self, source):
+		"""Return the validators of the last response of a source, to send a conditional request.
+		:param source: the source name (e.g. eccu)
+		:type source: a String object
+		:returns: a (etag, lastModified) tuple of String objects, None when unknown
+		"""
+		with self.lock:
+			row = self.db.execute('SELECT etag, lastModified FROM validators WHERE source = ?', (source,)).fetchone()
+		return row if row is not None else (None, None)
+
+	def setValidators(self, source, etag, lastModified):
+		"""Save the validators of the last response of a source, or forget them when both are None
+		(the next request will not be conditional).
+		:param source: the source name (e.g. eccu)
+		:type source: a String object
+		:param etag: the ETag header of the response
+		:type etag: a String object
+		:param lastModified: the Last-Modified header of the response
+		:type lastModified: a String object
+		"""
+		with self.lock:
+			if etag is None and lastModified is None:
+				self.db.execute('DELETE FROM validators WHERE source = ?', (source,))
+			else:
+				self.db.execute('INSERT OR REPLACE INTO validators (source, etag, lastModified, updated) VALUES (?, ?, ?, ?)',
+					(source, etag, lastModified, int(time.time())))
+
+	def spoolAnnotation(self, tenant, title, text, start, end, published):
+		"""Write an annotation to the spool before it is sent, and record the events it stands for
+		as published in the same transaction: from then on, the annotation is sent from the spool
+		(see unspoolAnnotation, retrySpooledAnnotation and deadLetterAnnotation), never from the events again.
+		:param tenant: the tenant name ('' for a single tenant)
+		:type tenant: a String object
+		:param title: the annotation title
+		:param text: the annotation body text
+		:param start: start time of the annotation in epoch time format in milliseconds
+		:param end: end time of the annotation in epoch time format in milliseconds, None if not set
+		:param published: the events the annotation stands for
+		:type published: a List of (source, eventId) tuples
+		:returns: the spool ID of the annotation, None if all its events were already recorded as published
+			(e.g. by an overlapping run): the annotation is not spooled and must not be sent (see claimPublished)
+		"""
+		now = int(time.time())
+		with self.lock, self._transaction():
+			claimed = 0
+			for source, eventId in published:
+				claimed += self.db.execute('INSERT OR IGNORE INTO published (source, eventId, published) VALUES (?, ?, ?)',
+					(source, str(eventId), now)).rowcount
+			if published and claimed == 0:
+				return None
+			cursor = self.db.execute('INSERT INTO spool (tenant, title, text, startTime, endTime, attempts, nextAttempt, error, created) '
+				'VALUES (?, ?, ?, ?, ?, 0, 0, NULL, ?)', (tenant, title, text, start, end, now))
+		return cursor.lastrowid
+
+	def unspoolAnnotation(self, spoolId):
+		"""Remove an annotation sent from the spool.
+		:param spoolId: the spool ID of the annotation
+		:type spoolId: an int
+		"""
+		with self.lock:
+			self.db.execute('DELETE FROM spool WHERE id = ?', (spoolId,))
+
+	def retrySpooledAnnotation(self, spoolId, attempts, nextAttempt, error):
+		"""Keep an annotation that could not be sent in the spool, to be sent again later.
+		:param spoolId: the spool ID of the annotation
+		:type spoolId: an int
+		:param attempts: the number of times the annotation was dispatched
+		:type attempts: an int
+		:param nextAttempt: the epoch time in seconds from which the annotation can be sent again
+		:type nextAttempt: a float
+		:param error: the reason of the failure
+		:type error: a String object
+		"""
+		with self.lock:
+			self.db.execute('UPDATE spool SET attempts = ?, nextAttempt = ?, error = ? WHERE id = ?', (attempts, nextAttempt, error, spoolId))
+
+	def deadLetterAnnotation(self, spoolId, attempts, error):
+		"""Move an annotation given up from the spool to the dead-letter queue.
+		:param spoolId: the spool ID of the annotation
+		:type spoolId: an int
+		:param attempts: the number of times the annotation was dispatched
+		:type attempts: an int
+		:param error: the reason of the failure
+		:type error: a String object
+		"""
+		with self.lock, self._transaction():
+			self.db.execute('INSERT OR REPLACE INTO deadletters (id, tenant, title, text, startTime, endTime, attempts, error, created, failed) '
+				'SELECT id, tenant, title, text, startTime, endTime, ?, ?, created, ? FROM spool WHERE id = ?', (attempts, error, int(time.time()), spoolId))
+			self.db.execute('DELETE FROM spool WHERE id = ?', (spoolId,))
+
+	def getSpooledAnnotations(self, tenant, now = None, lease = None):
+		"""Return the annotations of a tenant waiting in the spool that can be sent again.
+		:param tenant: the tenant name ('' for a single tenant)
+		:type tenant: a String object
+		:param now: (optional) the current epoch time in seconds
+		:type now: a float
+		:param lease: (optional) a delay in seconds during which the annotations returned are not returned
+			to another run, so that overlapping runs do not send them twice (see releaseSpooledAnnotations)
+		:type lease: a float
+		:returns: a List of (id, title, text, start, end, attempts) tuples, oldest first
+		"""
+		if now is None:
+			now = time.time()
+		with self.lock, self._transaction():
+			rows = self.db.execute('SELECT id, title, text, startTime, endTime, attempts FROM spool WHERE tenant = ? AND nextAttempt <= ? ORDER BY id',
+				(tenant, now)).fetchall()
+			if lease is not None:
+				self.db.executemany('UPDATE spool SET nextAttempt = ? WHERE id = ?', [ (now + lease, row[0]) for row in rows ])
+		return rows
+
+	def releaseSpooledAnnotations(self, spoolIds, now = None):
+		"""Make annotations returned with a lease, but not sent, available again (see getSpooledAnnotations).
+		:param spoolIds: the spool IDs of the annotations
+		:type spoolIds: a List of int
+		:param now: (optional) the current epoch time in seconds
+		:type now: a float
+		"""
+		if now is None:
+			now = time.time()
+		with self.lock:
+			self.db.executemany('UPDATE spool SET nextAttempt = ? WHERE id = ?', [ (now, spoolId) for spoolId in spoolIds ])
+
+	def getDeadLetters(self):
+		"""Return the annotations of the dead-letter queue.
+		:returns: a List of (id, tenant, title, text, start, end, attempts, error, created, failed) tuples, oldest first
+		"""
+		with self.lock:
+			return self.db.execute('SELECT id, tenant, title, text, startTime, endTime, attempts, error, created, failed FROM deadletters ORDER BY id').fetchall()
+
+	def replayDeadLetters(self, ids = None):
+		"""Move annotations of the dead-letter queue back to the spool: they are sent by the next run.
+		:param ids: (optional) the IDs of the annotations to replay, all of them if None
+		:type ids: a List of int
+		:returns: the number of annotations moved back to the spool
+		"""
+		where = ''
+		args = ()
+		if ids is not None:
+			where = ' WHERE id IN (' + ','.join('?' * len(ids)) + ')'
+			args = tuple(ids)
+		with self.lock, self._transaction():
+			cursor = self.db.execute('INSERT OR IGNORE INTO spool (id, tenant, title, text, startTime, endTime, attempts, nextAttempt, error, created) '
+				'SELECT id, tenant, title, text, startTime, endTime, 0, 0, NULL, created FROM deadletters' + where, args)
+			count = cursor.rowcount
+			self.db.execute('DELETE FROM deadletters' + where, args)
+		return count
+
+	def getSpoolCounts(self):
+		"""Return the number of annotations in the spool and in the dead-letter queue.
+		:returns: a (spooled, deadLetters) tuple of int
+		"""
+		with self.lock:
+			spooled = self.db.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+			deadLetters = self.db.execute('SELECT COUNT(*) FROM deadletters').fetchone()[0]
+		return spooled, deadLetters
@@ -0,0 +1,189 @@
+import os
+import json
+import threading
+from collections.abc import Mapping
+from selector import SelectorIndex
+from matcher import CriteriaMatcher
+from mpulseapihandler import MPulseAPIHandler
+from tokenmanager import SecurityTokenManager
+from dispatcher import AnnotationDispatcher
+
+
+class Tenant:
+	"""
+	An mPulse tenant (or app) annotated by a multi-tenant run, with its own events selector,
+	API token, security token and rate limit.
+	"""
+
+	def __init__(self, logger, name, apiToken, tenant, selectorFile, rate, burst, coalescingWindow, tokenCacheFile):
+		"""
+		:param logger: the logger
+		:param name: the name of the tenant in the configuration file (e.g. shop)
+		:type name: a String object
+		:param apiToken: the mPulse API token
+		:type apiToken: a String object
+		:param tenant: the mPulse tenant name
+		:type tenant: a String object
+		:param selectorFile: the events selector file path and file name
+		:type selectorFile: a String object
+		:param rate: maximum number of annotations sent per second
+		:type rate: a float
+		:param burst: maximum number of annotations sent in a burst
+		:type burst: an int
+		:param coalescingWindow: the default coalescing window in seconds
+		:type coalescingWindow: an int
+		:param tokenCacheFile: path and file name of the security token cache
+		:type tokenCacheFile: a String object
+		"""
+		self.logger = logger
+		self.name = name
+		self.apiToken = apiToken
+		self.tenant = tenant
+		self.rate = rate
+		self.burst = burst
+		self.coalescingWindow = coalescingWindow
+		self.tokenCacheFile = tokenCacheFile
+		self.selector = SelectorIndex(logger, selectorFile)
+		self.mpulse = None
+		self.tokens = None
+		self.dispatcher = None
+
+	def open(self, simulate, workers, mpulseUrl):
+		"""Create the mPulse API handler and dispatcher of the tenant, and retrieve its security token.
+		:param simulate: if True, no annotation will be sent to mPulse
+		:type simulate: a boolean
+		:param workers: maximum number of annotations in flight
+		:type workers: an int
+		:param mpulseUrl: the base URL of mPulse APIs
+		:type mpulseUrl: a String object
+		"""
+		self.mpulse = MPulseAPIHandler(self.logger, simulate, workers, mpulseUrl)
+		self.tokens = SecurityTokenManager(self.logger, self.mpulse, self.apiToken, self.tenant, self.tokenCacheFile)
+		self.tokens.getToken()
+		self.dispatcher = AnnotationDispatcher(self.logger, self.mpulse, self.tokens, self.rate, self.burst)
+
+	def close(self):
+		self.selector.close()
+		if self.tokens is not None:
+			self.tokens.close()
+		if self.mpulse is not None:
+			self.mpulse.close()
+
+
+def tenantTokenCacheFile(tokenCacheFile, name):
+	"""Return the security token cache of a tenant, next to the default cache (e.g. state/mpulse-token-shop.json).
+	"""
+	root, ext = os.path.splitext(tokenCacheFile)
+	return root + '-' + name + ext
+
+
+def loadTenants(logger, filename, rate, burst, coalescingWindow, tokenCacheFile):
+	"""Load the tenants of a multi-tenant configuration file, a JSON file such as:
+	{ "tenants": [ { "name": "shop", "apiToken": "XXXX", "tenant": "MPULSE TENANT", "selector": "shop-selector.csv",
+		"rate": 2.0, "burst": 5, "coalesce": 60, "tokenCache": "state/token-shop.json" } ] }
+	rate, burst, coalesce and tokenCache are optional, the values of the command line being used by default
+	(the token cache of each tenant defaulting to the command line cache suffixed with the tenant name).
+	:param filename: the configuration file path and file name
+	:type filename: a String object
+	:returns: a List of Tenant objects
+	"""
+	with open(filename, mode='r') as infile:
+		config = json.load(infile)
+	tenants = []
+	names = set()
+	for entry in config.get('tenants', []):
+		for key in ('name', 'apiToken', 'tenant', 'selector'):
+			if not entry.get(key):
+				raise ValueError('tenant %s of %s has no %s' % (entry.get('name', len(tenants) + 1), filename, key))
+		name = entry['name']
+		if name in names:
+			raise ValueError('tenant %s is defined twice in %s' % (name, filename))
+		names.add(name)
+		tenants.append(Tenant(logger, name, entry['apiToken'], entry['tenant'], entry['selector'],
+			float(entry.get('rate', rate)), int(entry.get('burst', burst)), int(entry.get('coalesce', coalescingWindow)),
+			entry.get('tokenCache', tenantTokenCacheFile(tokenCacheFile, name))))
+		logger.info("tenant '%s': mPulse tenant '%s', events selector %s", name, entry['tenant'], entry['selector'])
+	if not tenants:
+		raise ValueError('no tenant defined in ' + filename)
+	return tenants
+
+
+class TenantSelector(Mapping):
+	"""
+	The union of the events selectors of several tenants, used to fetch and parse the events
+	once for all the tenants: an event definition ID selected by several tenants is parsed
+	with the union of their criteria (compiled in a single CriteriaMatcher), then each matching
+	event is routed to the tenants whose own criteria it matches (see routesOf).
+	The union is rebuilt when the selector of a tenant is reloaded (see SelectorIndex).
+	"""
+
+	def __init__(self, logger, tenants):
+		"""
+		:param logger: the logger
+		:param tenants: the tenants
+		:type tenants: a List of Tenant objects
+		"""
+		self.logger = logger
+		self.tenants = tenants
+		self.lock = threading.Lock()
+		# Versions of the tenant selectors, union selector and routes, swapped together
+		self.index = None
+		self._build()
+
+	def _build(self):
+		versions = tuple(tenant.selector.snapshot() for tenant in self.tenants)
+		classes = {}
+		routes = {}
+		for tenant, selectors in zip(self.tenants, versions):
+			for selectorId, (eventClass, criteria, window) in selectors.items():
+				if classes.setdefault(selectorId, eventClass) is not eventClass:
+					self.logger.error("Selector '%s' of tenant '%s' ignored: class %s differs from the class %s of another tenant",
+						selectorId, tenant.name, eventClass.__name__, classes[selectorId].__name__)
+					continue
+				routes.setdefault(selectorId, []).append((tenant, criteria))
+		union = {}
+		for selectorId, route in routes.items():
+			patterns = [ criteria.criteria for tenant, criteria in route ]
+			# An empty criteria selects every event of its class
+			union[selectorId] = (classes[selectorId], CriteriaMatcher('' if '' in patterns else ';'.join(patterns)), None)
+		self.index = (versions, union, routes)
+
+	def _current(self):
+		index = self.index
+		if any(tenant.selector.snapshot() is not version for tenant, version in zip(self.tenants, index[0])):
+			with self.lock:
+				if self.index is index:
+					self._build()
+				index = self.index
+		return index
+
+	def __getitem__(self, key):
+		return self._current()[1][key]
+
+	def __iter__(self):
+		return iter(self._current()[1])
+
+	def __len__(self):
+		return len(self._current()[1])
+
+	def snapshot(self):
+		"""Return the current union selector (see SelectorIndex.snapshot).
+		:returns: a python Dictionary where key is the event type ID and value the class and the union of the criteria
+		"""
+		return self._current()[1]
+
+	def routesOf(self, selectorId):
+		"""Return the tenants selecting an event definition ID, with their criteria.
+		:param selectorId: the event definition ID
+		:type selectorId: a String object
+		:returns: a List of (Tenant, CriteriaMatcher) tuples
+		"""
+		return self._current()[2].get(selectorId, ())
+
+	def watch(self):
+		for tenant in self.tenants:
+			tenant.selector.watch()
+
+	def close(self):
+		for tenant in self.tenants:
+			tenant.selector.close()
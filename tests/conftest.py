@@ -0,0 +1,30 @@
+import os
+import sys
+import logging
+import importlib.util
+
+import pytest
+
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# The modules of the annotator and the benchmark fixtures are imported from the source tree
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+
+
+@pytest.fixture
+def logger():
+	return logging.getLogger('mpulse-annotator-tests')
+
+
+@pytest.fixture
+def annotator(logger):
+	"""Import mpulse-annotator.py as a module (its file name is not a valid module name).
+	"""
+	spec = importlib.util.spec_from_file_location('annotator', os.path.join(ROOT_DIR, 'mpulse-annotator.py'))
+	annotator = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(annotator)
+	annotator.l = logger
+	annotator.baseUrl = 'https://akab-test.luna.akamaiapis.net'
+	return annotator
@@ -0,0 +1,54 @@
+import fixtures
+from aggregator import aggregateEvents, eccuTimeWindowKey
+from coalescer import CoalescedEvent
+from dispatcher import STATUS_SUCCESS
+from event import EccuEvent
+from statestore import StateStore
+
+
+def eccuEvents(count):
+	events = []
+	for request in fixtures.generateEccuRequests(count, matchRatio = 1.0)['requests']:
+		# Same request name and requestor: all the requests are aggregated in a one-day window
+		request['requestName'] = 'invalidate images'
+		request['requestor'] = fixtures.USERNAMES[0]
+		e = EccuEvent()
+		e.parseJson(request)
+		events.append(e)
+	return events
+
+
+class FakeDispatcher:
+
+	def dispatchEvents(self, events, workers):
+		for e in events:
+			yield e, STATUS_SUCCESS
+
+
+def test_aggregated_event_stands_for_merged_events():
+	events = eccuEvents(3)
+	ids = [ e.getEventId() for e in events ]
+	aggregated = aggregateEvents(events, eccuTimeWindowKey(86400))
+	assert len(aggregated) == 1
+	first, count = aggregated[0]
+	assert count == 3
+	assert [ e.getEventId() for e in first.getEvents() ] == ids
+	assert [ e.getEventId() for e in CoalescedEvent([ first ]).getEvents() ] == ids
+
+
+def test_single_event_stands_for_itself():
+	e = eccuEvents(1)[0]
+	assert aggregateEvents([ e ])[0] == (e, 1)
+	assert e.getEvents() == (e,)
+
+
+def test_merged_events_are_recorded_as_published(annotator, tmp_path):
+	events = eccuEvents(3)
+	aggregated = [ e for e, count in aggregateEvents(events, eccuTimeWindowKey(86400)) ]
+	state = StateStore(str(tmp_path / 'state.db'))
+	try:
+		results = annotator.publishEvents(FakeDispatcher(), aggregated, 1, state)
+		assert results[STATUS_SUCCESS] == 3
+		assert all(state.isPublished('eccu', e.getEventId()) for e in events)
+	finally:
+		state.close()
@@ -0,0 +1,47 @@
+import queue
+import logging
+import threading
+
+from asynclog import NonBlockingQueueHandler
+from metrics import LOG_RECORDS_DROPPED
+
+
+def record(level, message):
+	return logging.LogRecord('test', level, __file__, 1, message, None, None)
+
+
+def dropped(level):
+	return LOG_RECORDS_DROPPED.values.get((('level', level),), 0)
+
+
+def test_info_records_are_dropped_when_queue_is_full():
+	q = queue.Queue(1)
+	handler = NonBlockingQueueHandler(q)
+	before = dropped('INFO')
+	handler.handle(record(logging.INFO, 'first'))
+	handler.handle(record(logging.INFO, 'dropped'))
+	assert q.qsize() == 1
+	assert dropped('INFO') == before + 1
+
+
+def test_warning_records_wait_for_room_in_the_queue():
+	q = queue.Queue(1)
+	handler = NonBlockingQueueHandler(q, blockTimeout = 10.0)
+	handler.handle(record(logging.INFO, 'first'))
+	# The listener frees the queue a bit later: the error is queued instead of being dropped
+	reader = threading.Timer(0.2, q.get)
+	reader.start()
+	before = dropped('ERROR')
+	handler.handle(record(logging.ERROR, 'error'))
+	reader.join()
+	assert q.get_nowait().getMessage() == 'error'
+	assert dropped('ERROR') == before
+
+
+def test_warning_records_are_dropped_when_the_listener_is_stuck():
+	q = queue.Queue(1)
+	handler = NonBlockingQueueHandler(q, blockTimeout = 0.05)
+	handler.handle(record(logging.INFO, 'first'))
+	before = dropped('WARNING')
+	handler.handle(record(logging.WARNING, 'warning'))
+	assert dropped('WARNING') == before + 1
@@ -0,0 +1,95 @@
+import io
+import json
+import datetime
+
+import fixtures
+from backfill import BackfillPlan, ECCU_WORK_ITEM
+from dispatcher import STATUS_SUCCESS
+from selector import parseEventsSelector
+from statestore import StateStore
+
+
+START = '2019-01-10T00:00:00'
+END = '2019-01-10T03:00:00'
+
+
+class FakeResponse:
+
+	def __init__(self, status, body = None):
+		self.status_code = status
+		self.headers = {}
+		self.raw = io.BytesIO(json.dumps(body).encode('utf-8') if body is not None else b'')
+
+	def close(self):
+		pass
+
+
+class FakeSession:
+	"""Answer EventViewer with one page of selected events per time slice, and ECCU with no request.
+	The slices listed in failing are answered with an HTTP 503.
+	"""
+
+	def __init__(self, failing = ()):
+		self.failing = set(failing)
+
+	def get(self, url, headers = None, stream = False, timeout = None):
+		if '/eccu-api/' in url:
+			return FakeResponse(200, { 'requests': [] })
+		start = url.split('start=')[1].split('&')[0]
+		if start in self.failing:
+			return FakeResponse(503)
+		date = datetime.datetime.strptime(start, '%Y-%m-%dT%H:%M:%S')
+		events = list(fixtures.generateEventViewerEvents(20, seed = date.hour, matchRatio = 1.0, start = date))
+		return FakeResponse(200, { 'events': events })
+
+
+class FakeDispatcher:
+
+	def __init__(self):
+		self.sent = []
+
+	def dispatchEvents(self, events, workers):
+		for e in events:
+			self.sent.append(e)
+			yield e, STATUS_SUCCESS
+
+
+def runBackfill(annotator, logger, tmp_path, sess):
+	selectorFile = str(tmp_path / 'selector.csv')
+	fixtures.writeSelector(selectorFile)
+	state = StateStore(str(tmp_path / 'state.db'))
+	plan = BackfillPlan(str(tmp_path / 'backfill.json'), START, END)
+	dispatcher = FakeDispatcher()
+	try:
+		annotator.backfill(sess, dispatcher, parseEventsSelector(logger, selectorFile), state, plan, 1, 2, 0, 1)
+	finally:
+		state.close()
+	return plan, dispatcher
+
+
+def test_failed_slice_stays_pending(annotator, logger, tmp_path):
+	plan, dispatcher = runBackfill(annotator, logger, tmp_path, FakeSession(failing = [ '2019-01-10T01:00:00' ]))
+	assert dispatcher.sent
+	assert plan.getPendingSlices() == [ ('2019-01-10T01:00:00', '2019-01-10T02:00:00') ]
+	assert plan.isDone('2019-01-10T00:00:00')
+	assert plan.isDone('2019-01-10T02:00:00')
+	assert plan.isDone(ECCU_WORK_ITEM)
+
+	# The next run only fetches the failed slice
+	plan, dispatcher = runBackfill(annotator, logger, tmp_path, FakeSession())
+	assert dispatcher.sent
+	assert plan.getPendingSlices() == []
+	assert plan.getProgress() == (4, 4)
+
+
+def test_failed_eccu_fetch_stays_pending(annotator, logger, tmp_path):
+
+	class FailingEccuSession(FakeSession):
+		def get(self, url, headers = None, stream = False, timeout = None):
+			if '/eccu-api/' in url:
+				return FakeResponse(500)
+			return FakeSession.get(self, url, headers, stream)
+
+	plan, dispatcher = runBackfill(annotator, logger, tmp_path, FailingEccuSession())
+	assert plan.getPendingSlices() == []
+	assert not plan.isDone(ECCU_WORK_ITEM)
@@ -0,0 +1,77 @@
+from coalescer import EventCoalescer, CoalescedEvent
+from event import Event
+
+
+class TimedEvent(Event):
+
+	__slots__ = ('time',)
+
+	SOURCE = 'eventviewer'
+
+	def __init__(self, eventId, time):
+		Event.__init__(self, eventId)
+		self.time = time
+
+	def getEventStartTime(self):
+		return str(self.time)
+
+	def getEventEndTime(self):
+		return None
+
+
+class OtherSourceEvent(TimedEvent):
+
+	__slots__ = ()
+
+	SOURCE = 'eccu'
+
+
+def timedEvents(times, eventClass = TimedEvent):
+	return [ eventClass(str(i), t) for i, t in enumerate(times) ]
+
+
+def idsOf(annotation):
+	return [ e.getEventId() for e in annotation.getEvents() ]
+
+
+def test_group_is_flushed_once_stream_time_is_past_its_window(logger):
+	coalescer = EventCoalescer(logger, lambda e: 60, maxLateness = 0)
+	received = []
+
+	def stream():
+		for e in timedEvents([ 1000, 1030, 1080, 5000, 5010, 9000 ]):
+			received.append(e.getEventId())
+			yield e
+
+	annotations = coalescer.coalesce(stream())
+	first = next(annotations)
+	# The first burst is published when the event at 5000 arrives, not at the end of the stream
+	assert isinstance(first, CoalescedEvent)
+	assert idsOf(first) == [ '0', '1', '2' ]
+	assert received == [ '0', '1', '2', '3' ]
+	second = next(annotations)
+	assert idsOf(second) == [ '3', '4' ]
+	assert received[-1] == '5'
+	assert [ idsOf(a) for a in annotations ] == [ [ '5' ] ]
+
+
+def test_late_events_join_their_group(logger):
+	coalescer = EventCoalescer(logger, lambda e: 60, maxLateness = 600)
+	annotations = list(coalescer.coalesce(timedEvents([ 1000, 1400, 1030, 1440, 1600, 1060 ])))
+	assert sorted(idsOf(a) for a in annotations) == [ [ '0', '2', '5' ], [ '1', '3' ], [ '4' ] ]
+
+
+def test_stream_time_is_kept_per_source(logger):
+	coalescer = EventCoalescer(logger, lambda e: 60, maxLateness = 0)
+	events = timedEvents([ 1000, 1030 ]) + timedEvents([ 9000 ], OtherSourceEvent) + [ TimedEvent('3', 1060) ]
+	annotations = list(coalescer.coalesce(events))
+	assert sorted(idsOf(a) for a in annotations) == [ [ '0' ], [ '0', '1', '3' ] ]
+
+
+def test_every_event_is_published_once(logger):
+	times = [ (i * 37) % 5000 + (i // 50) * 3000 for i in range(1000) ]
+	coalescer = EventCoalescer(logger, lambda e: 20, maxPending = 100)
+	annotations = list(coalescer.coalesce(timedEvents(times)))
+	ids = [ i for a in annotations for i in idsOf(a) ]
+	assert sorted(ids) == sorted(str(i) for i in range(len(times)))
+	assert coalescer.getStats() == { 'events': 1000, 'annotations': len(annotations) }
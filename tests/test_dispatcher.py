@@ -0,0 +1,132 @@
+import datetime
+import email.utils
+
+import requests
+
+from dispatcher import AnnotationDispatcher, STATUS_SUCCESS, STATUS_RETRY, parseRetryAfter
+from tokenmanager import SecurityTokenManager
+
+
+class FakeResponse:
+
+	def __init__(self, status, headers = None):
+		self.status_code = status
+		self.headers = headers or {}
+
+
+class FakeMPulse:
+	"""mPulse API handler minting the tokens given, and accepting annotations sent with the valid token.
+	"""
+
+	simulate = False
+
+	def __init__(self, tokens, validToken):
+		self.tokens = list(tokens)
+		self.validToken = validToken
+		self.sentWith = []
+
+	def getSecurityToken(self, apiToken, tenant):
+		return self.tokens.pop(0) if self.tokens else None
+
+	def addAnnotation(self, token, title, text, start, end = None):
+		self.sentWith.append(token)
+		return FakeResponse(200 if token == self.validToken else 401)
+
+
+def dispatcherOf(logger, mpulse):
+	tokens = SecurityTokenManager(logger, mpulse, 'apiToken', 'tenant')
+	return AnnotationDispatcher(logger, mpulse, tokens, rate = 1000, burst = 1000), tokens
+
+
+def test_rejected_token_is_replaced(logger):
+	mpulse = FakeMPulse([ 'revoked', 'fresh' ], 'fresh')
+	dispatcher, tokens = dispatcherOf(logger, mpulse)
+	try:
+		assert dispatcher.dispatch('title', 'text', 1000) == STATUS_SUCCESS
+		assert mpulse.sentWith == [ 'revoked', 'fresh' ]
+	finally:
+		tokens.close()
+
+
+def test_failed_renewal_keeps_previous_token_and_is_retryable(logger):
+	mpulse = FakeMPulse([ 'revoked' ], 'fresh')
+	dispatcher, tokens = dispatcherOf(logger, mpulse)
+	try:
+		assert dispatcher.dispatch('title', 'text', 1000) == STATUS_RETRY
+		assert tokens.invalidate('revoked') is None
+		assert tokens.token == 'revoked'
+		# The next annotation requests a new token again
+		mpulse.tokens.append('fresh')
+		assert dispatcher.dispatch('title', 'text', 1000) == STATUS_SUCCESS
+		assert None not in mpulse.sentWith
+	finally:
+		tokens.close()
+
+
+def test_annotation_not_sent_without_token(logger):
+	mpulse = FakeMPulse([], 'fresh')
+	dispatcher, tokens = dispatcherOf(logger, mpulse)
+	try:
+		assert dispatcher.dispatch('title', 'text', 1000) == STATUS_RETRY
+		assert mpulse.sentWith == []
+	finally:
+		tokens.close()
+
+
+def test_retry_after_seconds_and_http_date(logger):
+	mpulse = FakeMPulse([], 'fresh')
+	dispatcher, tokens = dispatcherOf(logger, mpulse)
+	dispatcher.maxBackoff = 300.0
+	inTwoMinutes = email.utils.format_datetime(datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds = 120), usegmt = True)
+	assert dispatcher.getRetryDelay(FakeResponse(429, { 'Retry-After': '7' }), 1) == 7.0
+	assert 115 <= dispatcher.getRetryDelay(FakeResponse(429, { 'Retry-After': inTwoMinutes }), 1) <= 120
+	# A date in the past means no wait, a date too far away is capped
+	assert dispatcher.getRetryDelay(FakeResponse(503, { 'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT' }), 1) == 0.0
+	assert dispatcher.getRetryDelay(FakeResponse(503, { 'Retry-After': 'Fri, 31 Dec 2100 23:59:59 GMT' }), 1) == 300.0
+	# An invalid value falls back to the exponential backoff
+	assert 1.0 <= dispatcher.getRetryDelay(FakeResponse(503, { 'Retry-After': 'soon' }), 2) <= dispatcher.backoff * 2
+
+
+def test_parse_retry_after():
+	assert parseRetryAfter('120') == 120.0
+	assert parseRetryAfter('') is None
+	assert parseRetryAfter('Sun, 06 Nov 1994 08:49:37 GMT') < 0
+
+
+class UnreachableMPulse(FakeMPulse):
+	"""mPulse API handler timing out on the first requests.
+	"""
+
+	def __init__(self, failures):
+		FakeMPulse.__init__(self, [ 'token' ], 'token')
+		self.failures = failures
+
+	def addAnnotation(self, token, title, text, start, end = None):
+		if self.failures > 0:
+			self.failures -= 1
+			self.sentWith.append(None)
+			raise requests.ConnectTimeout('connect timed out')
+		return FakeMPulse.addAnnotation(self, token, title, text, start, end)
+
+
+def test_timeout_is_retried_with_backoff(logger):
+	mpulse = UnreachableMPulse(2)
+	tokens = SecurityTokenManager(logger, mpulse, 'apiToken', 'tenant')
+	dispatcher = AnnotationDispatcher(logger, mpulse, tokens, rate = 1000, burst = 1000, backoff = 0.01)
+	try:
+		assert dispatcher.dispatch('title', 'text', 1000) == STATUS_SUCCESS
+		assert mpulse.sentWith == [ None, None, 'token' ]
+		assert dispatcher.retries == 2
+	finally:
+		tokens.close()
+
+
+def test_timeouts_give_up_after_max_retries(logger):
+	mpulse = UnreachableMPulse(10)
+	tokens = SecurityTokenManager(logger, mpulse, 'apiToken', 'tenant')
+	dispatcher = AnnotationDispatcher(logger, mpulse, tokens, rate = 1000, burst = 1000, maxRetries = 2, backoff = 0.01)
+	try:
+		assert dispatcher.dispatch('title', 'text', 1000) == STATUS_RETRY
+		assert len(mpulse.sentWith) == 3
+	finally:
+		tokens.close()
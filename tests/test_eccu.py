@@ -0,0 +1,140 @@
+import io
+import json
+
+import pytest
+
+import fixtures
+from dispatcher import STATUS_SUCCESS
+from fetcher import FetchError
+from selector import parseEventsSelector
+from statestore import StateStore
+
+
+ETAG = '"v1"'
+LAST_MODIFIED = 'Thu, 10 Jan 2019 12:00:00 GMT'
+
+
+class FakeResponse:
+
+	def __init__(self, status, body = None, headers = None):
+		self.status_code = status
+		self.headers = headers or {}
+		self.raw = io.BytesIO(json.dumps(body).encode('utf-8') if body is not None else b'')
+
+	def close(self):
+		pass
+
+
+class EccuSession:
+	"""Answer ECCU with the requests given (HTTP 304 to a conditional request with the current ETag),
+	or with the status given, and EventViewer with no event.
+	"""
+
+	def __init__(self, requests):
+		self.requests = requests
+		self.status = 200
+		self.conditional = []
+
+	def get(self, url, headers = None, stream = False, timeout = None):
+		if '/eccu-api/' not in url:
+			return FakeResponse(200, { 'events': [] })
+		self.conditional.append(dict(headers or {}))
+		if self.status != 200:
+			return FakeResponse(self.status)
+		if (headers or {}).get('If-None-Match') == ETAG:
+			return FakeResponse(304)
+		return FakeResponse(200, { 'requests': self.requests }, { 'ETag': ETAG, 'Last-Modified': LAST_MODIFIED })
+
+
+class FakeDispatcher:
+
+	def __init__(self):
+		self.sent = []
+
+	def dispatchEvents(self, events, workers):
+		for e in events:
+			self.sent.append(e)
+			yield e, STATUS_SUCCESS
+
+
+@pytest.fixture
+def selector(logger, tmp_path):
+	selectorFile = str(tmp_path / 'selector.csv')
+	fixtures.writeSelector(selectorFile)
+	return parseEventsSelector(logger, selectorFile)
+
+
+@pytest.fixture
+def state(tmp_path):
+	state = StateStore(str(tmp_path / 'state.db'))
+	yield state
+	state.close()
+
+
+def requestIds(events):
+	return [ e.getEventId() for e in events ]
+
+
+def test_unchanged_request_is_skipped_and_changed_request_is_emitted(annotator, state):
+	requests = fixtures.generateEccuRequests(3, matchRatio = 1.0)['requests']
+	requests[2]['status'] = 'PENDING'
+	index = {}
+	changes = []
+	assert list(annotator.newOrChangedECCURequests(requests, 0, index, changes)) == requests
+	state.saveEccuRequests(changes)
+
+	# Requested before the start time: unchanged requests are skipped before being parsed
+	start = annotator.isoToEpochSeconds(requests[-1]['requestDate']) + 1
+	requests[2]['status'] = 'SUCCEEDED'
+	changes = []
+	assert list(annotator.newOrChangedECCURequests(requests, start, state.getEccuRequests(), changes)) == [ requests[2] ]
+	assert changes == [ (str(requests[2]['requestId']), annotator.isoToEpochSeconds(requests[2]['requestDate']), 'SUCCEEDED') ]
+	state.saveEccuRequests(changes)
+	assert state.getEccuRequests()[str(requests[2]['requestId'])][1] == 'SUCCEEDED'
+
+
+def test_index_is_saved_with_the_events(annotator, state, selector):
+	requests = fixtures.generateEccuRequests(4, matchRatio = 1.0)['requests']
+	sess = EccuSession(requests)
+	events = annotator.getECCUEvents(sess, '0', selector, state)
+	assert requestIds(events) == [ str(r['requestId']) for r in requests ]
+	assert set(state.getEccuRequests()) == set(requestIds(events))
+	# Not conditional: the validators are not saved
+	assert state.getValidators('eccu') == (None, None)
+
+	events = annotator.getECCUEvents(sess, '0', selector, state, conditional = True)
+	assert len(events) == 4
+	assert state.getValidators('eccu') == (ETAG, LAST_MODIFIED)
+
+
+def test_not_modified_keeps_the_validators(annotator, state, selector):
+	sess = EccuSession(fixtures.generateEccuRequests(4, matchRatio = 1.0)['requests'])
+	annotator.getECCUEvents(sess, '0', selector, state, conditional = True)
+	assert annotator.getECCUEvents(sess, '0', selector, state, conditional = True) == []
+	assert sess.conditional[-1] == { 'If-None-Match': ETAG, 'If-Modified-Since': LAST_MODIFIED }
+	assert state.getValidators('eccu') == (ETAG, LAST_MODIFIED)
+
+
+def test_error_keeps_the_validators(annotator, state, selector):
+	sess = EccuSession(fixtures.generateEccuRequests(4, matchRatio = 1.0)['requests'])
+	annotator.getECCUEvents(sess, '0', selector, state, conditional = True)
+	sess.status = 503
+	with pytest.raises(FetchError):
+		annotator.getECCUEvents(sess, '0', selector, state, conditional = True)
+	assert state.getValidators('eccu') == (ETAG, LAST_MODIFIED)
+
+
+def test_failed_poll_keeps_the_validators(annotator, state, selector):
+	sess = EccuSession(fixtures.generateEccuRequests(4, matchRatio = 1.0)['requests'])
+	dispatcher = FakeDispatcher()
+	annotator.annotate(sess, dispatcher, selector, state, '2019-01-01T00:00:00', None, 1, 1, 0, 1)
+	assert len(dispatcher.sent) == 4
+	assert state.getValidators('eccu') == (ETAG, LAST_MODIFIED)
+
+	# The next polls are conditional: not modified, then failed
+	annotator.annotate(sess, dispatcher, selector, state, '2019-01-01T00:00:00', None, 1, 1, 0, 1)
+	sess.status = 503
+	annotator.annotate(sess, dispatcher, selector, state, '2019-01-01T00:00:00', None, 1, 1, 0, 1)
+	assert len(dispatcher.sent) == 4
+	assert [ headers.get('If-None-Match') for headers in sess.conditional ] == [ None, ETAG, ETAG ]
+	assert state.getValidators('eccu') == (ETAG, LAST_MODIFIED)
@@ -0,0 +1,91 @@
+import os
+import time
+import random
+import datetime
+
+import pytest
+
+import eventtime
+from eventtime import toEpochMillis, toEpochSeconds, fromEpochSeconds
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo = datetime.timezone.utc)
+
+OFFSETS = [ 'Z', '+0000', '+00:00', '-0500', '-05:00', '+0530', '+05:30', '+1400', '-1200', '-0930', '' ]
+
+
+def expectedMillis(date, pattern):
+	d = datetime.datetime.strptime(date, pattern)
+	if d.tzinfo is None:
+		d = d.replace(tzinfo = datetime.timezone.utc)
+	return (d - EPOCH) // datetime.timedelta(milliseconds = 1)
+
+
+def randomDates(count, seed = 0):
+	rnd = random.Random(seed)
+	dates = [ datetime.datetime(2020, 2, 29, 23, 59, 59, 999000), datetime.datetime(1970, 1, 1), datetime.datetime(2018, 12, 31, 23, 0, 0, 1000) ]
+	for i in range(count):
+		dates.append(datetime.datetime(1971, 1, 1) + datetime.timedelta(seconds = rnd.randint(0, 4000000000), microseconds = rnd.randint(0, 999) * 1000))
+	return dates
+
+
+@pytest.mark.parametrize('offset', OFFSETS)
+def test_dates_with_milliseconds(offset):
+	for d in randomDates(300):
+		date = d.strftime('%Y-%m-%dT%H:%M:%S.') + '%03d' % (d.microsecond // 1000) + offset
+		assert toEpochMillis(date) == expectedMillis(date, '%Y-%m-%dT%H:%M:%S.%f' + ('%z' if offset else '')), date
+
+
+@pytest.mark.parametrize('offset', OFFSETS)
+def test_dates_without_fraction(offset):
+	for d in randomDates(300, 1):
+		date = d.strftime('%Y-%m-%dT%H:%M:%S') + offset
+		assert toEpochMillis(date) == expectedMillis(date, '%Y-%m-%dT%H:%M:%S' + ('%z' if offset else '')), date
+		assert toEpochSeconds(date) == expectedMillis(date, '%Y-%m-%dT%H:%M:%S' + ('%z' if offset else '')) // 1000
+
+
+@pytest.mark.parametrize('fraction', [ '5', '12', '123', '1234', '123456' ])
+@pytest.mark.parametrize('offset', [ 'Z', '+0100', '-03:00', '' ])
+def test_fractions(fraction, offset):
+	date = '2019-01-10T09:00:00.' + fraction + offset
+	# Milliseconds are truncated, as the %f directive is
+	assert toEpochMillis(date) == expectedMillis(date, '%Y-%m-%dT%H:%M:%S.%f' + ('%z' if offset else ''))
+
+
+@pytest.mark.parametrize('date, pattern', [
+	('2019-01-10', '%Y-%m-%d'),
+	('2019-01-10 09:30:15', '%Y-%m-%d %H:%M:%S'),
+	('2019-01-10 09:30:15+02:00', '%Y-%m-%d %H:%M:%S%z'),
+	('2019-01-10T09:30', '%Y-%m-%dT%H:%M'),
+])
+def test_other_iso_formats(date, pattern):
+	assert toEpochMillis(date) == expectedMillis(date, pattern)
+
+
+@pytest.mark.parametrize('date', [ 'not a date', '2019-01-10T09:00:00+5', '2019-13-10T09:00:00Z', '2019-01-10T09:00:00.000+ab:cd' ])
+def test_invalid_dates(date):
+	with pytest.raises(ValueError):
+		toEpochMillis(date)
+
+
+def test_local_timezone_is_ignored():
+	date = '2019-03-31T01:30:00.000+0000'
+	previous = os.environ.get('TZ')
+	try:
+		for tz in ('Europe/Paris', 'America/New_York', 'UTC'):
+			os.environ['TZ'] = tz
+			time.tzset()
+			eventtime._hourCache.clear()
+			assert toEpochMillis(date) == 1553995800000
+	finally:
+		if previous is None:
+			del os.environ['TZ']
+		else:
+			os.environ['TZ'] = previous
+		time.tzset()
+
+
+def test_from_epoch_seconds():
+	for d in randomDates(100, 2):
+		date = d.strftime('%Y-%m-%dT%H:%M:%S')
+		assert fromEpochSeconds(toEpochSeconds(date)) == date
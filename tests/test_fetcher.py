@@ -0,0 +1,95 @@
+import io
+import json
+import time
+import threading
+
+import pytest
+import requests
+from urllib3.exceptions import ReadTimeoutError
+
+from fetcher import EventViewerFetcher, FetchError, DEFAULT_API_TIMEOUT
+
+
+class FakeResponse:
+
+	def __init__(self, status, body = None):
+		self.status_code = status
+		self.headers = {}
+		self.raw = io.BytesIO(json.dumps(body).encode('utf-8') if body is not None else b'')
+
+	def close(self):
+		pass
+
+
+class PagedSession:
+	"""Serve pages of events, the links of a page following its events as in EventViewer responses.
+	"""
+
+	def __init__(self, pages, failing = ()):
+		self.pages = pages
+		self.failing = failing
+		self.requested = {}
+
+	def get(self, url, stream = False, timeout = None):
+		assert timeout == DEFAULT_API_TIMEOUT
+		page = int(url.split('page=')[1]) if 'page=' in url else 0
+		self.requested[page] = time.monotonic()
+		if page in self.failing:
+			return FakeResponse(503)
+		body = { 'events': [ { 'eventId': '%d-%d' % (page, i) } for i in range(3) ] }
+		if page + 1 < self.pages:
+			body['links'] = [ { 'rel': 'next', 'href': '/event-viewer-api/v1/events?page=%d' % (page + 1) } ]
+		return FakeResponse(200, body)
+
+
+def test_next_page_is_requested_while_page_is_parsed(logger):
+	parsed = {}
+
+	def slowSelect(events):
+		events = list(events)
+		page = int(events[0]['eventId'].split('-')[0])
+		time.sleep(0.3)
+		parsed[page] = time.monotonic()
+		return events
+
+	sess = PagedSession(3)
+	fetcher = EventViewerFetcher(logger, sess, 'https://akab-test.luna.akamaiapis.net', 1, slowSelect)
+	pages = list(fetcher.getPages('2019-01-10T00:00:00'))
+	assert [ e['eventId'] for page in pages for e in page['events'] ] == [ '%d-%d' % (p, i) for p in range(3) for i in range(3) ]
+	# Page N+1 is requested before page N is parsed
+	assert sess.requested[1] < parsed[0]
+	assert sess.requested[2] < parsed[1]
+
+
+def test_failed_page_raises(logger):
+	fetcher = EventViewerFetcher(logger, PagedSession(3, failing = (1,)), 'https://akab-test.luna.akamaiapis.net', 2)
+	with pytest.raises(FetchError):
+		list(fetcher.getPages('2019-01-10T00:00:00'))
+
+
+class TimeoutSession:
+
+	def get(self, url, stream = False, timeout = None):
+		raise requests.Timeout('read timed out')
+
+
+class SlowBody:
+
+	def read(self, size = -1):
+		raise ReadTimeoutError(None, '/event-viewer-api/v1/events', 'read timed out')
+
+
+def test_timeout_is_a_failed_fetch(logger):
+	fetcher = EventViewerFetcher(logger, TimeoutSession(), 'https://akab-test.luna.akamaiapis.net', 1)
+	with pytest.raises(FetchError):
+		list(fetcher.getPages('2019-01-10T00:00:00'))
+
+
+def test_read_timeout_while_decoding_is_a_failed_fetch(logger):
+	response = FakeResponse(200)
+	response.raw = SlowBody()
+	sess = PagedSession(1)
+	sess.get = lambda url, stream = False, timeout = None: response
+	fetcher = EventViewerFetcher(logger, sess, 'https://akab-test.luna.akamaiapis.net', 1)
+	with pytest.raises(FetchError):
+		list(fetcher.getPages('2019-01-10T00:00:00'))
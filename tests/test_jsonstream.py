@@ -0,0 +1,41 @@
+import io
+import json
+
+import pytest
+
+import fixtures
+from jsonstream import JsonArrayReader
+
+
+# Strings with escapes, escaped and raw multibyte characters (2, 3 and 4 bytes in UTF-8), and numbers
+TRICKY_EVENTS = [
+	{ 'eventId': 'quote " backslash \\ slash / tab \t newline \n', 'value': -1.5e10 },
+	{ 'eventId': 'café 日本語 \U0001f600', 'value': 1234567890123 },
+	{ 'eventId': '', 'value': 0, 'list': [ 1, 2.5, -3, True, None, {} ], 'nested': { 'a': [ [], {} ] } },
+	{ 'eventId': '\\u0041 is not A', 'value': 0.001 },
+]
+
+
+def documents():
+	page = next(fixtures.generateEventViewerPages(20, 20))
+	for ensureAscii in (True, False):
+		yield json.dumps({ 'events': TRICKY_EVENTS, 'links': [ { 'rel': 'next', 'href': '/next' } ], 'total': 12345 }, ensure_ascii = ensureAscii)
+		yield json.dumps({ 'total': -42.5, 'events': TRICKY_EVENTS + page['events'] }, ensure_ascii = ensureAscii, indent = 2)
+	yield '{"events":[]}'
+	yield '{ "links" : [ ] , "events" : [ 1 , 22 , 333 ] }'
+
+
+@pytest.mark.parametrize('chunkSize', [ 1, 2, 3, 4, 5, 7, 13, 64, 65536 ])
+@pytest.mark.parametrize('document', list(documents()))
+def test_chunk_boundaries(document, chunkSize):
+	expected = json.loads(document)
+	reader = JsonArrayReader(io.BytesIO(document.encode('utf-8')), 'events', chunkSize)
+	assert list(reader) == expected.pop('events')
+	assert reader.fields == expected
+	assert reader.count == len(json.loads(document)['events'])
+
+
+@pytest.mark.parametrize('document', [ '', '[]', '{"events": [1, 2', '{"events": ["unterminated', '{"events": [1 2]}', '{"events": [1], "total": }' ])
+def test_invalid_documents(document):
+	with pytest.raises(ValueError):
+		list(JsonArrayReader(io.BytesIO(document.encode('utf-8')), 'events', 3))
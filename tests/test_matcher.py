@@ -0,0 +1,59 @@
+import random
+
+import pytest
+
+from matcher import AhoCorasick, CriteriaMatcher, AHO_CORASICK_MIN_PATTERNS
+
+
+def naiveSearch(patterns, text):
+	return any(p in text for p in patterns)
+
+
+@pytest.mark.parametrize('patterns, text, expected', [
+	# Nested patterns: one pattern is a prefix, suffix or infix of another
+	([ 'he', 'she', 'his', 'hers' ], 'ushers', True),
+	([ 'abcd', 'bc' ], 'xbcx', True),
+	([ 'abcd', 'bcx' ], 'abcx', True),
+	([ 'abcd', 'cd' ], 'abcx', False),
+	# Overlapping patterns: the failure links must resume inside a partial match
+	([ 'aab', 'aaab' ], 'aaaab', True),
+	([ 'abab', 'babb' ], 'ababb', True),
+	([ 'abcabd' ], 'abcabcabd', True),
+	([ 'abcabd' ], 'abcabcab', False),
+	([ 'www.customerdomain.com', 'customerdomain.com.au' ], 'https://static.customerdomain.com/x', False),
+	([ 'x' ], '', False),
+])
+def test_search(patterns, text, expected):
+	assert AhoCorasick(patterns).search(text) == expected
+	assert naiveSearch(patterns, text) == expected
+
+
+def test_search_against_naive_matcher():
+	rnd = random.Random(0)
+	for i in range(2000):
+		# A small alphabet makes overlapping and nested patterns likely
+		alphabet = 'ab' if i % 2 else 'abc'
+		patterns = [ ''.join(rnd.choice(alphabet) for j in range(rnd.randint(1, 6))) for k in range(rnd.randint(1, 8)) ]
+		text = ''.join(rnd.choice(alphabet) for j in range(rnd.randint(0, 12)))
+		assert AhoCorasick(patterns).search(text) == naiveSearch(patterns, text), (patterns, text)
+
+
+@pytest.mark.parametrize('count', [ 1, AHO_CORASICK_MIN_PATTERNS - 1, AHO_CORASICK_MIN_PATTERNS, 100 ])
+def test_criteria_matcher_against_naive_matcher(count):
+	rnd = random.Random(count)
+	patterns = [ str(rnd.randint(100000, 999999)) for i in range(count) ] + [ '1234', '12345' ]
+	matcher = CriteriaMatcher(';'.join(patterns))
+	assert (matcher.automaton is not None) == (len(set(patterns)) >= AHO_CORASICK_MIN_PATTERNS)
+	for i in range(500):
+		text = 'CP codes to Purge - ' + ', '.join(str(rnd.randint(100000, 999999)) for j in range(rnd.randint(0, 3)))
+		if i % 10 == 0:
+			text += rnd.choice(patterns)
+		assert matcher.containsAny(text) == naiveSearch(patterns, text)
+		assert matcher.equalsAny(text) == (text in patterns)
+
+
+def test_empty_pattern_matches_everything():
+	matcher = CriteriaMatcher('123;;456')
+	assert matcher.containsAny('')
+	assert matcher.containsAny('anything')
+	assert not CriteriaMatcher('123;456').containsAny('')
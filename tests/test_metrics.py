@@ -0,0 +1,15 @@
+import urllib.request
+
+from metrics import MetricsServer, MetricsRegistry
+
+
+def test_metrics_server_listens_on_loopback_by_default(logger):
+	metricsRegistry = MetricsRegistry()
+	server = MetricsServer(logger, 0, metricsRegistry = metricsRegistry)
+	try:
+		host, port = server.server.server_address[:2]
+		assert host == '127.0.0.1'
+		with urllib.request.urlopen('http://127.0.0.1:%d/metrics.json' % port) as response:
+			assert response.status == 200
+	finally:
+		server.close()
@@ -0,0 +1,53 @@
+import requests
+
+from mpulseapihandler import MPulseAPIHandler, DEFAULT_MPULSE_TIMEOUT
+
+
+class FakeResponse:
+
+	def __init__(self, status, body = None):
+		self.status_code = status
+		self.body = body
+
+	def json(self):
+		return self.body
+
+
+class FakeSession:
+
+	def __init__(self, response = None, error = None):
+		self.response = response
+		self.error = error
+		self.timeouts = []
+
+	def put(self, url, data = None, headers = None, timeout = None):
+		return self.request(timeout)
+
+	def post(self, url, data = None, headers = None, timeout = None):
+		return self.request(timeout)
+
+	def request(self, timeout):
+		self.timeouts.append(timeout)
+		if self.error is not None:
+			raise self.error
+		return self.response
+
+
+def handlerWith(logger, session):
+	mpulse = MPulseAPIHandler(logger)
+	mpulse.close()
+	mpulse.session = session
+	return mpulse
+
+
+def test_requests_are_sent_with_timeouts(logger):
+	session = FakeSession(FakeResponse(200, { 'token': 'abc' }))
+	mpulse = handlerWith(logger, session)
+	assert mpulse.getSecurityToken('apiToken', 'tenant') == 'abc'
+	assert mpulse.addAnnotation('abc', 'title', 'text', 1000).status_code == 200
+	assert session.timeouts == [ DEFAULT_MPULSE_TIMEOUT, DEFAULT_MPULSE_TIMEOUT ]
+
+
+def test_security_token_timeout_returns_none(logger):
+	mpulse = handlerWith(logger, FakeSession(error = requests.Timeout('read timed out')))
+	assert mpulse.getSecurityToken('apiToken', 'tenant') is None
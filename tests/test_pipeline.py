@@ -0,0 +1,52 @@
+from pipeline import SourceMerger, EventRouter
+
+
+def test_router_routes_items_to_their_consumers(logger):
+	router = EventRouter(logger, 2)
+	received = { 'even': [], 'all': [] }
+	for name in received:
+		router.addConsumer(name, lambda items, name = name: received[name].extend(items) or len(received[name]))
+	results = router.route(range(10), lambda i: [ 'even', 'all' ] if i % 2 == 0 else [ 'all' ])
+	assert received == { 'even': [ 0, 2, 4, 6, 8 ], 'all': list(range(10)) }
+	assert results == { 'even': 5, 'all': 10 }
+	assert { name: stats['events'] for name, stats in router.getStats().items() } == { 'even': 5, 'all': 10 }
+
+
+def test_router_shares_items_between_consumers(logger):
+	router = EventRouter(logger)
+	received = { 'a': [], 'b': [] }
+	for name in received:
+		router.addConsumer(name, lambda items, name = name: received[name].extend(items))
+	items = [ object() for i in range(3) ]
+	router.route(items, lambda item: [ 'a', 'b' ])
+	assert all(x is y for x, y in zip(received['a'], received['b']))
+
+
+def test_failed_consumer_does_not_block_the_others(logger):
+	router = EventRouter(logger, 1)
+	received = []
+
+	def failing(items):
+		next(iter(items))
+		raise RuntimeError('mPulse is down')
+
+	router.addConsumer('failing', failing)
+	router.addConsumer('working', lambda items: received.extend(items) or len(received))
+	results = router.route(range(100), lambda i: [ 'failing', 'working' ])
+	assert received == list(range(100))
+	assert results == { 'working': 100 }
+	assert router.getStats()['failing']['error'] == 'mPulse is down'
+
+
+def test_merger_isolates_failed_sources(logger):
+	def failing():
+		yield 1
+		raise RuntimeError('API error')
+
+	merger = SourceMerger(logger, 2)
+	merger.addSource('failing', failing)
+	merger.addSource('working', lambda: range(10, 20))
+	assert sorted(merger) == [ 1 ] + list(range(10, 20))
+	stats = merger.getStats()
+	assert stats['failing']['error'] == 'API error' and not stats['failing']['done']
+	assert stats['working']['done'] and stats['working']['events'] == 10
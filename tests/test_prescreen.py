@@ -0,0 +1,47 @@
+import pytest
+
+import fixtures
+from matcher import CriteriaMatcher
+from selector import EVENT_CLASSES
+
+
+def rawEvents(definition):
+	"""Return the generated raw events of an event definition, half of them matching the selector of the fixtures.
+	"""
+	if definition == fixtures.ECCU_SELECTOR:
+		return fixtures.generateEccuRequests(500, seed = 3, matchRatio = 0.5)['requests']
+	return [ event for event in fixtures.generateEventViewerEvents(4000, seed = 3, matchRatio = 0.5)
+		if event['eventType']['eventDefinition']['eventDefinitionId'] == definition ]
+
+
+def criteriaOf(row):
+	patterns = row[2].split(';')
+	return [
+		row[2],
+		# A single pattern, a pattern matching a part of a value only, and no criteria at all
+		patterns[0],
+		patterns[0][:4],
+		'',
+	]
+
+
+@pytest.mark.parametrize('row', fixtures.selectorRows(), ids = lambda row: row[1])
+def test_match_implies_prescreen(row):
+	eventClass = EVENT_CLASSES[row[1]]
+	events = rawEvents(row[0])
+	assert events
+	for criteria in criteriaOf(row):
+		matcher = CriteriaMatcher(criteria)
+		matched = 0
+		prescreened = 0
+		for event in events:
+			e = eventClass()
+			e.parseJson(event)
+			if e.matchCriteria(matcher):
+				matched += 1
+				assert eventClass.prescreen(event, matcher), (criteria, event)
+			if eventClass.prescreen(event, matcher):
+				prescreened += 1
+		if criteria == row[2]:
+			# Half of the events match the selector, the other half is dropped by prescreen
+			assert 0 < matched == prescreened < len(events)
@@ -0,0 +1,83 @@
+import os
+import logging
+import threading
+
+from event import FastPurgeUrlEvent, PropertyManagerEvent
+from selector import SelectorIndex, snapshotOf
+
+
+def writeSelector(filename, version, rows = None):
+	"""Write an events selector whose criteria all name the same version, and move its modification time forward.
+	"""
+	if rows is None:
+		rows = [ '894488,FastPurgeUrlEvent,www%d.example.com' % version, '168296,PropertyManagerEvent,shop%d.example.com' % version ]
+	with open(filename, mode='w') as outfile:
+		outfile.write('# version %d\n' % version)
+		for row in rows:
+			outfile.write(row + '\n')
+	mtime = 1500000000 + version
+	os.utime(filename, (mtime, mtime))
+
+
+def test_changed_mtime_reloads_the_selector(logger, tmp_path):
+	filename = str(tmp_path / 'selector.csv')
+	writeSelector(filename, 1)
+	index = SelectorIndex(logger, filename)
+	before = index.snapshot()
+	assert not index.reloadIfChanged()
+	writeSelector(filename, 2)
+	assert index.reloadIfChanged()
+	after = index.snapshot()
+	assert after is not before
+	assert after['894488'][0] is FastPurgeUrlEvent and after['894488'][1].criteria == 'www2.example.com'
+	assert after['168296'][0] is PropertyManagerEvent and after['168296'][1].criteria == 'shop2.example.com'
+	# The previous snapshot is never modified
+	assert before['894488'][1].criteria == 'www1.example.com'
+	assert snapshotOf(index) is after
+
+
+def test_selector_that_fails_to_parse_keeps_previous_snapshot(logger, tmp_path, caplog):
+	filename = str(tmp_path / 'selector.csv')
+	writeSelector(filename, 1)
+	index = SelectorIndex(logger, filename)
+	before = index.snapshot()
+	# A row without event class nor criteria cannot be parsed
+	writeSelector(filename, 2, [ '894488,FastPurgeUrlEvent,www2.example.com', '168296' ])
+	with caplog.at_level(logging.ERROR, logger = logger.name):
+		assert not index.reloadIfChanged()
+	assert index.snapshot() is before
+	assert any('unable to reload events selector' in record.getMessage() for record in caplog.records)
+	# The file is not parsed again until it is modified
+	assert not index.reloadIfChanged()
+	writeSelector(filename, 3)
+	assert index.reloadIfChanged()
+	assert index['894488'][1].criteria == 'www3.example.com'
+
+
+def test_readers_see_a_whole_snapshot(logger, tmp_path):
+	filename = str(tmp_path / 'selector.csv')
+	writeSelector(filename, 0)
+	index = SelectorIndex(logger, filename)
+	stop = threading.Event()
+	mixed = []
+
+	def read():
+		while not stop.is_set():
+			snapshot = index.snapshot()
+			versions = set(criteria.criteria.split('.')[0][-1] for eventClass, criteria, window in snapshot.values())
+			if len(versions) != 1 or len(snapshot) != 2:
+				mixed.append(versions)
+
+	readers = [ threading.Thread(target = read) for i in range(4) ]
+	for reader in readers:
+		reader.start()
+	try:
+		for version in range(1, 10):
+			writeSelector(filename, version)
+			assert index.reloadIfChanged()
+	finally:
+		stop.set()
+		for reader in readers:
+			reader.join()
+	assert mixed == []
+	assert index.snapshot()['168296'][1].criteria == 'shop9.example.com'
@@ -0,0 +1,138 @@
+import sqlite3
+
+import fixtures
+from dispatcher import STATUS_SUCCESS, STATUS_RETRY
+from event import EccuEvent
+from spool import AnnotationSpool
+from statestore import StateStore
+
+
+class LockedStateStore(StateStore):
+	"""A state store whose spool cannot be written (e.g. database locked by another process).
+	"""
+
+	def spoolAnnotation(self, *args):
+		raise sqlite3.OperationalError('database is locked')
+
+
+class UnsettledStateStore(StateStore):
+	"""A state store whose spool cannot be updated once an annotation is sent.
+	"""
+
+	def unspoolAnnotation(self, spoolId):
+		raise sqlite3.OperationalError('database is locked')
+
+
+class FakeDispatcher:
+
+	def __init__(self):
+		self.sent = []
+
+	def dispatchEvents(self, events, workers):
+		for e in events:
+			self.sent.append(e)
+			yield e, STATUS_SUCCESS
+
+
+def eccuEvents(count):
+	events = []
+	for request in fixtures.generateEccuRequests(count)['requests']:
+		e = EccuEvent()
+		e.parseJson(request)
+		events.append(e)
+	return events
+
+
+def test_annotation_is_spooled(logger, tmp_path):
+	state = StateStore(str(tmp_path / 'state.db'))
+	try:
+		e = eccuEvents(1)[0]
+		spoolId = AnnotationSpool(logger, state).add(e, [ ('eccu', e.getEventId()) ])
+		assert spoolId is not None
+		assert state.isPublished('eccu', e.getEventId())
+		assert state.getSpoolCounts() == (1, 0)
+	finally:
+		state.close()
+
+
+def test_annotation_sent_without_spooling_when_spool_fails(annotator, logger, tmp_path):
+	state = LockedStateStore(str(tmp_path / 'state.db'))
+	try:
+		spool = AnnotationSpool(logger, state)
+		events = eccuEvents(3)
+		assert spool.add(events[0], [ ('eccu', events[0].getEventId()) ]) is None
+		dispatcher = FakeDispatcher()
+		results = annotator.publishEvents(dispatcher, events, 1, state, spool = spool)
+		assert results[STATUS_SUCCESS] == 3
+		assert dispatcher.sent == events
+		# Annotations sent without spooling are recorded as published once sent
+		assert all(state.isPublished('eccu', e.getEventId()) for e in events)
+	finally:
+		state.close()
+
+
+class RacingStateStore(StateStore):
+	"""A state store running another run once, after the events were checked but before they are claimed.
+	"""
+
+	race = None
+
+	def runRace(self):
+		if self.race is not None:
+			race, self.race = self.race, None
+			race()
+
+	def claimPublished(self, published):
+		self.runRace()
+		return StateStore.claimPublished(self, published)
+
+	def spoolAnnotation(self, *args):
+		self.runRace()
+		return StateStore.spoolAnnotation(self, *args)
+
+
+class FailingDispatcher:
+
+	def dispatchEvents(self, events, workers):
+		for e in events:
+			yield e, STATUS_RETRY
+
+
+def test_overlapping_runs_send_an_annotation_once(annotator, logger, tmp_path):
+	for spooled in (True, False):
+		filename = str(tmp_path / ('state-%s.db' % spooled))
+		first, second = RacingStateStore(filename), StateStore(filename)
+		try:
+			events = eccuEvents(3)
+			dispatcher, other = FakeDispatcher(), FakeDispatcher()
+			first.race = lambda: annotator.publishEvents(other, events, 1, second, spool = AnnotationSpool(logger, second) if spooled else None)
+			annotator.publishEvents(dispatcher, events, 1, first, spool = AnnotationSpool(logger, first) if spooled else None)
+			assert other.sent == events
+			assert dispatcher.sent == []
+			assert all(first.isPublished('eccu', e.getEventId()) for e in events)
+		finally:
+			first.close()
+			second.close()
+
+
+def test_claim_is_released_when_annotation_is_not_sent(annotator, tmp_path):
+	state = StateStore(str(tmp_path / 'state.db'))
+	try:
+		events = eccuEvents(2)
+		results = annotator.publishEvents(FailingDispatcher(), events, 1, state)
+		assert results[STATUS_RETRY] == 2
+		assert not any(state.isPublished('eccu', e.getEventId()) for e in events)
+	finally:
+		state.close()
+
+
+def test_spool_update_error_is_logged(annotator, logger, tmp_path):
+	state = UnsettledStateStore(str(tmp_path / 'state.db'))
+	try:
+		events = eccuEvents(2)
+		results = annotator.publishEvents(FakeDispatcher(), events, 1, state, spool = AnnotationSpool(logger, state))
+		assert results[STATUS_SUCCESS] == 2
+		# The annotations stay in the spool
+		assert state.getSpoolCounts() == (2, 0)
+	finally:
+		state.close()
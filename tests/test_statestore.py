@@ -0,0 +1,117 @@
+import random
+
+import pytest
+
+from statestore import StateStore
+
+
+@pytest.fixture
+def state(tmp_path):
+	state = StateStore(str(tmp_path / 'state.db'))
+	yield state
+	state.close()
+
+
+def test_checkpoint_never_moves_backwards(state):
+	assert state.getCheckpoint('eventviewer') is None
+	state.setCheckpoint('eventviewer', 1000)
+	state.setCheckpoint('eventviewer', 900)
+	assert state.getCheckpoint('eventviewer') == 1000
+	state.setCheckpoint('eventviewer', 1100)
+	assert state.getCheckpoint('eventviewer') == 1100
+	# Sources are independent
+	state.setCheckpoint('eccu', 10)
+	assert state.getCheckpoint('eventviewer') == 1100
+
+
+def test_checkpoint_moves_to_last_event_done(state):
+	for eventTime in (1003, 1001, 1002):
+		state.trackEvent('eventviewer', eventTime, True)
+	assert not state.hasPending('eventviewer')
+	assert state.saveCheckpoint('eventviewer') == 1003
+	assert state.getCheckpoint('eventviewer') == 1003
+	# The progress is reset once saved
+	assert state.saveCheckpoint('eventviewer') is None
+
+
+def test_checkpoint_stops_at_first_pending_event(state):
+	state.trackEvent('eventviewer', 1001, True)
+	state.trackEvent('eventviewer', 1005, False)
+	state.trackEvent('eventviewer', 1003, False)
+	state.trackEvent('eventviewer', 1009, True)
+	assert state.hasPending('eventviewer')
+	assert state.saveCheckpoint('eventviewer') == 1003
+	assert state.getCheckpoint('eventviewer') == 1003
+
+
+def test_pending_event_older_than_checkpoint(state):
+	state.setCheckpoint('eventviewer', 2000)
+	state.trackEvent('eventviewer', 1500, False)
+	state.trackEvent('eventviewer', 2500, True)
+	state.saveCheckpoint('eventviewer')
+	assert state.getCheckpoint('eventviewer') == 2000
+
+
+def test_random_progress(state):
+	rnd = random.Random(0)
+	checkpoint = None
+	for run in range(200):
+		events = [ (rnd.randint(0, 100000), rnd.random() < 0.9) for i in range(rnd.randint(0, 20)) ]
+		for eventTime, done in events:
+			state.trackEvent('eventviewer', eventTime, done)
+		pending = [ t for t, done in events if not done ]
+		completed = [ t for t, done in events if done ]
+		expected = min(pending) if pending else (max(completed) if completed else None)
+		assert state.saveCheckpoint('eventviewer') == expected
+		if expected is not None and (checkpoint is None or expected > checkpoint):
+			checkpoint = expected
+		assert state.getCheckpoint('eventviewer') == checkpoint
+
+
+def test_published_events(state):
+	assert not state.isPublished('eventviewer', 'a')
+	state.markPublished('eventviewer', 'a')
+	assert state.isPublished('eventviewer', 'a')
+	assert not state.isPublished('eccu', 'a')
+	assert not state.isPublished('shop/eventviewer', 'a')
+
+
+def test_events_are_claimed_once(state, tmp_path):
+	other = StateStore(str(tmp_path / 'state.db'))
+	try:
+		assert state.claimPublished([ ('eccu', 1), ('eccu', 2) ]) == [ ('eccu', 1), ('eccu', 2) ]
+		# An overlapping run only claims the events not claimed yet
+		assert other.claimPublished([ ('eccu', 1), ('eccu', 2) ]) == []
+		assert other.claimPublished([ ('eccu', 2), ('eccu', 3) ]) == [ ('eccu', 3) ]
+		assert state.isPublished('eccu', 3)
+		state.releasePublished([ ('eccu', 1) ])
+		assert not other.isPublished('eccu', 1)
+		assert other.claimPublished([ ('eccu', 1) ]) == [ ('eccu', 1) ]
+	finally:
+		other.close()
+
+
+def test_spooled_annotations_are_leased(state, tmp_path):
+	other = StateStore(str(tmp_path / 'state.db'))
+	try:
+		spoolId = state.spoolAnnotation('', 'title', 'text', 1000, None, [ ('eccu', 1) ])
+		# The events of a spooled annotation cannot be spooled again
+		assert other.spoolAnnotation('', 'title', 'text', 1000, None, [ ('eccu', 1) ]) is None
+		assert [ row[0] for row in state.getSpooledAnnotations('', now = 100, lease = 60) ] == [ spoolId ]
+		assert other.getSpooledAnnotations('', now = 100) == []
+		# The lease expires (the run holding it stopped)
+		assert [ row[0] for row in other.getSpooledAnnotations('', now = 161) ] == [ spoolId ]
+		state.releaseSpooledAnnotations([ spoolId ], now = 100)
+		assert [ row[0] for row in other.getSpooledAnnotations('', now = 100) ] == [ spoolId ]
+		assert state.getSpoolCounts() == (1, 0)
+	finally:
+		other.close()
+
+
+def test_failed_transaction_is_rolled_back(state):
+	with pytest.raises(ValueError):
+		state.saveEccuRequests([ ('1', 100, 'SUCCEEDED'), ('2', 200) ])
+	assert not state.db.in_transaction
+	assert state.getEccuRequests() == {}
+	state.saveEccuRequests([ ('3', 300, 'SUCCEEDED') ])
+	assert state.getEccuRequests() == { '3': (300, 'SUCCEEDED') }
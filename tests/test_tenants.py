@@ -0,0 +1,119 @@
+import os
+
+import fixtures
+from dispatcher import STATUS_SUCCESS
+from event import EccuEvent, PropertyManagerEvent
+from statestore import StateStore
+from tenants import Tenant, TenantSelector
+
+
+class FakeDispatcher:
+
+	def __init__(self):
+		self.sent = []
+
+	def dispatchEvents(self, events, workers):
+		for e in events:
+			self.sent.append(e)
+			yield e, STATUS_SUCCESS
+
+
+def writeSelector(filename, rows):
+	with open(filename, mode='w') as outfile:
+		for row in rows:
+			outfile.write(','.join(row) + '\n')
+
+
+def makeTenants(logger, tmp_path, selectors):
+	tenants = []
+	for name, rows in selectors:
+		selectorFile = str(tmp_path / (name + '-selector.csv'))
+		writeSelector(selectorFile, rows)
+		tenant = Tenant(logger, name, 'apiToken', name, selectorFile, 1.0, 1, 0, str(tmp_path / (name + '-token.json')))
+		tenant.dispatcher = FakeDispatcher()
+		tenants.append(tenant)
+	return tenants
+
+
+def eccuEvent(requestId, propertyName):
+	request = fixtures.generateEccuRequests(1, matchRatio = 1.0)['requests'][0]
+	request['requestId'] = requestId
+	request['requestName'] = 'bulk'
+	request['propertyName'] = propertyName
+	e = EccuEvent()
+	e.parseJson(request)
+	return e
+
+
+def test_union_selector_routes_to_tenant_criteria(logger, tmp_path):
+	tenants = makeTenants(logger, tmp_path, [
+		('shop', [ [ '000001', 'EccuEvent', 'shop.example.com' ], [ fixtures.PROPERTY_MANAGER_DEFINITION, 'PropertyManagerEvent', '' ] ]),
+		('blog', [ [ '000001', 'EccuEvent', 'blog.example.com' ] ]),
+	])
+	selector = TenantSelector(logger, tenants)
+	try:
+		assert set(selector) == { '000001', fixtures.PROPERTY_MANAGER_DEFINITION }
+		eventClass, criteria, window = selector['000001']
+		assert eventClass is EccuEvent
+		assert criteria.equalsAny('shop.example.com') and criteria.equalsAny('blog.example.com')
+		assert [ tenant.name for tenant, criteria in selector.routesOf('000001') ] == [ 'shop', 'blog' ]
+		assert [ tenant.name for tenant, criteria in selector.routesOf(fixtures.PROPERTY_MANAGER_DEFINITION) ] == [ 'shop' ]
+		assert selector.routesOf('999999') == ()
+		# An empty criteria of a tenant selects every event of the class
+		assert selector[fixtures.PROPERTY_MANAGER_DEFINITION][0] is PropertyManagerEvent
+		assert selector[fixtures.PROPERTY_MANAGER_DEFINITION][1].isEmpty()
+	finally:
+		selector.close()
+
+
+def test_union_selector_is_rebuilt_when_a_tenant_selector_is_reloaded(logger, tmp_path):
+	tenants = makeTenants(logger, tmp_path, [
+		('shop', [ [ '000001', 'EccuEvent', 'shop.example.com' ] ]),
+		('blog', [ [ '000001', 'EccuEvent', 'blog.example.com' ] ]),
+	])
+	selector = TenantSelector(logger, tenants)
+	try:
+		before = selector.snapshot()
+		writeSelector(tenants[1].selector.csvfile, [ [ '000001', 'EccuEvent', 'news.example.com' ] ])
+		stat = os.stat(tenants[1].selector.csvfile)
+		os.utime(tenants[1].selector.csvfile, ns = (stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+		assert tenants[1].selector.reloadIfChanged()
+		after = selector.snapshot()
+		assert after is not before
+		assert after['000001'][1].equalsAny('news.example.com')
+		assert not after['000001'][1].equalsAny('blog.example.com')
+	finally:
+		selector.close()
+
+
+def test_eccu_events_are_aggregated_per_tenant(annotator, logger, tmp_path):
+	tenants = makeTenants(logger, tmp_path, [
+		('shop', [ [ '000001', 'EccuEvent', 'shop.example.com' ] ]),
+		('blog', [ [ '000001', 'EccuEvent', 'blog.example.com;shop.example.com' ] ]),
+	])
+	selector = TenantSelector(logger, tenants)
+	state = StateStore(str(tmp_path / 'state.db'))
+	try:
+		# Same request name, requestor and times: the events of a tenant are aggregated
+		events = [ eccuEvent(1, 'shop.example.com'), eccuEvent(2, 'blog.example.com'), eccuEvent(3, 'shop.example.com') ]
+		routes = {}
+		aggregated = annotator.aggregateTenantECCUEvents(selector, events, 0, routes)
+		results, complete = annotator.publishTenantEvents(tenants, selector, aggregated, 1, state, routes = routes)
+		assert complete
+		assert routes == {}
+
+		shop, blog = [ tenant.dispatcher.sent for tenant in tenants ]
+		assert len(shop) == 1
+		assert [ e.getEventId() for e in shop[0].getEvents() ] == [ '1', '3' ]
+		assert 'shop.example.com, shop.example.com' in shop[0].getAnnotationText()
+		assert len(blog) == 1
+		assert [ e.getEventId() for e in blog[0].getEvents() ] == [ '1', '2', '3' ]
+		# The events fetched are not modified
+		assert [ e.getPropertyName() for e in events ] == [ 'shop.example.com', 'blog.example.com', 'shop.example.com' ]
+
+		assert state.isPublished('shop/eccu', '1') and state.isPublished('shop/eccu', '3')
+		assert not state.isPublished('shop/eccu', '2')
+		assert all(state.isPublished('blog/eccu', eventId) for eventId in ('1', '2', '3'))
+	finally:
+		state.close()
+		selector.close()
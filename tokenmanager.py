@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+
+# mPulse security tokens expire after 5 hours
+DEFAULT_TOKEN_LIFETIME = 5 * 3600
+
+# The token is refreshed this number of seconds before it expires
+DEFAULT_REFRESH_MARGIN = 600
+
+
+class SecurityTokenManager:
+	"""
+	Provide a valid mPulse security token. The token is cached on disk with its
+	expiry time so that it can be reused by the next runs, and it is refreshed in
+	the background before it expires. A token rejected by mPulse can be invalidated
+	to get a new one (see invalidate).
+	"""
+
+	def __init__(self, logger, mpulse, apiToken, tenant, cacheFile = None, lifetime = DEFAULT_TOKEN_LIFETIME, refreshMargin = DEFAULT_REFRESH_MARGIN):
+		"""
+		:param logger: the logger
+		:param mpulse: the mPulse API handler used to request security tokens
+		:type mpulse: a MPulseAPIHandler object
+		:param apiToken: mPulse API token
+		:type apiToken: a String
+		:param tenant: mPulse tenant
+		:type tenant: a String
+		:param cacheFile: (optional) path and file name of the token cache, no cache if None
+		:type cacheFile: a String
+		:param lifetime: number of seconds a security token is valid
+		:type lifetime: an int
+		:param refreshMargin: number of seconds before expiry the token is refreshed
+		:type refreshMargin: an int
+		"""
+		self.logger = logger
+		self.mpulse = mpulse
+		self.apiToken = apiToken
+		self.tenant = tenant
+		self.cacheFile = cacheFile
+		self.lifetime = lifetime
+		self.refreshMargin = min(refreshMargin, lifetime / 2)
+		# The cache is only valid for the same API token and tenant
+		self.cacheKey = hashlib.sha256((apiToken + '\n' + tenant).encode('utf-8')).hexdigest()
+		self.lock = threading.Lock()
+		self.token = None
+		self.expires = 0
+		self.timer = None
+		self._loadCache()
+
+	def _loadCache(self):
+		if self.cacheFile is None or not os.path.isfile(self.cacheFile):
+			return
+		try:
+			with open(self.cacheFile, mode='r') as infile:
+				data = json.load(infile)
+			if data['key'] == self.cacheKey and data['expires'] - self.refreshMargin > time.time():
+				self.token = data['token']
+				self.expires = data['expires']
+				self.logger.info('mPulse security token loaded from cache %s', self.cacheFile)
+		except (ValueError, KeyError, OSError) as e:
+			self.logger.error('Unable to read mPulse security token cache %s: %s', self.cacheFile, e)
+
+	def _saveCache(self):
+		if self.cacheFile is None:
+			return
+		try:
+			directory = os.path.dirname(self.cacheFile)
+			if directory and not os.path.isdir(directory):
+				os.makedirs(directory)
+			tmpFile = self.cacheFile + '.tmp'
+			fd = os.open(tmpFile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+			with os.fdopen(fd, mode='w') as outfile:
+				json.dump({ 'key': self.cacheKey, 'token': self.token, 'expires': self.expires }, outfile)
+			os.replace(tmpFile, self.cacheFile)
+		except OSError as e:
+			self.logger.error('Unable to write mPulse security token cache %s: %s', self.cacheFile, e)
+
+	def _refresh(self):
+		# Must be called with the lock held, returns False if no new token was returned
+		token = self.mpulse.getSecurityToken(self.apiToken, self.tenant)
+		if token is None:
+			return False
+		self.token = token
+		self.expires = time.time() + self.lifetime
+		self._saveCache()
+		return True
+
+	def _schedule(self):
+		# Must be called with the lock held
+		if self.timer is not None:
+			self.timer.cancel()
+		delay = max(0, self.expires - self.refreshMargin - time.time())
+		self.timer = threading.Timer(delay, self._backgroundRefresh)
+		self.timer.daemon = True
+		self.timer.start()
+
+	def _backgroundRefresh(self):
+		with self.lock:
+			self.logger.info('refreshing mPulse security token before it expires')
+			self._refresh()
+			if self.token is not None and self.expires - self.refreshMargin > time.time():
+				self._schedule()
+
+	def getToken(self):
+		"""Return a valid security token, requesting a new one if needed.
+		:returns: a String with the security token, None in case of error
+		"""
+		with self.lock:
+			if self.token is None or self.expires - self.refreshMargin <= time.time():
+				self._refresh()
+				if self.token is not None:
+					self._schedule()
+			elif self.timer is None:
+				self._schedule()
+			return self.token
+
+	def invalidate(self, token):
+		"""Replace a token rejected by mPulse (e.g. HTTP 401) by a new one.
+		Nothing is done if the token was already replaced by another thread. If no new token
+		can be obtained, the rejected token is kept but marked as expired, so that the next
+		call to getToken requests a new one again.
+		:param token: the rejected token
+		:type token: a String
+		:returns: the new security token, None in case of error
+		"""
+		with self.lock:
+			if token == self.token:
+				self.logger.info('mPulse security token rejected, requesting a new one')
+				# An exception raised by the request leaves the rejected token expired as well
+				self.expires = 0
+				if not self._refresh():
+					self.logger.error('unable to replace the mPulse security token rejected by mPulse')
+					return None
+				self._schedule()
+			return self.token
+
+	def close(self):
+		"""Stop the background refresh.
+		"""
+		with self.lock:
+			if self.timer is not None:
+				self.timer.cancel()
+				self.timer = None